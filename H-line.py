@@ -1,11 +1,12 @@
 import contextlib
 import os, sys, json
-from time import sleep
+from time import monotonic
 from datetime import datetime, timedelta
 
 # Import necessary classes/modules
 sys.path.append("src/")
 from observation import Observation as obs
+from scheduler import Scheduler
 
 
 # Main method
@@ -33,43 +34,107 @@ def main(config):
             quit()
     else:
         num_data = 1
+        second_interval = 0
 
     # Do observation(s)
-    # Start time of observation
-    current_time = datetime.utcnow()
-    for i in range(num_data):
-        COORD_CLASS = Observation.getCoordinates(current_time + timedelta(seconds = 24*60**2/num_data * i), **OBSERVER_PARAM)
-        print(current_time + timedelta(seconds = 24*60**2/num_data * i))
+    # The observations start at fixed times. An interrupted 24h observation is resumed from the state file
+    SCHEDULER = Scheduler(num_data, second_interval, OBSERVATION_PARAM["overrun_policy"], OBSERVATION_PARAM["prepare_ahead"], OBSERVATION_PARAM["state_file"] if num_data > 1 else "")
+    if SCHEDULER.resumed:
+        print(f"Resuming observations started at {SCHEDULER.START_TIME} from observation {SCHEDULER.next_slot + 1} of {num_data}")
+
+    # Calculate coordinates and velocity corrections of every observation before observing
+    print(f"Calculating ephemeris for {num_data} observation(s)...")
+    times = SCHEDULER.getTimes()
+    Observation.getSchedule(times, **OBSERVER_PARAM)
+
+    # Points the observation and tunes the SDR before the next observation starts
+    # Observations that start late get their coordinates recalculated for the actual start time
+    def prepare(slot, start_time):
+        if start_time - times[slot] > timedelta(seconds = 1):
+            Observation.updateScheduleEntry(slot, start_time, **OBSERVER_PARAM)
+        Observation.useScheduleEntry(slot)
+        sdr.center_freq = Observation.H_LINE_FREQ
+
+    # The plots of a 24h observation are added to an animation as they're made, which is finished when the run ends
+    ANIMATION = None
+    if num_data > 1 and PLOTTING_PARAM["animation"]:
+        from animation import AnimationWriter
+        first = Observation.SCHEDULE[0]
+        ANIMATION = AnimationWriter(f'Spectrums/ra={float(first["ra"])},dec={float(first["dec"])}', PLOTTING_PARAM["animation"])
+
+    # Plots and datafiles can be saved by background workers
+    OUTPUT_STAGE = None
+    if OBSERVATION_PARAM["background_output"]:
+        from output import OutputStage
+        OUTPUT_STAGE = OutputStage(PLOTTING_PARAM, num_workers = OBSERVATION_PARAM["output_workers"], max_pending = OBSERVATION_PARAM["max_pending_output"], animation = ANIMATION)
+
+    try:
+        for count, i in enumerate(SCHEDULER.slots(prepare)):
+            if count > 0:
+                clear_console()
+            if SCHEDULER.skipped:
+                print(f"Skipped {len(SCHEDULER.skipped)} observation(s) that couldn't start on time")
+            if SCHEDULER.late > 1:
+                print(f"Started {SCHEDULER.late:.1f} seconds late")
+            print(Observation.time)
         
-        print(f"Started observing! - {current_time}")
-        print(f"Receiving {DSP_PARAM['number_of_fft']} FFT's of {2**DSP_PARAM['resolution']} samples")
+            print(f"Started observing! - {datetime.utcnow()}")
+            print(f"Receiving {DSP_PARAM['number_of_fft']} FFT's of {2**DSP_PARAM['resolution']} samples")
+
+            with contextlib.redirect_stdout(None):
+                Observation.collectData(sdr, SDR_PARAM["sample_rate"], **DSP_PARAM)
+            for name, stats in Observation.sample_stats.items():
+                if stats:
+                    print(f"{name} pipeline: {stats['blocks']} blocks in {stats['elapsed']:.1f}s, {stats['overruns']} overruns, {stats['dropped']} dropped blocks")
+            if hasattr(sdr, "getStats"):
+                stream = sdr.getStats()
+                print(f"rtl_tcp stream: {stream['throughput']/1e6:.2f} MS/s, {stream['stalls']} stalls ({stream['stall_time']:.1f}s), {stream['overflows']} buffer overflows")
+            for name, health in Observation.receiver_health.items():
+                status = f"{health['throughput']/1e6:.2f} MS/s, weight {health.get('weight', 0):.2f}" if health["active"] else f"left out after {health['last_error']}"
+                print(f"Receiver {name}: {health['integrations']} integrations, {health['failures']} failures, {status}")
+            for name, fractions in Observation.rfi_stats.items():
+                print(f"{name} flagged as RFI: {fractions['total']*100:.2f}% ({fractions['persistent']*100:.2f}% persistent, {fractions['dropped']*100:.2f}% dropped samples)")
+            if Observation.adaptive_stats:
+                adaptive = Observation.adaptive_stats
+                print(f"Adaptive integration: {adaptive['num_fft']} FFT's in {adaptive['elapsed']:.1f}s, stopped by {adaptive['stopped_by']} at SNR {adaptive['snr']:.1f} and noise {adaptive['noise']:.4f}dB")
+            if Observation.blank_reused:
+                print("Reused blank reference from a previous observation")
+            print("Analyzing data...")
+            Observation.analyzeData()
 
-        with contextlib.redirect_stdout(None):
-            Observation.collectData(sdr, SDR_PARAM["sample_rate"], **DSP_PARAM)
-        print("Analyzing data...")
-        Observation.analyzeData(COORD_CLASS)
-        print("Plotting data...")
-        Observation.plotData(**PLOTTING_PARAM)
-
-        print(f"Done observing! - {datetime.utcnow()}")
-
-        # Next, write datafile if necessary
-        if OBSERVATION_PARAM["datafile"]:
             user_params = {
                 "SDR": SDR_PARAM,
                 "DSP": DSP_PARAM,
                 "Observer": OBSERVER_PARAM,
                 "Observation": OBSERVATION_PARAM
             }
-            Observation.writeDatafile(**user_params)
-
-        # Wait for next execution
-        if num_data > 1:
-            end_time = current_time + timedelta(seconds = second_interval * (i + 1))
-            time_remaining = end_time - datetime.utcnow()
-            print(f'Waiting for next data collection in {time_remaining.total_seconds()} seconds')
-            sleep(time_remaining.total_seconds())
-            clear_console()
+            if OUTPUT_STAGE is not None:
+                # Plot and write datafile in the background while the next observation starts
+                print("Saving results in the background...")
+                datafile = Observation.getDatafile(**user_params) if OBSERVATION_PARAM["datafile"] else None
+                OUTPUT_STAGE.submit(Observation.freqs, Observation.SNR_spectrum, Observation.getPlotInfo(), datafile, Observation.getDatafilePath())
+            else:
+                print("Plotting data...")
+                frame = Observation.plotData(**PLOTTING_PARAM)
+                if ANIMATION is not None:
+                    ANIMATION.addFrame(frame)
+
+                # Next, write datafile if necessary
+                if OBSERVATION_PARAM["datafile"]:
+                    Observation.writeDatafile(**user_params)
+
+            print(f"Done observing! - {datetime.utcnow()}")
+
+            # The scheduler waits for the next execution
+            if i < num_data - 1:
+                print(f'Waiting for next data collection in {max(0, SCHEDULER.deadline(i + 1) - monotonic()):.1f} seconds')
+    finally:
+        if OUTPUT_STAGE is not None:
+            print("Waiting for plots and datafiles to be saved...")
+            for error in OUTPUT_STAGE.close():
+                print(error)
+        if ANIMATION is not None and ANIMATION.close() is not None:
+            print(f"Saved animation to {ANIMATION.PATH}")
 
 
 # Reads user config
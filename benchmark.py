@@ -0,0 +1,485 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from time import perf_counter
+import numpy as np
+
+# Import necessary classes/modules
+sys.path.append("src/")
+from dsp import DSP
+from simulator import SimulatedSdr
+from filters import Filter
+from analysis import Analysis
+from store import ObservationStore
+from observation import saveDatafile
+from dynspec import DynamicSpectrum
+from rfi import RFIFlagger
+from estimator import Estimator
+from downconverter import DownConverter
+from rtltcp import RtlTcpClient, RtlTcpServer
+from recording import iqToBytes
+from spectrumtcp import SpectrumClient, SpectrumServer
+from multireceiver import MultiReceiver
+from adaptive import AdaptiveIntegration
+
+
+'''
+Benchmarks for the processing chain. These run without an SDR connected.
+Run all benchmarks with "python3 benchmark.py" or a single one with fx. "python3 benchmark.py dsp".
+'''
+
+# Serves pregenerated noise so the source doesn't limit the measured throughput
+class NoiseSource():
+    def __init__(self, num_samples, seed = 0):
+        rng = np.random.default_rng(seed)
+        self.SAMPLES = (rng.standard_normal(num_samples) + 1j*rng.standard_normal(num_samples)).astype(np.complex64)
+        self.position = 0
+        self.sample_rate = 2400000
+
+    def read_samples(self, num_samples):
+        end = self.position + num_samples
+        if end <= self.SAMPLES.size:
+            samples = self.SAMPLES[self.position:end].copy()
+        else:
+            samples = np.take(self.SAMPLES, np.arange(self.position, end), mode = 'wrap')
+        self.position = end % self.SAMPLES.size
+        return samples
+
+
+# The FFT-by-FFT integration loop used before the batched engine
+def legacySample(sdr, fft_size, num_fft):
+    PSD_sum = np.zeros(fft_size)
+    for i in range(num_fft):
+        samples = np.array(sdr.read_samples(fft_size))
+        PSD = (np.abs(np.fft.fft(samples))/fft_size)**2
+        PSD_sum = np.add(PSD_sum, np.fft.fftshift(10.0*np.log10(PSD)))
+    return np.true_divide(PSD_sum, num_fft)
+
+
+# Compares the batched DSP.sample with the legacy loop
+def benchmarkDSP(resolutions = [8, 11], num_fft = 5000):
+    for resolution in resolutions:
+        fft_size = 2**resolution
+        print(f'DSP integration of {num_fft} FFT\'s of {fft_size} samples')
+
+        start = perf_counter()
+        legacy_PSD = legacySample(NoiseSource(2**22), fft_size, num_fft)
+        legacy_time = perf_counter() - start
+        print(f'{"legacy":>16}: {num_fft/legacy_time:10.0f} FFT/s')
+
+        for batch_size in [10, 100, 1000]:
+            DSP_CLASS = DSP(resolution = resolution, num_fft = num_fft, median = 0, batch_size = batch_size, threads = 0, ring_slots = 0, baseline = "poly:1", baseline_window = 150)
+            start = perf_counter()
+            PSD = DSP_CLASS.sample(NoiseSource(2**22))
+            elapsed = perf_counter() - start
+            deviation = np.amax(np.abs(PSD - legacy_PSD))
+            print(f'{f"batch_size={batch_size}":>16}: {num_fft/elapsed:10.0f} FFT/s ({legacy_time/elapsed:.1f}x, max deviation {deviation:.1e} dB)')
+
+
+# Compares the threaded acquisition pipeline with serial sampling
+def benchmarkPipeline(resolution = 11, num_fft = 5000, batch_size = 100):
+    print(f'Pipeline integration of {num_fft} FFT\'s of {2**resolution} samples')
+    for threads in [0, 1, 2, 4]:
+        DSP_CLASS = DSP(resolution = resolution, num_fft = num_fft, median = 0, batch_size = batch_size, threads = threads, ring_slots = 8, baseline = "poly:1", baseline_window = 150)
+        start = perf_counter()
+        DSP_CLASS.sample(NoiseSource(2**22))
+        elapsed = perf_counter() - start
+        stats = f'{DSP_CLASS.stats["overruns"]} overruns, {DSP_CLASS.stats["dropped"]} dropped' if DSP_CLASS.stats else 'serial'
+        print(f'{f"threads={threads}":>16}: {num_fft/elapsed:10.0f} FFT/s ({stats})')
+
+
+# Measures how the process pipeline scales with the number of worker processes at a high resolution
+# Efficiency is the speedup divided by the number of processes, which is limited by the number of cores
+def benchmarkProcesses(resolution = 18, num_fft = 200, batch_size = 4):
+    print(f'Process pipeline integration of {num_fft} FFT\'s of {2**resolution} samples on {os.cpu_count()} cores')
+    source = NoiseSource(2**22)
+    reference_rate = None
+    for processes in [0] + [2**i for i in range(int(np.log2(os.cpu_count() or 1)) + 1)]:
+        DSP_CLASS = DSP(resolution = resolution, num_fft = num_fft, median = 0, batch_size = batch_size, threads = 0, ring_slots = 8, baseline = "poly:1", baseline_window = 150, processes = processes)
+        start = perf_counter()
+        DSP_CLASS.sample(source)
+        rate = num_fft/(perf_counter() - start)
+        if processes == 0:
+            reference_rate = rate
+            print(f'{"serial":>16}: {rate:10.1f} FFT/s')
+        else:
+            print(f'{f"processes={processes}":>16}: {rate:10.1f} FFT/s, {rate/reference_rate:5.2f}x speedup, {rate/reference_rate/processes*100:5.1f}% efficiency')
+
+
+# Serves pregenerated raw IQ bytes, so the stand-in rtl_tcp server doesn't limit the measured throughput
+class RawNoiseSource(NoiseSource):
+    def __init__(self, num_samples, seed = 0):
+        super().__init__(num_samples, seed)
+        self.RAW = iqToBytes(np.clip(self.SAMPLES*0.3, -1, 1))
+        self.center_freq = 0
+        self.sample_rate = 0
+
+    def read_bytes(self, num_bytes):
+        start = self.position
+        self.position = (start + num_bytes) % self.RAW.size
+        return self.RAW[start:start + num_bytes] if start + num_bytes <= self.RAW.size else np.take(self.RAW, np.arange(start, start + num_bytes), mode = 'wrap')
+
+
+# Measures the sustained throughput of the rtl_tcp client from a local stand-in server for different read sizes
+# The largest is a batch of 100 FFT's at resolution 16, which is more than the ring buffer of the client holds
+def benchmarkRtlTcp(seconds = 2.0, read_sizes = [2**14, 2**18, 2**21, 100*2**16]):
+    print(f'rtl_tcp client reading from a local server for {seconds} seconds')
+    server = RtlTcpServer(RawNoiseSource(2**20), "127.0.0.1", 0, block_size = 2**18)
+    server.start()
+    for read_size in read_sizes:
+        client = RtlTcpClient("127.0.0.1", server.ADDRESS[1])
+        client.center_freq = 1420405750
+        client.read_samples(read_size)
+        start = perf_counter()
+        num_samples = 0
+        while perf_counter() - start < seconds:
+            num_samples += client.read_samples(read_size).size
+        rate = num_samples/(perf_counter() - start)
+        stats = client.getStats()
+        client.close()
+        print(f'{f"reads of {read_size}":>20}: {rate/1e6:8.2f} MS/s, {stats["stalls"]} stalls')
+    server.close()
+
+
+# Compares the bytes sent over the link by a spectrum host with the raw IQ an rtl_tcp host sends for the same integrations
+def benchmarkSpectrumHost(resolution = 11, num_fft = 1000, num_integrations = 5):
+    print(f'Spectrum host integrating {num_integrations} times {num_fft} FFT\'s of {2**resolution} samples')
+    with open("config.json", "r") as file:
+        dsp_param = json.load(file)["DSP"]
+    dsp_param.update(resolution = resolution)
+    source = NoiseSource(2**22)
+    source.sample_rate, source.center_freq = 2400000, 1420405750
+    server = SpectrumServer(source, "127.0.0.1", 0)
+    server.start()
+    client = SpectrumClient("127.0.0.1", server.ADDRESS[1])
+    client.configure(2400000, dsp_param)
+    DSP_CLASS = DSP.fromConfig(2400000, num_fft, **dsp_param)
+    start = perf_counter()
+    for i in range(num_integrations):
+        DSP_CLASS.sample(client)
+    elapsed = (perf_counter() - start)/num_integrations
+    client.close()
+    server.close()
+
+    spectrum_bytes = client.stats["bytes"]/num_integrations
+    raw_bytes = 2*num_fft*2**resolution
+    print(f'{"rtl_tcp":>16}: {raw_bytes/1e3:10.1f} kB/integration')
+    print(f'{"spectrum":>16}: {spectrum_bytes/1e3:10.1f} kB/integration ({raw_bytes/spectrum_bytes:.0f}x less), {elapsed*1e3:.0f} ms/integration')
+
+
+# Measures integrating on several local rtl_tcp hosts at once, with the throughput of each receiver
+def benchmarkReceivers(resolution = 11, num_fft = 2000, batch_size = 100, max_receivers = 4):
+    print(f'Integrating {num_fft} FFT\'s of {2**resolution} samples on several local rtl_tcp hosts at once')
+    servers = [RtlTcpServer(RawNoiseSource(2**20, seed = i), "127.0.0.1", 0, block_size = 2**18) for i in range(max_receivers)]
+    for server in servers:
+        server.start()
+    DSP_CLASS = DSP(resolution = resolution, num_fft = num_fft, median = 0, batch_size = batch_size, threads = 0, ring_slots = 8, baseline = "poly:1", baseline_window = 150)
+    for num_receivers in range(1, max_receivers + 1):
+        clients = [RtlTcpClient("127.0.0.1", server.ADDRESS[1]) for server in servers[:num_receivers]]
+        receivers = MultiReceiver(clients, [f'host {i}' for i in range(num_receivers)], 2400000)
+        receivers.center_freq = 1420405750
+        start = perf_counter()
+        DSP_CLASS.sample(receivers)
+        elapsed = perf_counter() - start
+        throughputs = ", ".join(f'{health["throughput"]/1e6:.1f}' for health in receivers.getHealth().values())
+        receivers.close()
+        print(f'{f"{num_receivers} receivers":>16}: {num_receivers*num_fft/elapsed:10.0f} FFT/s in total, {throughputs} MS/s per receiver')
+    for server in servers:
+        server.close()
+
+
+# Compares a fixed number of FFT's with adaptive integration on simulated pointings with bright and faint H-lines
+def benchmarkAdaptive(resolution = 11, num_fft = 4000, check_fft = 200, batch_size = 100, target = "snr:8", amplitudes = [0.4, 0.1, 0.03]):
+    print(f'Integrating up to {num_fft} FFT\'s of {2**resolution} samples on the H-line and blank, checking every {check_fft} FFT\'s for {target}')
+    fixed_DSP = DSP(resolution = resolution, num_fft = num_fft, median = 5, batch_size = batch_size, threads = 0, ring_slots = 0, baseline = "poly:1", baseline_window = 150)
+    adaptive_DSP = DSP(resolution = resolution, num_fft = check_fft, median = 5, batch_size = batch_size, threads = 0, ring_slots = 0, baseline = "poly:1", baseline_window = 150)
+    freqs = fixed_DSP.generateFreqs(2400000)
+    getSNRSpectrum = lambda h_line_data, blank_data: fixed_DSP.applyFilter(fixed_DSP.correctBaseline(freqs, fixed_DSP.combineSpectrums(freqs, h_line_data, blank_data)))
+    adaptive = AdaptiveIntegration.fromConfig(target, max_time = 0)
+    for amplitude in amplitudes:
+        sdr = SimulatedSdr(h_line_amplitude = amplitude)
+        start = perf_counter()
+        sdr.center_freq = 1420405750
+        h_line_data = fixed_DSP.sample(sdr)
+        sdr.center_freq = 1420405750 + 3200000
+        blank_data = fixed_DSP.sample(sdr)
+        fixed_time = perf_counter() - start
+        fixed_SNR, fixed_noise = adaptive.estimate(freqs, getSNRSpectrum(h_line_data, blank_data))
+
+        start = perf_counter()
+        adaptive.sample(sdr, adaptive_DSP, freqs, 1420405750, 1420405750 + 3200000, num_fft, getSNRSpectrum, {}, {}, "")
+        adaptive_time = perf_counter() - start
+        stats = adaptive.stats
+        print(f'{f"amplitude {amplitude}":>16}: fixed {num_fft} FFT\'s in {fixed_time:.2f}s (SNR {fixed_SNR:.1f}), adaptive {stats["num_fft"]} FFT\'s in {adaptive_time:.2f}s (SNR {stats["snr"]:.1f}, stopped by {stats["stopped_by"]}, {fixed_time/adaptive_time:.1f}x)')
+
+
+# Measures the cost of capturing a dynamic spectrum during the integration
+# The settings are run in turns and the best time of each is used, to even out changes in CPU speed
+def benchmarkDynamicSpectrum(resolution = 11, num_fft = 10000, batch_size = 100, repeats = 5):
+    print(f'Dynamic spectrum capture during integration of {num_fft} FFT\'s of {2**resolution} samples')
+    DSP_CLASS = DSP(resolution = resolution, num_fft = num_fft, median = 0, batch_size = batch_size, threads = 0, ring_slots = 0, baseline = "poly:1", baseline_window = 150)
+    source = NoiseSource(2**22)
+    subintegrations = [0, 1, 10, 100]
+    elapsed = {subintegration: [] for subintegration in subintegrations}
+    for i in range(repeats):
+        for subintegration in subintegrations:
+            dynamic_spectrum = DynamicSpectrum(DSP_CLASS.FFT_SIZE, subintegration, capacity = 1024) if subintegration else None
+            start = perf_counter()
+            DSP_CLASS.sample(source, dynamic_spectrum)
+            elapsed[subintegration].append(perf_counter() - start)
+
+    reference_time = min(elapsed[0])
+    print(f'{"no capture":>16}: {num_fft/reference_time:10.0f} FFT/s')
+    for subintegration in subintegrations[1:]:
+        best_time = min(elapsed[subintegration])
+        print(f'{f"{subintegration} FFT/row":>16}: {num_fft/best_time:10.0f} FFT/s ({(best_time/reference_time - 1)*100:+.1f}% time)')
+
+
+# Measures the cost of flagging RFI during the integration and how much of the simulated RFI is flagged
+def benchmarkRFI(resolution = 11, num_fft = 10000, batch_size = 100, repeats = 5):
+    print(f'RFI flagging during integration of {num_fft} FFT\'s of {2**resolution} samples')
+    DSP_CLASS = DSP(resolution = resolution, num_fft = num_fft, median = 0, batch_size = batch_size, threads = 0, ring_slots = 0, baseline = "poly:1", baseline_window = 150)
+    source = NoiseSource(2**22)
+    elapsed = {"no flagging": [], "flagging": []}
+    for i in range(repeats):
+        for name in elapsed:
+            rfi_flagger = RFIFlagger() if name == "flagging" else None
+            start = perf_counter()
+            DSP_CLASS.sample(source, rfi_flagger = rfi_flagger)
+            elapsed[name].append(perf_counter() - start)
+
+    reference_time = min(elapsed["no flagging"])
+    best_time = min(elapsed["flagging"])
+    print(f'{"no flagging":>16}: {num_fft/reference_time:10.0f} FFT/s')
+    print(f'{"flagging":>16}: {num_fft/best_time:10.0f} FFT/s ({(best_time/reference_time - 1)*100:+.1f}% time)')
+
+    rfi_flagger = RFIFlagger()
+    DSP_CLASS.sample(SimulatedSdr(seed = 0), rfi_flagger = rfi_flagger)
+    fractions = ", ".join(f'{name} {fraction*100:.2f}%' for name, fraction in rfi_flagger.getFractions().items())
+    print(f'{"simulated RFI":>16}: {fractions}')
+
+
+# Returns the equivalent noise bandwidth in bins and the highest leakage 3 or more bins away in dB of an estimator's channels
+# from the frequency response of its taps, oversampled 64 times
+def channelResponse(estimator):
+    taps = estimator.TAPS.ravel()
+    oversampling = 64*taps.size//estimator.FFT_SIZE
+    response = np.abs(np.fft.fft(taps, 64*taps.size))**2
+    response /= response[0]
+    offsets = np.abs(np.fft.fftfreq(response.size, 1/response.size))/oversampling
+    return np.sum(response)/oversampling, 10*np.log10(np.max(response[offsets >= 3]))
+
+
+# Compares the resolution the spectral estimators achieve with their processing cost
+# The effective resolution is the noise bandwidth of a channel, which includes how much the window widens it
+def benchmarkEstimators(resolutions = [9, 11], num_samples = 2**23, batch_size = 100, sample_rate = 2400000):
+    print(f'Spectral estimators on {num_samples} samples')
+    print(f'{"estimator":>24} {"samples/s":>12} {"resolution":>12} {"leakage":>10}')
+    source = NoiseSource(2**22)
+    for resolution in resolutions:
+        for estimator in ["fft", "welch:hann:0.5", "welch:blackman:0.75", "pfb:4", "pfb:8"]:
+            DSP_CLASS = DSP(resolution = resolution, num_fft = num_samples >> resolution, median = 0, batch_size = batch_size, threads = 0, ring_slots = 0, baseline = "poly:1", baseline_window = 150, estimator = estimator)
+            start = perf_counter()
+            DSP_CLASS.sample(source)
+            elapsed = perf_counter() - start
+            noise_bandwidth, leakage = channelResponse(DSP_CLASS.ESTIMATOR)
+            print(f'{f"{estimator} 2^{resolution}":>24} {num_samples/elapsed:12.3g} {noise_bandwidth*sample_rate/DSP_CLASS.FFT_SIZE/1e3:9.2f} kHz {leakage:7.1f} dB')
+
+
+# Compares integrating the full band with zooming in on bands of velocities, with and without RFI flagging
+# The settings are run in turns and the best time of each is used, to even out changes in CPU speed
+def benchmarkZoom(resolution = 11, num_fft = 5000, batch_size = 100, sample_rate = 2400000, repeats = 3):
+    print(f'Zoom on {num_fft} blocks of {2**resolution} samples at {sample_rate/1e6} MHz')
+    source = NoiseSource(2**22)
+    spans = [0, 180, 90, 45]
+    elapsed = {(span, flagging): [] for span in spans for flagging in [False, True]}
+    for i in range(repeats):
+        for span, flagging in elapsed:
+            downconverter = DownConverter(sample_rate, span) if span > 0 else None
+            DSP_CLASS = DSP(resolution = resolution, num_fft = num_fft, median = 0, batch_size = batch_size, threads = 0, ring_slots = 0, baseline = "poly:1", baseline_window = 150, downconverter = downconverter)
+            start = perf_counter()
+            DSP_CLASS.sample(source, rfi_flagger = RFIFlagger() if flagging else None)
+            elapsed[(span, flagging)].append(perf_counter() - start)
+
+    for span, flagging in elapsed:
+        best_time = min(elapsed[(span, flagging)])
+        speedup = min(elapsed[(0, flagging)])/best_time
+        decimation = DownConverter(sample_rate, span).DECIMATION if span > 0 else 1
+        name = f'{f"{span} km/s" if span > 0 else "full band"}{", flagging" if flagging else ""}'
+        print(f'{name:>22}: {num_fft*2**resolution/best_time:10.3g} samples/s, {2**resolution//decimation:5} channels of {sample_rate/2**resolution/1e3:.2f} kHz ({speedup:.1f}x)')
+
+
+# Measures how fast the simulated SDR generates samples
+def benchmarkSimulator(num_samples = 2**24, read_size = 204800):
+    sdr = SimulatedSdr(seed = 0)
+    start = perf_counter()
+    for i in range(num_samples//read_size):
+        sdr.read_samples(read_size)
+    elapsed = perf_counter() - start
+    print(f'Simulated SDR: {num_samples//read_size*read_size/elapsed/1e6:.1f} MS/s')
+
+
+# The moving average loop used before the filter kernels
+def legacyMedian(data, median):
+    for i in range(len(data)):
+        data[i] = np.mean(data[i:i+median])
+    return data
+
+
+# Compares the filter kernels with the legacy moving average loop
+def benchmarkFilters(resolution = 16, width = 5, num_spectrums = 24):
+    data = np.random.default_rng(0).standard_normal((num_spectrums, 2**resolution))
+    print(f'Filtering {num_spectrums} spectrums of {2**resolution} bins with a width of {width}')
+
+    start = perf_counter()
+    legacyMedian(data[0].copy(), width)
+    legacy_time = perf_counter() - start
+    print(f'{"legacy":>16}: {legacy_time*1e3:10.2f} ms/spectrum')
+
+    for kernel in ["median", "boxcar", "savgol", "hanning"]:
+        FILTER = Filter(kernel, width)
+        start = perf_counter()
+        FILTER.apply(data)
+        elapsed = (perf_counter() - start)/num_spectrums
+        print(f'{kernel:>16}: {elapsed*1e3:10.2f} ms/spectrum ({legacy_time/elapsed:.0f}x)')
+
+
+# Times the analysis of a spectrum and compares the doppler conversions with astropy
+def benchmarkAnalysis(resolution = 16, repeats = 100):
+    import astropy.units as u
+    ANALYSIS = Analysis()
+    freqs = np.linspace(1420405750 - 1.2e6, 1420405750 + 1.2e6, 2**resolution)
+    data = np.random.default_rng(0).standard_normal(freqs.size)
+
+    astropy_vel = (freqs*u.Hz).to(u.km/u.s, equivalencies = u.doppler_radio(ANALYSIS.H_FREQUENCY*u.Hz)).value
+    print(f'Max deviation from astropy: {np.amax(np.abs(ANALYSIS.radialVelFromFreq(freqs) - astropy_vel)):.1e} km/s')
+
+    start = perf_counter()
+    for i in range(repeats):
+        ANALYSIS.getRadialVelocity(data, freqs)
+    print(f'Radial velocity of {2**resolution} bins: {(perf_counter() - start)/repeats*1e6:.0f} us')
+
+
+# Measures the cold start time of the entry points in a fresh interpreter
+def benchmarkStartup(repeats = 3):
+    entry_points = {
+        "host": "sys.path.append('src/'); from observation import Observation; Observation.getSDR",
+        "observe": "sys.path.append('src/'); from observation import Observation; import ephemeris, plot",
+        "ui": "import ui"
+    }
+    baseline = min(timeStartup("pass") for i in range(repeats))
+    print(f'{"python":>16}: {baseline*1e3:8.0f} ms')
+    for name, code in entry_points.items():
+        try:
+            elapsed = min(timeStartup(code) for i in range(repeats))
+            print(f'{name:>16}: {elapsed*1e3:8.0f} ms')
+        except subprocess.CalledProcessError as err:
+            print(f'{name:>16}: failed to import ({err.stderr.strip().splitlines()[-1]})')
+
+
+def timeStartup(code):
+    start = perf_counter()
+    subprocess.run([sys.executable, "-c", f"import sys; {code}"], check = True, capture_output = True, text = True)
+    return perf_counter() - start
+
+
+# Compares creating a new figure for each plot with reusing the figure
+def benchmarkPlot(num_plots = 10, resolution = 11):
+    from plot import Plotter, MAP_PATH
+    freqs = np.linspace(1420405750 - 1.2e6, 1420405750 + 1.2e6, 2**resolution)
+    rng = np.random.default_rng(0)
+    plot_map = os.path.exists(MAP_PATH)
+    print(f'Plotting {num_plots} observations {"with" if plot_map else "without"} the H-line map')
+
+    with tempfile.TemporaryDirectory() as folder:
+        for reuse_figure in [False, True]:
+            PLOT = Plotter(plot_map, 0.0, 0.0, reuse_figure = reuse_figure, output_folder = folder)
+            start = perf_counter()
+            for i in range(num_plots):
+                info = {"ra": float(i), "dec": 10.0, "gal_lon": 0.0, "gal_lat": 0.0, "barycenter_correction": 1.0,
+                    "lsr_correction": 2.0, "SNR": 1.0, "observed_radial_velocity": 0.0}
+                PLOT.plot(freqs, rng.standard_normal(freqs.size), **info)
+            elapsed = (perf_counter() - start)/num_plots
+            print(f'{f"reuse_figure={reuse_figure}":>20}: {elapsed*1e3:8.0f} ms/plot')
+
+
+# Measures how many updates per second the live view processes from the simulated SDR, and the display work the GUI thread does for each frame
+# The dearpygui calls themselves aren't included, so this runs without a display
+def benchmarkLive(resolutions = [11, 14, 16], seconds = 2.0, sample_rate = 2400000, num_frames = 200):
+    try:
+        from src.ui.live import LiveSpectrum, colormap, UPDATE_RATE
+    except ImportError as err:
+        print(f'The live view can\'t be imported ({err})')
+        return
+    print(f'Live view from the simulated SDR at {sample_rate/1e6} MHz, which needs {UPDATE_RATE} updates/s to keep up')
+    for resolution in resolutions:
+        view = LiveSpectrum(SimulatedSdr(sample_rate = sample_rate), sample_rate, resolution)
+        view.processUpdate()
+        start = perf_counter()
+        updates = 0
+        while perf_counter() - start < seconds:
+            view.processUpdate()
+            updates += 1
+        rate = updates/(perf_counter() - start)
+
+        start = perf_counter()
+        for i in range(num_frames):
+            version, spectrum, waterfall = view.getDisplay(-1)
+            low, high = np.min(spectrum), np.max(spectrum)
+            colormap((waterfall - low)/max(high - low, 1e-6)).ravel()
+        frame_time = (perf_counter() - start)/num_frames
+        print(f'{f"resolution {resolution}":>16}: {rate:6.1f} updates/s ({rate/UPDATE_RATE:.1f}x real time), {frame_time*1e3:.2f} ms of display work per frame')
+
+
+# Compares writing JSON datafiles with appending to the binary survey file
+def benchmarkStore(num_observations = 10, resolution = 11):
+    rng = np.random.default_rng(0)
+    content = {
+        "Observation results": {"RA": 0.0, "Dec": 0.0},
+        "Data": {name: rng.standard_normal(2**resolution) for name in ["Blank spectrum", "H-line spectrum", "SNR Spectrum", "Frequency list"]}
+    }
+    print(f'Saving {num_observations} observations of {2**resolution} bins')
+
+    with tempfile.TemporaryDirectory() as folder:
+        for name, path in [("json", "data({}).json"), ("binary", "survey.hlobs")]:
+            start = perf_counter()
+            for i in range(num_observations):
+                saveDatafile(content, os.path.join(folder, path.format(i)))
+            elapsed = (perf_counter() - start)/num_observations
+            size = sum(os.path.getsize(os.path.join(folder, file)) for file in os.listdir(folder) if file.endswith(path[-5:]))/num_observations
+            print(f'{name:>16}: {elapsed*1e3:8.2f} ms/observation, {size/1e3:8.1f} kB/observation')
+
+        start = perf_counter()
+        ObservationStore(os.path.join(folder, "survey.hlobs")).read(num_observations - 1)
+        print(f'{"read record":>16}: {(perf_counter() - start)*1e3:8.2f} ms')
+
+
+BENCHMARKS = {
+    "dsp": benchmarkDSP,
+    "pipeline": benchmarkPipeline,
+    "processes": benchmarkProcesses,
+    "simulator": benchmarkSimulator,
+    "filters": benchmarkFilters,
+    "analysis": benchmarkAnalysis,
+    "startup": benchmarkStartup,
+    "plot": benchmarkPlot,
+    "dynspec": benchmarkDynamicSpectrum,
+    "rfi": benchmarkRFI,
+    "estimators": benchmarkEstimators,
+    "zoom": benchmarkZoom,
+    "store": benchmarkStore,
+    "rtltcp": benchmarkRtlTcp,
+    "spectrumhost": benchmarkSpectrumHost,
+    "receivers": benchmarkReceivers,
+    "adaptive": benchmarkAdaptive,
+    "live": benchmarkLive
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS.keys())
+    for name in selected:
+        BENCHMARKS[name]()
+        print()
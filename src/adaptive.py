@@ -0,0 +1,136 @@
+import os
+import copy
+from time import perf_counter
+import numpy as np
+
+from analysis import Analysis
+ANALYSIS = Analysis()
+
+'''
+Adaptive integration, which stops integrating when the H-line is clear enough instead of after a fixed number of FFT's.
+The H-line and blank are integrated in alternating chunks (on, off, off, on, ...) like the switching cycles,
+so the SNR spectrum of the running means can be checked after every pair of chunks.
+The noise is estimated from the bins outside the ±120 km/s window (narrower when zoomed) of the SNR spectrum, and the SNR is the peak inside the window over that noise.
+The integration stops when the target SNR or noise is reached, when number_of_fft FFT's have been integrated or when the max time is hit.
+The running sums are saved to a checkpoint after every pair, so an interrupted integration continues where it stopped.
+'''
+
+# Scales the MAD to the standard deviation of normal distributed data
+MAD_SCALE = 1.4826
+# snr stops when the SNR reaches the target, noise stops when the noise in dB drops to the target
+KINDS = ["snr", "noise"]
+
+class AdaptiveIntegration():
+    def __init__(self, kind, target, max_time, checkpoint_path = ""):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown adaptive integration "{kind}". Available kinds = {KINDS}')
+        self.KIND = kind
+        self.TARGET = target
+        # Seconds of integration before stopping, no matter the SNR. 0 for no limit
+        self.MAX_TIME = max_time
+        self.CHECKPOINT_PATH = checkpoint_path
+        self.stats = {}
+
+
+    # Creates an adaptive integration from the "adaptive" config parameter, fx. "snr:5" or "noise:0.01"
+    # Returns None for "", which integrates a fixed number of FFT's
+    @staticmethod
+    def fromConfig(parameter, max_time, checkpoint_path = ""):
+        if not parameter:
+            return None
+        kind, target = parameter.split(":")
+        return AdaptiveIntegration(kind, float(target), max_time, checkpoint_path)
+
+
+    # Integrates the H-line and blank in chunks of DSP.NUM_FFT FFT's until a stop condition is met, and returns their mean spectrums
+    # The last chunk is shortened, so no more than max_fft FFT's are integrated
+    # getSNRSpectrum turns the H-line and blank spectrums into the SNR spectrum. key identifies the observation in the checkpoint
+    def sample(self, sdr, DSP, freqs, h_line_freq, blank_freq, max_fft, getSNRSpectrum, dynamic_spectrums, rfi_flaggers, key):
+        state = self.loadCheckpoint(key)
+        resumed = state is not None
+        if state is None:
+            state = {"H-line": None, "Blank": None, "num_fft": 0, "elapsed": 0.0, "checks": 0}
+        start = perf_counter() - state["elapsed"]
+        sample_stats = {}
+        stopped_by = "number_of_fft"
+        snr, noise = None, None
+        tuned_freq = None
+
+        while state["num_fft"] < max_fft:
+            chunk_DSP = DSP
+            if max_fft - state["num_fft"] < DSP.NUM_FFT:
+                chunk_DSP = copy.copy(DSP)
+                chunk_DSP.NUM_FFT = max_fft - state["num_fft"]
+            order = [("H-line", h_line_freq), ("Blank", blank_freq)] if state["checks"] % 2 == 0 else [("Blank", blank_freq), ("H-line", h_line_freq)]
+            # Neighbouring chunks at the same frequency share a tune
+            for name, freq in order:
+                if freq != tuned_freq:
+                    sdr.center_freq = freq
+                    tuned_freq = freq
+                PSD_sum, counts = chunk_DSP.integrateSums(sdr, dynamic_spectrums.get(name), rfi_flaggers.get(name))
+                if state[name] is not None:
+                    PSD_sum, counts = PSD_sum + state[name][0], counts + state[name][1]
+                state[name] = (PSD_sum, counts)
+                sample_stats[name] = chunk_DSP.stats
+            state["num_fft"] += chunk_DSP.NUM_FFT
+            state["checks"] += 1
+            state["elapsed"] = perf_counter() - start
+            self.saveCheckpoint(key, state)
+
+            snr, noise = self.estimate(freqs, getSNRSpectrum(DSP.getMeanSpectrum(*state["H-line"]), DSP.getMeanSpectrum(*state["Blank"])))
+            if self.KIND == "snr" and snr >= self.TARGET or self.KIND == "noise" and noise <= self.TARGET:
+                stopped_by = self.KIND
+                break
+            if self.MAX_TIME > 0 and state["elapsed"] >= self.MAX_TIME:
+                stopped_by = "max_time"
+                break
+
+        self.clearCheckpoint()
+        h_line_data, blank_data = DSP.getMeanSpectrum(*state["H-line"]), DSP.getMeanSpectrum(*state["Blank"])
+        if snr is None:
+            snr, noise = self.estimate(freqs, getSNRSpectrum(h_line_data, blank_data))
+        self.sample_stats = sample_stats
+        self.stats = {"num_fft": state["num_fft"], "elapsed": state["elapsed"], "checks": state["checks"], "stopped_by": stopped_by, "snr": snr, "noise": noise, "resumed": resumed}
+        return h_line_data, blank_data
+
+
+    # Returns the SNR and the noise in dB of an SNR spectrum
+    # The noise is the robust standard deviation of the bins outside the window around the H-line, so the H-line doesn't count as noise
+    def estimate(self, freqs, SNR_spectrum):
+        min_index, max_index = ANALYSIS.getLineWindowIndices(freqs)
+        line_free = np.concatenate((SNR_spectrum[:min_index], SNR_spectrum[max_index:]))
+        noise = MAD_SCALE*np.median(np.abs(line_free - np.median(line_free)))
+        peak = np.max(SNR_spectrum[min_index:max_index]) - np.median(line_free)
+        return float(peak/max(noise, 1e-12)), float(noise)
+
+
+    # Returns the state of the checkpoint if it's from the same observation, or None
+    def loadCheckpoint(self, key):
+        if not self.CHECKPOINT_PATH or not os.path.exists(self.CHECKPOINT_PATH):
+            return None
+        with np.load(self.CHECKPOINT_PATH) as checkpoint:
+            if str(checkpoint["key"]) != key:
+                return None
+            return {
+                "H-line": (checkpoint["h_line_sum"], checkpoint["h_line_counts"]),
+                "Blank": (checkpoint["blank_sum"], checkpoint["blank_counts"]),
+                "num_fft": int(checkpoint["num_fft"]),
+                "elapsed": float(checkpoint["elapsed"]),
+                "checks": int(checkpoint["checks"])
+            }
+
+
+    # Saves the running sums. The checkpoint is written to a temporary file first, so an interruption never leaves half a checkpoint
+    def saveCheckpoint(self, key, state):
+        if not self.CHECKPOINT_PATH:
+            return
+        temporary_path = self.CHECKPOINT_PATH + ".tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, key = key, h_line_sum = state["H-line"][0], h_line_counts = state["H-line"][1], blank_sum = state["Blank"][0], blank_counts = state["Blank"][1],
+                     num_fft = state["num_fft"], elapsed = state["elapsed"], checks = state["checks"])
+        os.replace(temporary_path, self.CHECKPOINT_PATH)
+
+
+    def clearCheckpoint(self):
+        if self.CHECKPOINT_PATH and os.path.exists(self.CHECKPOINT_PATH):
+            os.remove(self.CHECKPOINT_PATH)
@@ -1,4 +1,3 @@
-import astropy.units as u
 import numpy as np
 
 # Analyze data, eg. find/calculate radial velocity, SNR and etc.
@@ -7,39 +6,58 @@ class Analysis():
         # Constants
         self.H_FREQUENCY = 1420405750
         self.C_SPEED = 299792.458 # km/s
+        # Velocity window around the H-line in km/s, which is searched for the peak and left out of noise floor estimates
+        self.LINE_WINDOW = 120
+        # Cached window indices for each frequency axis and velocity
+        self.window_indices = {}
+        self.line_windows = {}
     
     
     # Returns the radial velocity and maximum SNR
     def getRadialVelocity(self, data, freqs):
         # Center around H-line
         # TODO Change to radial velocity instead of frequency
-        min_index = (np.abs(np.array(freqs)-self.freqFromRadialVel(120))).argmin()
-        max_index = (np.abs(np.array(freqs)-self.freqFromRadialVel(-120))).argmin()
+        min_index, max_index = self.getLineWindowIndices(freqs)
 
-        SNR = np.amax(data[min_index:max_index])
         #Get index of max SNR
-        index = np.where(data==SNR)[0][0]
+        index = min_index + np.argmax(data[min_index:max_index])
+        SNR = data[index]
         radial_vel = self.radialVelFromFreq(freqs[index])
 
         return np.round(SNR, 2), np.round(radial_vel, 2)
+
+
+    # Returns the indices of the bins closest to +velocity and -velocity, ie. the lower and upper end of the window around the H-line
+    # The indices are cached for each frequency axis, which is identified by its first and last frequency and its size
+    def getWindowIndices(self, freqs, velocity):
+        key = (freqs[0], freqs[-1], len(freqs), velocity)
+        if key not in self.window_indices:
+            freqs = np.asarray(freqs)
+            min_index = (np.abs(freqs-self.freqFromRadialVel(velocity))).argmin()
+            max_index = (np.abs(freqs-self.freqFromRadialVel(-velocity))).argmin()
+            self.window_indices[key] = (min_index, max_index)
+        return self.window_indices[key]
     
 
+    # Returns the indices of the window around the H-line, which is LINE_WINDOW km/s unless the frequency axis is zoomed in
+    # On a zoomed axis the window is narrowed so at least a quarter of the bins are outside it, instead of only the edge bins
+    def getLineWindowIndices(self, freqs):
+        key = (freqs[0], freqs[-1], len(freqs))
+        if key not in self.line_windows:
+            velocities = np.abs(self.radialVelFromFreq(freqs))
+            self.line_windows[key] = min(self.LINE_WINDOW, float(np.quantile(velocities, 0.75)))
+        return self.getWindowIndices(freqs, self.line_windows[key])
+
+
     # Returns radial velocity from frequency
+    # Uses the radio definition of the doppler shift, v = c*(f0 - f)/f0, like astropy's doppler_radio equivalency
     def radialVelFromFreq(self, freq):
-        H_freq = u.doppler_radio(self.H_FREQUENCY*u.Hz)
-        measured = freq*u.Hz
-        v_doppler = measured.to(u.km/u.s,equivalencies=H_freq)
-        
-        return v_doppler.value
+        return self.C_SPEED*(self.H_FREQUENCY - np.asarray(freq))/self.H_FREQUENCY
     
 
     # Returns frequency from radial velocity
     def freqFromRadialVel(self, radial_vel):
-        H_freq = u.doppler_radio(self.H_FREQUENCY*u.Hz)
-        measured = radial_vel*u.km/u.s
-        freq = measured.to(u.Hz,equivalencies=H_freq)
-        
-        return freq.value
+        return self.H_FREQUENCY*(1 - np.asarray(radial_vel)/self.C_SPEED)
     
 
     #TODO Gaussian curve modelling??
\ No newline at end of file
@@ -0,0 +1,65 @@
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+'''
+Streaming animation of observations.
+Frames are rendered plots (RGB arrays) that are encoded and written to the file as soon as they're added,
+so memory use doesn't grow with the number of frames.
+GIFs are written frame by frame with Pillow, which is installed with matplotlib.
+MP4s are piped to ffmpeg through imageio and need the imageio-ffmpeg package, otherwise a GIF is written instead.
+'''
+
+FORMATS = ["gif", "mp4"]
+# Time each frame is shown in seconds
+FRAME_DURATION = 0.1
+
+class AnimationWriter():
+    def __init__(self, path, format = "gif"):
+        if format not in FORMATS:
+            raise ValueError(f'Unknown animation format "{format}". Available formats = {FORMATS}')
+        self.FORMAT = format
+        self.PATH = f'{path}.{format}'
+        self.file = None
+        self.writer = None
+        self.num_frames = 0
+
+        if format == "mp4":
+            try:
+                import imageio
+                self.writer = imageio.get_writer(self.PATH, fps = 1/FRAME_DURATION, macro_block_size = 1)
+            except Exception as err:
+                print(f'MP4 animation not available ({err}), writing a GIF instead')
+                self.FORMAT = "gif"
+                self.PATH = f'{path}.gif'
+
+
+    # Encodes and writes a frame. All frames must have the same size
+    def addFrame(self, frame):
+        frame = np.asarray(frame)[..., :3]
+        if self.FORMAT == "mp4":
+            self.writer.append_data(frame)
+        else:
+            self.addGIFFrame(frame)
+        self.num_frames += 1
+
+
+    # Each frame gets its own palette, so the colors don't depend on the first frame
+    def addGIFFrame(self, frame):
+        image = Image.fromarray(frame).quantize(colors = 256, method = Image.Quantize.FASTOCTREE)
+        if self.file is None:
+            self.file = open(self.PATH, "wb")
+            header, _ = GifImagePlugin.getheader(image, info = {"loop": 0})
+            self.file.write(b"".join(header))
+        for data in GifImagePlugin.getdata(image, duration = int(FRAME_DURATION*1000), include_color_table = True):
+            self.file.write(data)
+
+
+    # Finishes the file and returns its path, or None if no frames were added
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.file is not None:
+            self.file.write(b";")
+            self.file.close()
+            self.file = None
+        return self.PATH if self.num_frames else None
@@ -0,0 +1,85 @@
+import numpy as np
+
+from analysis import Analysis
+ANALYSIS = Analysis()
+
+'''
+Baseline fitting for spectrums.
+The baseline is a least squares polynomial or cubic spline fitted only to the line-free bins,
+ie. the bins outside a velocity window around the H-line, and then subtracted from the whole spectrum.
+The design matrix and its pseudo inverse only depend on the spectrum size, the model and the mask,
+so they are cached and reused for every observation with the same settings.
+'''
+
+MODELS = ["poly", "spline"]
+
+# Cached (design matrix, pseudo inverse of the masked design matrix) for each (size, model, order, frequency axis, velocity window)
+DESIGN_CACHE = {}
+
+class Baseline():
+    def __init__(self, model, order, velocity_window):
+        if model not in MODELS:
+            raise ValueError(f'Unknown baseline model "{model}". Available models = {MODELS}')
+        self.MODEL = model
+        self.ORDER = order
+        self.VELOCITY_WINDOW = velocity_window
+        self.masks = {}
+
+
+    # Creates a baseline from the "baseline" config parameter, fx. "poly:1" or "spline:8"
+    # For polynomials the number is the order, for splines it's the number of segments
+    @staticmethod
+    def fromConfig(parameter, velocity_window):
+        model, order = parameter.split(":")
+        return Baseline(model, int(order), velocity_window)
+
+
+    # Frequency axes are identified by their first and last frequency and their size
+    @staticmethod
+    def getAxisKey(freqs):
+        return (freqs[0], freqs[-1], len(freqs))
+
+
+    # Returns a boolean mask of the line-free bins for a frequency axis
+    def getMask(self, freqs):
+        key = self.getAxisKey(freqs)
+        if key not in self.masks:
+            velocities = ANALYSIS.radialVelFromFreq(np.asarray(freqs))
+            mask = np.abs(velocities) > self.VELOCITY_WINDOW
+            if np.count_nonzero(mask) <= self.ORDER + 3:
+                raise ValueError(f'Too few bins outside the baseline window of {self.VELOCITY_WINDOW}km/s to fit a baseline')
+            self.masks[key] = mask
+        return self.masks[key]
+
+
+    # Returns the cached design matrix and pseudo inverse for the given size and the mask of the frequency axis
+    # The mask is identified by the axis and velocity window it's made from, so different masks never share an entry
+    def getDesign(self, size, freqs):
+        mask = self.getMask(freqs)
+        key = (size, self.MODEL, self.ORDER, self.getAxisKey(freqs), self.VELOCITY_WINDOW)
+        if key not in DESIGN_CACHE:
+            x = np.linspace(-1, 1, size)
+            if self.MODEL == "poly":
+                design = np.vander(x, self.ORDER + 1, increasing = True)
+            else:
+                # Cubic spline in truncated power basis with evenly spaced knots
+                knots = np.linspace(-1, 1, self.ORDER + 1)[1:-1]
+                cubic = np.vander(x, 4, increasing = True)
+                truncated = np.clip(x[:, np.newaxis] - knots, 0, None)**3
+                design = np.hstack((cubic, truncated))
+            DESIGN_CACHE[key] = (design, np.linalg.pinv(design[mask]))
+        return DESIGN_CACHE[key]
+
+
+    # Returns the fitted baseline of a spectrum or a stack of spectrums (one per row)
+    def fit(self, freqs, data):
+        data = np.asarray(data)
+        mask = self.getMask(freqs)
+        design, solver = self.getDesign(data.shape[-1], freqs)
+        coefficients = data[..., mask] @ solver.T
+        return coefficients @ design.T
+
+
+    # Subtracts the fitted baseline. The result is written to out if given, which may be data itself
+    def subtract(self, freqs, data, out = None):
+        return np.subtract(data, self.fit(freqs, data), out = out)
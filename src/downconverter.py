@@ -0,0 +1,81 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+'''
+Digital down-conversion for zooming in on the H-line.
+The samples are mixed so the center of the zoom band is at 0 Hz, low-pass filtered and decimated by DECIMATION,
+so FFT's that are DECIMATION times smaller give the same channel width for the zoom band only.
+The filter only computes the kept outputs. CHUNK outputs at a time are one row of a banded matrix product,
+which keeps the matrix products large enough to be fast. The mixing is folded into the taps, so the NCO only runs at the decimated rate.
+The filter needs samples from before the batch, which are passed as the first HISTORY samples, like for the estimators.
+The NCO restarts at the first sample of every batch. This only changes the phase of the whole batch, which doesn't change the power spectrums.
+'''
+
+C_SPEED = 299792.458 # km/s
+H_FREQUENCY = 1420405750
+# Taps of the low-pass filter for each decimated sample
+TAPS_PER_OUTPUT = 24
+# Fraction of the decimated band that is flat and free of aliases
+PASSBAND = 0.75
+# Decimated samples computed by each row of the matrix product
+CHUNK = 32
+
+class DownConverter():
+    # span is the width of the zoom band in km/s, and center is the radial velocity at its center
+    def __init__(self, sample_rate, span, center = 0):
+        span_freq = span/C_SPEED*H_FREQUENCY
+        # Radio convention, positive velocities are below the H-line
+        self.OFFSET = -center/C_SPEED*H_FREQUENCY
+        if span <= 0 or abs(self.OFFSET) + span_freq/2 > sample_rate/2:
+            raise ValueError(f'Zoom band of {span} km/s around {center} km/s must be inside the sampled band of {sample_rate/1e6} MHz')
+
+        # The largest power of two that keeps the zoom band in the passband
+        self.DECIMATION = 2**int(np.floor(np.log2(PASSBAND*sample_rate/span_freq)))
+        if self.DECIMATION < 2:
+            raise ValueError(f'Zoom band of {span} km/s is too wide to decimate at {sample_rate/1e6} MHz. At most {PASSBAND*sample_rate/2/H_FREQUENCY*C_SPEED:.0f} km/s is possible')
+        self.SAMPLE_RATE = sample_rate/self.DECIMATION
+        self.HISTORY = (TAPS_PER_OUTPUT - 1)*self.DECIMATION
+
+        # Windowed sinc with the cutoff at half the decimated sample rate, mixed down by the offset
+        length = TAPS_PER_OUTPUT*self.DECIMATION
+        times = np.arange(length)
+        taps = np.sinc((times - (length - 1)/2)/self.DECIMATION)*np.kaiser(length, 8.0)
+        taps = taps/np.sum(taps)*np.exp(-2j*np.pi*self.OFFSET/sample_rate*times)
+
+        # Each row of the banded matrix computes one decimated sample from a window of CHUNK*DECIMATION + HISTORY samples
+        self.WINDOW = CHUNK*self.DECIMATION + self.HISTORY
+        matrix = np.zeros((CHUNK, self.WINDOW), dtype = np.complex64)
+        for row in range(CHUNK):
+            matrix[row, row*self.DECIMATION:row*self.DECIMATION + length] = taps
+        self.MATRIX = np.ascontiguousarray(matrix.T)
+
+        # Cached NCO for the decimated samples of the largest batch so far
+        self.nco = np.ones(0, dtype = np.complex64)
+
+
+    # Returns the decimated samples of a batch. The first HISTORY samples are from before the batch
+    def process(self, samples):
+        samples = np.asarray(samples, dtype = np.complex64)
+        num_outputs = (samples.size - self.HISTORY)//self.DECIMATION
+        num_chunks = num_outputs//CHUNK
+
+        # Whole chunks at once, and the last outputs with the first rows of the matrix
+        outputs = np.empty(num_outputs, dtype = np.complex64)
+        windows = sliding_window_view(samples[:num_chunks*CHUNK*self.DECIMATION + self.HISTORY], self.WINDOW)[::CHUNK*self.DECIMATION]
+        outputs[:num_chunks*CHUNK] = (windows @ self.MATRIX).ravel()
+        remainder = num_outputs - num_chunks*CHUNK
+        if remainder > 0:
+            start = num_chunks*CHUNK*self.DECIMATION
+            window_size = remainder*self.DECIMATION + self.HISTORY
+            outputs[num_chunks*CHUNK:] = samples[start:start + window_size] @ self.MATRIX[:window_size, :remainder]
+
+        if self.OFFSET != 0:
+            outputs *= self.getNCO(num_outputs)
+        return outputs
+
+
+    # Returns the NCO for a batch, which is computed again only when a larger batch comes
+    def getNCO(self, num_outputs):
+        if self.nco.size < num_outputs:
+            self.nco = np.exp(-2j*np.pi*self.OFFSET/self.SAMPLE_RATE*np.arange(num_outputs)).astype(np.complex64)
+        return self.nco[:num_outputs]
@@ -1,31 +1,203 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 from analysis import Analysis
+from pipeline import Pipeline
+from parallel import ProcessPipeline
+from filters import Filter
+from baseline import Baseline
+from estimator import Estimator
+from downconverter import DownConverter
 ANALYSIS = Analysis()
 
 class DSP():
-    def __init__(self, resolution, num_fft, median):
-        self.FFT_SIZE = 2**resolution
+    def __init__(self, resolution, num_fft, median, batch_size, threads, ring_slots, baseline, baseline_window, estimator = "fft", downconverter = None, processes = 0):
+        # Samples read from the SDR for each FFT. A down converter decimates them, so the FFT's get smaller with the same channel width
+        self.BLOCK_SAMPLES = 2**resolution
+        self.DOWNCONVERTER = downconverter
+        self.FFT_SIZE = self.BLOCK_SAMPLES//downconverter.DECIMATION if downconverter is not None else self.BLOCK_SAMPLES
         self.NUM_FFT = num_fft
+        # Spectral estimator that turns the samples into power spectrums. Welch gives more than one spectrum for each block of FFT_SIZE samples
+        self.ESTIMATOR = Estimator.fromConfig(estimator, self.FFT_SIZE)
+        # Samples from before each batch that the estimator and down converter need
+        self.HISTORY = self.ESTIMATOR.HISTORY*(downconverter.DECIMATION if downconverter is not None else 1) + (downconverter.HISTORY if downconverter is not None else 0)
         self.MEDIAN = median
+        self.FILTER = Filter.fromConfig(median)
+        self.BASELINE = Baseline.fromConfig(baseline, baseline_window)
+        # Number of FFT's read and processed at once. Limits the memory used for each batch
+        self.BATCH_SIZE = max(1, min(batch_size, num_fft))
+        # Number of worker threads for the acquisition pipeline. 0 samples and processes on the calling thread
+        self.THREADS = threads
+        # Number of worker processes instead of threads, for FFT's too large for one core. Takes precedence over THREADS
+        self.PROCESSES = processes
+        self.RING_SLOTS = ring_slots
+        self.stats = {}
+        self.dynamic_spectrum = None
+        self.rfi_flagger = None
+
+
+    # Creates a DSP for integrations of num_fft FFT's from the DSP section of the config
+    # A down converter is created if zooming in on a band of velocities
+    @staticmethod
+    def fromConfig(sample_rate, num_fft, **dsp_param):
+        downconverter = DownConverter(sample_rate, dsp_param["zoom_span"], dsp_param["zoom_center"]) if dsp_param["zoom_span"] > 0 else None
+        DSP_CLASS = DSP(resolution = dsp_param["resolution"], num_fft = num_fft, median = dsp_param["median"], batch_size = dsp_param["batch_size"], threads = dsp_param["threads"], ring_slots = dsp_param["ring_slots"], baseline = dsp_param["baseline"], baseline_window = dsp_param["baseline_window"], estimator = dsp_param["estimator"], downconverter = downconverter, processes = dsp_param["processes"])
+
+        # The baseline is fitted to the bins outside baseline_window, which a zoom band may not have
+        # This is checked before sampling, so the integration isn't lost when the baseline is corrected
+        if downconverter is not None:
+            freqs = DSP_CLASS.generateFreqs(sample_rate)
+            edge_velocity = np.max(np.abs(ANALYSIS.radialVelFromFreq(freqs[[0, -1]])))
+            if dsp_param["baseline_window"] >= edge_velocity:
+                raise ValueError(f'baseline_window of {dsp_param["baseline_window"]} km/s must be smaller than the zoom band, which reaches {edge_velocity:.0f} km/s from the H-line')
+            DSP_CLASS.BASELINE.getMask(freqs)
+        return DSP_CLASS
     
     
     # This samples from a given SDR
-    def sample(self, sdr):
-        # Create array for summing FFTs
+    # Samples are read in batches of BATCH_SIZE FFT's which are processed as one 2D array
+    # Sub-integrations are captured in the dynamic spectrum and RFI is left out by the RFI flagger if they're given
+    def sample(self, sdr, dynamic_spectrum = None, rfi_flagger = None):
+        if hasattr(sdr, "integrate"):
+            return self.sampleRemote(sdr, dynamic_spectrum, rfi_flagger)
+        # Several receivers integrate at once with copies of this DSP
+        if hasattr(sdr, "sampleReceivers"):
+            return sdr.sampleReceivers(self, dynamic_spectrum, rfi_flagger)
+        PSD_sum, counts = self.integrateSums(sdr, dynamic_spectrum, rfi_flagger)
+        return self.getMeanSpectrum(PSD_sum, counts)
+
+
+    # Integrates NUM_FFT FFT's and returns the unshifted sum of the log power spectrums and the number of FFT's in each channel
+    # Sums of several integrations can be added together before they're averaged
+    def integrateSums(self, sdr, dynamic_spectrum = None, rfi_flagger = None):
+        self.dynamic_spectrum = dynamic_spectrum
+        self.rfi_flagger = rfi_flagger
+        # The rows of the dynamic spectrum are timed by their position in the sample stream. Each FFT of the estimator takes a share of a block
+        if dynamic_spectrum is not None:
+            sample_rate = getattr(sdr, "sample_rate", 0)
+            dynamic_spectrum.begin(self.BLOCK_SAMPLES/sample_rate/self.ESTIMATOR.FRAMES_PER_BLOCK if sample_rate else 0)
+        if self.PROCESSES > 0 or self.THREADS > 0:
+            if self.PROCESSES > 0:
+                pipeline = ProcessPipeline(self, num_workers = self.PROCESSES, num_slots = self.RING_SLOTS)
+            else:
+                pipeline = Pipeline(self, num_workers = self.THREADS, num_slots = self.RING_SLOTS)
+            PSD_sum, counts = pipeline.run(sdr)
+            self.stats = pipeline.stats
+        else:
+            PSD_sum, counts = self.sampleSerial(sdr)
+        if dynamic_spectrum is not None:
+            dynamic_spectrum.flush(self.NUM_FFT*self.ESTIMATOR.FRAMES_PER_BLOCK)
+        return PSD_sum, counts
+
+
+    # Returns the shifted mean spectrum of a sum of log power spectrums
+    def getMeanSpectrum(self, PSD_sum, counts):
+        # Shifting the sum is equal to summing the shifted spectrums
+        # Each channel is averaged over the FFT's that weren't flagged
+        mean_PSD = np.true_divide(np.fft.fftshift(PSD_sum), np.fft.fftshift(counts), out = np.zeros(self.FFT_SIZE), where = np.fft.fftshift(counts) > 0)
+        return self.fillFlaggedChannels(mean_PSD, np.fft.fftshift(counts) == 0)
+
+
+    # Reads and processes the batches one after the other on the calling thread
+    def sampleSerial(self, sdr):
+        # Create arrays for summing FFTs and counting the FFT's summed in each channel
         PSD_sum = np.zeros(self.FFT_SIZE)
+        counts = np.zeros(self.FFT_SIZE)
+        history = self.readHistory(sdr)
         
-        for i in range(self.NUM_FFT):
-            samples = np.array(sdr.read_samples(self.FFT_SIZE))
-            PSD = (np.abs(np.fft.fft(samples))/self.FFT_SIZE)**2
-            PSD_zero_checked = self.checkForZero(PSD)
-            PSD_log = 10.0*np.log10(PSD_zero_checked)
+        remaining = self.NUM_FFT
+        while remaining > 0:
+            num_fft = min(self.BATCH_SIZE, remaining)
+            samples = np.asarray(sdr.read_samples(num_fft*self.BLOCK_SAMPLES))
+            batch = np.concatenate((history, samples)) if self.HISTORY else samples
+            history = self.nextHistory(history, samples)
+            batch_sum, batch_counts = self.processBatch(batch, first_fft = self.NUM_FFT - remaining)
+            PSD_sum += batch_sum
+            counts += batch_counts
+            remaining -= num_fft
+        return PSD_sum, counts
 
-            PSD_sum = np.add(PSD_sum,np.fft.fftshift(PSD_log))
-        
-        mean_PSD = np.true_divide(PSD_sum,self.NUM_FFT)
-        return mean_PSD
+
+    # Integrates on a spectrum host, which sends the integrated spectrum instead of the samples
+    # The flagged counts and the sub-integrations from the host are added to the RFI flagger and dynamic spectrum
+    def sampleRemote(self, sdr, dynamic_spectrum, rfi_flagger):
+        metadata, spectrum, (rows, times, counts) = sdr.integrate(self.NUM_FFT, dynamic_spectrum.SUBINTEGRATION if dynamic_spectrum is not None else 0, rfi_flagger is not None)
+        if spectrum.size != self.FFT_SIZE:
+            raise ValueError(f'Spectrum host sent {spectrum.size} channels but {self.FFT_SIZE} were expected')
+        self.stats = metadata["stats"]
+        if rfi_flagger is not None and metadata["rfi"] is not None:
+            rfi_flagger.addStats(metadata["rfi"])
+        if dynamic_spectrum is not None:
+            dynamic_spectrum.addRows(rows, times, counts, self.NUM_FFT*self.ESTIMATOR.FRAMES_PER_BLOCK, metadata["elapsed"])
+        return spectrum.astype(np.float64)
+
+
+    # Reads the samples the estimator and down converter need from before the first batch
+    def readHistory(self, sdr):
+        if self.HISTORY == 0:
+            return np.zeros(0, dtype = np.complex64)
+        return np.asarray(sdr.read_samples(self.HISTORY))
+
+
+    # Returns the last HISTORY samples of the stream after samples are added to it
+    # They're copied, since the SDR may reuse the buffer of the samples
+    def nextHistory(self, history, samples):
+        if samples.size >= self.HISTORY:
+            return samples[samples.size - self.HISTORY:].copy()
+        return np.concatenate((history, samples))[-self.HISTORY:]
+
+
+    # Returns the unshifted sum of the log power spectrums for a block of samples and the number of FFT's summed in each channel
+    # The block is decimated if zooming, and the estimator transforms it into (number of FFT's x FFT_SIZE) power spectrums,
+    # after the samples from before the block
+    # first_fft is the number of the block's first FFT in the integration, which places it in the dynamic spectrum
+    def processBatch(self, samples, first_fft = 0):
+        if self.DOWNCONVERTER is not None:
+            samples = self.DOWNCONVERTER.process(samples)
+        PSD = self.ESTIMATOR.power(samples)
+        flags = self.flagBatch(PSD)
+
+        # Flagged values are set to 1, so they add 0 to the log sum
+        if flags is not None:
+            fft_flags, channel_flags = flags
+            PSD[fft_flags] = 1.0
+            PSD[:, channel_flags] = 1.0
+            counts = np.where(channel_flags, 0, PSD.shape[0] - np.count_nonzero(fft_flags))
+            # The dynamic spectrum averages each sub-integration over its own unflagged values
+            valid = ~(fft_flags[:, np.newaxis] | channel_flags[np.newaxis, :]) if self.dynamic_spectrum is not None else None
+        else:
+            valid = None
+            counts = PSD.shape[0]
+        log_PSD = np.log10(PSD, out = PSD)
+
+        # The dynamic spectrum sums the sub-integrations, which add up to the sum of the batch
+        if self.dynamic_spectrum is not None:
+            log_sum = self.dynamic_spectrum.add(first_fft*self.ESTIMATOR.FRAMES_PER_BLOCK, log_PSD, valid)
+        else:
+            log_sum = np.sum(log_PSD, axis = 0)
+
+        # Normalization by FFT_SIZE**2 is applied to the sum instead of each FFT
+        PSD_log_sum = 10.0*log_sum
+        PSD_log_sum -= counts*20.0*np.log10(self.FFT_SIZE)
+        return PSD_log_sum, counts
+
+
+    # Returns the flagged FFT's and channels of a batch, or None if nothing is flagged
+    # Dropped samples are read as zeros, so FFT's with zero power are always flagged
+    def flagBatch(self, PSD):
+        dropped = np.min(PSD, axis = 1) == 0
+        if self.rfi_flagger is not None:
+            return self.rfi_flagger.flag(PSD, dropped)
+        if dropped.any():
+            return dropped, np.zeros(PSD.shape[1], dtype = bool)
+        return None
+
+
+    # Channels that were flagged in every FFT are interpolated from the nearest channels that weren't
+    def fillFlaggedChannels(self, spectrum, empty):
+        if empty.any() and not empty.all():
+            channels = np.arange(spectrum.size)
+            spectrum[empty] = np.interp(channels[empty], channels[~empty], spectrum[~empty])
+        return spectrum
 
 
     # Return SNR spectrum together with highest H-line SNR
@@ -35,45 +207,37 @@ class DSP():
         # The above spectrum may not be at 0.0 SNR.
         # To fix this, we shift the spectrum to 0.0
         # The distance to shift is equal to the noise floors mean (ie. area around H-line, hence the slicing below)
-        min_index = (np.abs(np.array(freqs)-ANALYSIS.freqFromRadialVel(120))).argmin()
-        max_index = (np.abs(np.array(freqs)-ANALYSIS.freqFromRadialVel(-120))).argmin()
+        min_index, max_index = ANALYSIS.getLineWindowIndices(freqs)
         sliced = np.concatenate((diff[:min_index], diff[max_index:]))
         shifted_SNR = diff-np.mean(sliced)
 
         return shifted_SNR
 
-    
-    # Checks if samples have been dropped and replaces 0.0 with average of value before and after
-    def checkForZero(self, PSD):
-        index = np.array(np.where(PSD == 0))
-        if index.size == 0:
-            return PSD
-        print('Dropped sample was recovered!')
-        PSD[index] = np.mean(PSD[index+1]+PSD[index-1])
-        return PSD
 
     
     # Returns numpy array of frequencies for a given sample rate and resolution
+    # When zooming, the frequencies cover the zoom band
     def generateFreqs(self,sample_rate):
-        start_freq = 1420405750 - sample_rate/2
-        stop_freq = 1420405750 + sample_rate/2
+        center_freq = 1420405750
+        if self.DOWNCONVERTER is not None:
+            center_freq += self.DOWNCONVERTER.OFFSET
+            sample_rate = self.DOWNCONVERTER.SAMPLE_RATE
+        start_freq = center_freq - sample_rate/2
+        stop_freq = center_freq + sample_rate/2
         freqs = np.linspace(start = start_freq, stop = stop_freq, num = self.FFT_SIZE)
         return freqs
     
     
-    # Apply median filter to data
-    def applyMedian(self,data):
-        for i in range(len(data)):
-            data[i] = np.mean(data[i:i+self.MEDIAN])
-        return data
+    # Apply the filter selected by the median parameter to a spectrum or a stack of spectrums
+    def applyFilter(self, data, out = None):
+        if self.FILTER is None:
+            return data
+        return self.FILTER.apply(data, out = out)
 
     
-    # Correct for slanted data
-    def correctSlant(self, data):
-        X = np.linspace(0,len(data) - 1, len(data))
-        slope, intersect = np.polyfit(X, data, 1)
-        data = np.array([data[i] - (intersect + i * slope) for i in range(len(X))])
-        return data
+    # Subtract the baseline fitted to the line-free part of a spectrum or a stack of spectrums
+    def correctBaseline(self, freqs, data):
+        return self.BASELINE.subtract(freqs, data)
     
 
     # # Remove large noise spikes
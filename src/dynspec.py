@@ -0,0 +1,220 @@
+import threading
+from time import monotonic
+import numpy as np
+
+'''
+Dynamic spectrum (waterfall) captured during an integration.
+Groups of SUBINTEGRATION FFT's are averaged into sub-integrations, which are stored in a preallocated ring buffer
+of CAPACITY rows, so memory use is fixed however long the integration is. When the buffer is full, the oldest rows are overwritten.
+The sub-integrations are summed from the log spectrums that are summed for the integration anyway,
+and the integration sum is the sum of the sub-integrations, so capturing adds very little work.
+Batches may be processed out of order by the pipeline workers, so every sub-integration is identified by its number.
+Consecutive sub-integrations are in consecutive rows, so a batch is written as at most two contiguous slices of rows.
+The rows hold the unshifted means of the log10 power spectrums, which is one pass over the batch,
+and they're scaled to dB and shifted when they're read.
+Each row is timed by the middle of its FFT's in the sample stream, counted from when its integration began.
+Worker processes fill their own copies, which are merged back by number when the integration is done.
+'''
+
+DTYPES = ["float32", "float16"]
+# Fewest FFT's in each row from the config. With fewer, writing a row for every few FFT's costs more than 5% of the sampling throughput
+MIN_SUBINTEGRATION = 10
+
+class DynamicSpectrum():
+    def __init__(self, fft_size, subintegration, capacity, dtype = "float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f'Unknown dynamic spectrum dtype "{dtype}". Available types = {DTYPES}')
+        self.FFT_SIZE = fft_size
+        # Number of FFT's averaged in each row
+        self.SUBINTEGRATION = max(1, subintegration)
+        self.CAPACITY = max(1, capacity)
+
+        # Rows are unshifted means of log10 power spectrums. getData returns them as shifted spectrums in dB, like the integrated spectrum
+        self.data = np.zeros((self.CAPACITY, fft_size), dtype = dtype)
+        # Seconds since the capture started at the middle of each row, number of FFT's in each row and number of each row
+        self.times = np.zeros(self.CAPACITY)
+        self.counts = np.zeros(self.CAPACITY, dtype = np.int32)
+        self.numbers = np.full(self.CAPACITY, -1, dtype = np.int64)
+
+        # Sums of the sub-integrations that haven't received all their FFT's yet
+        self.pending = {}
+        self.first_number = 0
+        self.start = monotonic()
+        self.lock = threading.Lock()
+        self.begin(0)
+
+
+    # Creates a dynamic spectrum from the "dynamic_spectrum", "dynamic_capacity" and "dynamic_dtype" config parameters
+    @staticmethod
+    def fromConfig(fft_size, subintegration, capacity, dtype):
+        if subintegration < MIN_SUBINTEGRATION:
+            raise ValueError(f'dynamic_spectrum of {subintegration} FFT\'s per row is too few. Use at least {MIN_SUBINTEGRATION}, or 0 to disable it')
+        return DynamicSpectrum(fft_size, subintegration, capacity, dtype)
+
+
+    # Starts the timing of an integration, whose FFT's each take seconds_per_fft of samples
+    # Without the length of an FFT, fx. when the sample rate is unknown, rows are timed when they're completed
+    def begin(self, seconds_per_fft):
+        self.SECONDS_PER_FFT = seconds_per_fft
+        self.integration_start = monotonic() - self.start
+        self.integration_first_number = self.first_number
+
+
+    # Adds a batch of log10 power spectrums (one unshifted FFT per row) that starts at FFT number first_fft of the integration
+    # valid marks the values that weren't flagged, which are the only ones averaged. Flagged values must be 0
+    # Returns the sum of the batch along the FFT's
+    def add(self, first_fft, log_PSD, valid = None):
+        num_fft, num_channels = log_PSD.shape
+        first_number = self.first_number + first_fft//self.SUBINTEGRATION
+
+        # The batch is split into the end of a sub-integration started in an earlier batch,
+        # whole sub-integrations, which are summed at once, and the start of a sub-integration that continues in a later batch
+        head = min(-first_fft % self.SUBINTEGRATION, num_fft)
+        num_whole = (num_fft - head)//self.SUBINTEGRATION
+        tail = head + num_whole*self.SUBINTEGRATION
+        whole_shape = (num_whole, self.SUBINTEGRATION, num_channels)
+        whole_sums = log_PSD if self.SUBINTEGRATION == 1 else np.sum(log_PSD[head:tail].reshape(whole_shape), axis = 1)
+        if valid is None or self.SUBINTEGRATION == 1:
+            whole_valid = valid
+        else:
+            whole_valid = np.sum(valid[head:tail].reshape(whole_shape), axis = 1)
+        batch_sum = np.sum(whole_sums, axis = 0)
+
+        with self.lock:
+            if head > 0:
+                batch_sum += self.addPartial(first_number, log_PSD[:head], None if valid is None else valid[:head])
+            self.store(first_number + (head > 0), whole_sums, self.SUBINTEGRATION, whole_valid)
+            if tail < num_fft:
+                batch_sum += self.addPartial(first_number + (head > 0) + num_whole, log_PSD[tail:], None if valid is None else valid[tail:])
+
+        return batch_sum
+
+
+    # Adds FFT's to a sub-integration that is split between batches, and stores it when it's complete
+    # Returns the sum of the FFT's
+    def addPartial(self, number, log_PSD, valid):
+        part_sum = np.sum(log_PSD, axis = 0)
+        total, count, valid_count = self.pending.get(number, (0.0, 0, 0))
+        total, count = total + part_sum, count + log_PSD.shape[0]
+        valid_count = valid_count + (log_PSD.shape[0] if valid is None else np.sum(valid, axis = 0))
+        if count >= self.SUBINTEGRATION:
+            self.pending.pop(number, None)
+            self.store(number, total[np.newaxis], count, np.broadcast_to(valid_count, total.shape)[np.newaxis])
+        else:
+            self.pending[number] = (total, count, valid_count)
+        return part_sum
+
+
+    # Stores the remaining partial sub-integrations at the end of an integration
+    # The next integration starts with a new sub-integration
+    def flush(self, num_fft):
+        with self.lock:
+            for number, (total, count, valid_count) in sorted(self.pending.items()):
+                self.store(number, total[np.newaxis], count, np.broadcast_to(valid_count, total.shape)[np.newaxis])
+            self.pending = {}
+            self.first_number += -(-num_fft//self.SUBINTEGRATION)
+
+
+    # Writes the means of consecutive sub-integrations, starting with number first_number, to their rows
+    # Rows are only overwritten by newer sub-integrations
+    # valid_counts is the number of values averaged in each channel if some were flagged. Channels where everything was flagged are NaN
+    def store(self, first_number, totals, count, valid_counts = None):
+        # If more sub-integrations than rows are stored at once, only the newest are kept
+        skipped = max(0, len(totals) - self.CAPACITY)
+        first_number, totals = first_number + skipped, totals[skipped:]
+        valid_counts = valid_counts[skipped:] if valid_counts is not None else None
+
+        # The rows wrap around at most once, so they're written as two contiguous slices
+        first_row = first_number % self.CAPACITY
+        split = min(len(totals), self.CAPACITY - first_row)
+        self.writeRows(first_row, first_number, totals[:split], count, valid_counts[:split] if valid_counts is not None else None)
+        if split < len(totals):
+            self.writeRows(0, first_number + split, totals[split:], count, valid_counts[split:] if valid_counts is not None else None)
+
+
+    # Writes consecutive sub-integrations to the contiguous rows from first_row
+    def writeRows(self, first_row, first_number, totals, count, valid_counts):
+        rows = slice(first_row, first_row + len(totals))
+        numbers = first_number + np.arange(len(totals))
+        # Workers may finish out of order, so a newer sub-integration can already be in a row. Then only the rest are written
+        newer = numbers >= self.numbers[rows]
+        if not newer.all():
+            for index in np.flatnonzero(newer):
+                self.writeRows(first_row + index, first_number + index, totals[index:index + 1], count, valid_counts[index:index + 1] if valid_counts is not None else None)
+            return
+
+        # The means are written straight into the rows
+        if valid_counts is None:
+            np.multiply(totals, 1.0/count, out = self.data[rows])
+        else:
+            np.divide(totals, valid_counts, out = self.data[rows], where = valid_counts > 0)
+            np.copyto(self.data[rows], np.nan, where = valid_counts == 0)
+
+        if self.SECONDS_PER_FFT > 0:
+            self.times[rows] = self.integration_start + ((numbers - self.integration_first_number)*self.SUBINTEGRATION + count/2)*self.SECONDS_PER_FFT
+        else:
+            self.times[rows] = monotonic() - self.start
+        self.counts[rows] = count
+        self.numbers[rows] = numbers
+
+
+    # Adds the rows of an integration of num_fft FFT's that was captured elsewhere, like on a spectrum host
+    # The rows are shifted spectrums in dB from getData. The times are from the start of that integration, which ended now after elapsed seconds
+    def addRows(self, rows, times, counts, num_fft, elapsed):
+        with self.lock:
+            num_rows = -(-num_fft//self.SUBINTEGRATION)
+            numbers = self.first_number + num_rows - len(rows) + np.arange(len(rows))
+            numbers, rows, times, counts = numbers[-self.CAPACITY:], rows[-self.CAPACITY:], times[-self.CAPACITY:], counts[-self.CAPACITY:]
+            indices = numbers % self.CAPACITY
+            self.data[indices] = np.fft.ifftshift((rows + 20.0*np.log10(self.FFT_SIZE))/10.0, axes = 1)
+            self.times[indices] = times + monotonic() - self.start - elapsed
+            self.counts[indices] = counts
+            self.numbers[indices] = numbers
+            self.first_number += num_rows
+
+
+    # Merges copies of the dynamic spectrum that were filled by worker processes from this one
+    # Rows are taken from the copies where they're newer, and the parts of sub-integrations split between copies are summed
+    def merge(self, copies):
+        with self.lock:
+            pending = {}
+            for copy in copies:
+                newer = copy.numbers > self.numbers
+                self.data[newer] = copy.data[newer]
+                self.times[newer] = copy.times[newer]
+                self.counts[newer] = copy.counts[newer]
+                self.numbers[newer] = copy.numbers[newer]
+                for number, (total, count, valid_count) in copy.pending.items():
+                    if number in pending:
+                        merged_total, merged_count, merged_valid_count = pending[number]
+                        total, count, valid_count = merged_total + total, merged_count + count, merged_valid_count + valid_count
+                    pending[number] = (total, count, valid_count)
+
+            for number, (total, count, valid_count) in sorted(pending.items()):
+                if count >= self.SUBINTEGRATION:
+                    self.store(number, total[np.newaxis], count, np.broadcast_to(valid_count, total.shape)[np.newaxis])
+                else:
+                    self.pending[number] = (total, count, valid_count)
+
+
+    # The lock can't be pickled, so copies sent between processes get a new one
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+    # Returns the stored rows as shifted spectrums in dB, and their times and FFT counts, in the order of the sub-integrations
+    def getData(self):
+        with self.lock:
+            order = np.argsort(self.numbers)
+            order = order[self.numbers[order] >= 0]
+            data = np.fft.fftshift(self.data[order], axes = 1)
+            data *= 10.0
+            data -= 20.0*np.log10(self.FFT_SIZE)
+            return data, self.times[order], self.counts[order]
@@ -1,6 +1,7 @@
+import numpy as np
 from astropy import units as u
 from astropy.time import Time
-from astropy.coordinates import SkyCoord, SpectralCoord, EarthLocation, AltAz, ICRS, Galactic
+from astropy.coordinates import SkyCoord, SpectralCoord, EarthLocation, AltAz, ICRS, Galactic, LSR
 
 # Suppress warnings
 import warnings
@@ -8,11 +9,24 @@ from astropy.utils.exceptions import AstropyWarning
 warnings.simplefilter('ignore', category=AstropyWarning)
 
 # Import some helping functions
-from dsp import ANALYSIS
+from analysis import Analysis
+ANALYSIS = Analysis()
+
+# Fields of the table returned by Coordinates.schedule
+SCHEDULE_DTYPE = np.dtype([
+    ("time", "datetime64[us]"),
+    ("ra", float),
+    ("dec", float),
+    ("gal_lon", float),
+    ("gal_lat", float),
+    ("barycenter_correction", float),
+    ("lsr_correction", float)
+])
 
 class Coordinates:
     
     # init function creates pyephem observer and stores it in self
+    # Time may be a single time or a list of times, see schedule()
     def __init__(self, lat, lon, elevation, time):
         self.QTH = EarthLocation(lat = lat*u.degree, lon=lon*u.degree,height=elevation*u.m)
         self.TIME = Time(time)
@@ -64,4 +78,35 @@ class Coordinates:
         correction = ANALYSIS.radialVelFromFreq(freq_wrt_lsrk.value) - radial_vel_wrt_barycenter
         
         return round(correction, 2)
-        
+
+
+    # Computes coordinates and velocity corrections for all the times of this instance at once
+    # Every transform is a single vectorized astropy call on the array of times
+    # Returns a table (structured numpy array) with a row for each time
+    def schedule(self, alt, az):
+        times = self.TIME if not self.TIME.isscalar else self.TIME.reshape((1,))
+        num_times = len(times)
+
+        horizontal_coord = AltAz(alt = np.full(num_times, alt)*u.degree, az = np.full(num_times, az)*u.degree, pressure = 0*u.bar, obstime = times, location = self.QTH)
+        eq_coord = horizontal_coord.transform_to(ICRS())
+        gal_coord = eq_coord.transform_to(Galactic())
+
+        # Corrections are calculated for the rounded coordinates like equatorial() returns
+        ra, dec = np.round(eq_coord.ra.degree, 2), np.round(eq_coord.dec.degree, 2)
+        target = SkyCoord(ra = ra*u.degree, dec = dec*u.degree, frame = 'icrs')
+        barycenter_correction = target.radial_velocity_correction(kind='barycentric', obstime=times, location=self.QTH).to(u.km/u.s).value
+
+        # lsrVelocityCorrection() changes the frame of an observer on Earth to the Local Standard of Rest.
+        # This equals the barycentric correction plus the velocity of the barycenter w.r.t. the LSR along the line of sight.
+        # The observed velocity only changes the result by around 1e-3 km/s, so it's left out.
+        v_bary = LSR().v_bary.xyz.to(u.km/u.s).value
+        line_of_sight = target.transform_to(Galactic()).cartesian.xyz.value
+        lsr_correction = barycenter_correction + v_bary @ line_of_sight
+
+        table = np.zeros(num_times, dtype = SCHEDULE_DTYPE)
+        table["time"] = times.datetime64
+        table["ra"], table["dec"] = ra, dec
+        table["gal_lon"], table["gal_lat"] = np.round(gal_coord.l.degree, 2), np.round(gal_coord.b.degree, 2)
+        table["barycenter_correction"] = np.round(barycenter_correction, 2)
+        table["lsr_correction"] = np.round(lsr_correction, 2)
+        return table
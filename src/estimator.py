@@ -0,0 +1,93 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+'''
+Spectral estimators that turn a batch of samples into power spectrums (one unshifted spectrum per row).
+    fft:    Rectangular window on non-overlapping blocks, the plain FFT.
+    welch:  Windowed blocks that overlap, which lowers the leakage between bins and uses the samples the window suppresses.
+    pfb:    Polyphase filterbank, where TAPS blocks are weighted by a windowed sinc and summed before the FFT.
+            The channels get a flat top and steep edges, so a lower resolution gives clean channels.
+Welch and the filterbank need samples from before the batch. These are passed as the first HISTORY samples of the batch,
+so the spectrums continue across batches and every batch of NUM blocks gives NUM*FRAMES_PER_BLOCK spectrums.
+The taps are scaled so noise has the same power as with the plain FFT, and are cached for each setting.
+'''
+
+KINDS = ["fft", "welch", "pfb"]
+WINDOWS = {"hann": np.hanning, "hamming": np.hamming, "blackman": np.blackman, "rectangular": np.ones}
+
+# Cached taps for each (kind, FFT size, window, overlap or number of taps)
+TAPS_CACHE = {}
+
+class Estimator():
+    def __init__(self, kind, fft_size, window = "hann", overlap = 0.5, taps = 4):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown estimator "{kind}". Available estimators = {KINDS}')
+        if window not in WINDOWS:
+            raise ValueError(f'Unknown window "{window}". Available windows = {list(WINDOWS.keys())}')
+        self.KIND = kind
+        self.FFT_SIZE = fft_size
+
+        # Welch spectrums start every HOP samples
+        self.FRAMES_PER_BLOCK = int(round(1/(1 - overlap))) if kind == "welch" else 1
+        if not 0 <= overlap < 1 or fft_size % self.FRAMES_PER_BLOCK != 0:
+            raise ValueError(f'Overlap {overlap} must give a whole number of spectrums per block, fx. 0, 0.5 or 0.75')
+        self.HOP = fft_size//self.FRAMES_PER_BLOCK
+        self.NUM_TAPS = taps if kind == "pfb" else 1
+
+        # Samples needed from before the batch
+        if kind == "welch":
+            self.HISTORY = fft_size - self.HOP
+        elif kind == "pfb":
+            self.HISTORY = (self.NUM_TAPS - 1)*fft_size
+        else:
+            self.HISTORY = 0
+
+        key = (kind, fft_size, window, overlap if kind == "welch" else self.NUM_TAPS)
+        if key not in TAPS_CACHE:
+            TAPS_CACHE[key] = self.getTaps(WINDOWS[window])
+        # Taps in time order, with one row per block of the filterbank
+        self.TAPS = TAPS_CACHE[key]
+
+
+    # Creates an estimator from the "estimator" config parameter
+    # "fft", "welch:window:overlap" or "pfb:taps:window", fx. "welch:hann:0.5" or "pfb:4:hamming"
+    @staticmethod
+    def fromConfig(parameter, fft_size):
+        kind, *options = parameter.split(":")
+        if kind == "welch":
+            return Estimator(kind, fft_size, *options[:1], *[float(value) for value in options[1:2]])
+        if kind == "pfb":
+            return Estimator(kind, fft_size, *options[1:2], taps = int(options[0]) if options else 4)
+        return Estimator(kind, fft_size)
+
+
+    # Window for Welch or windowed sinc for the filterbank, scaled so the sum of the squared taps is FFT_SIZE
+    def getTaps(self, window):
+        if self.KIND == "pfb":
+            length = self.NUM_TAPS*self.FFT_SIZE
+            taps = np.sinc((np.arange(length) - (length - 1)/2)/self.FFT_SIZE)*window(length)
+        elif self.KIND == "welch":
+            taps = window(self.FFT_SIZE)
+        else:
+            taps = np.ones(self.FFT_SIZE)
+        taps *= np.sqrt(self.FFT_SIZE/np.sum(taps**2))
+        return taps.reshape(self.NUM_TAPS, self.FFT_SIZE)
+
+
+    # Returns the power spectrums of a batch. The first HISTORY samples are from before the batch
+    def power(self, samples):
+        samples = np.asarray(samples, dtype = np.complex128)
+        if self.KIND == "welch":
+            frames = sliding_window_view(samples, self.FFT_SIZE)[::self.HOP]*self.TAPS[0]
+        elif self.KIND == "pfb":
+            # Each spectrum sums NUM_TAPS consecutive blocks weighted by their row of the taps
+            blocks = samples.reshape(-1, self.FFT_SIZE)
+            num_frames = blocks.shape[0] - self.NUM_TAPS + 1
+            frames = blocks[:num_frames]*self.TAPS[0]
+            for tap in range(1, self.NUM_TAPS):
+                frames += blocks[tap:tap + num_frames]*self.TAPS[tap]
+        else:
+            frames = samples.reshape(-1, self.FFT_SIZE)
+
+        spectrum = np.fft.fft(frames, axis = 1)
+        return spectrum.real**2 + spectrum.imag**2
@@ -0,0 +1,77 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+'''
+Smoothing filters for spectrums.
+All kernels work along the last axis, so a single spectrum or a stack of spectrums (one per row) can be filtered at once.
+The edges are padded with the nearest value so the filtered spectrum keeps its length and isn't shifted.
+'''
+
+KERNELS = ["median", "boxcar", "savgol", "hanning"]
+
+class Filter():
+    def __init__(self, kind, width, order = 2):
+        if kind not in KERNELS:
+            raise ValueError(f'Unknown filter "{kind}". Available filters = {KERNELS}')
+        self.KIND = kind
+        # Centered windows need an odd width
+        self.WIDTH = int(width) | 1
+        self.ORDER = order
+
+        if kind == "savgol":
+            self.WEIGHTS = self.savgolWeights(self.WIDTH, order)
+        elif kind == "hanning":
+            # Hanning window without the zero valued end points
+            weights = np.hanning(self.WIDTH + 2)[1:-1]
+            self.WEIGHTS = weights/np.sum(weights)
+
+
+    # Creates a filter from the "median" config parameter
+    # An integer gives a running median of that width, 0 disables filtering
+    # A string of "kernel:width" or "savgol:width:order" selects another kernel, fx. "boxcar:9"
+    @staticmethod
+    def fromConfig(parameter):
+        if isinstance(parameter, str) and ":" not in parameter:
+            parameter = int(parameter)
+        if isinstance(parameter, str):
+            kind, width, *order = parameter.split(":")
+            if int(width) == 0:
+                return None
+            return Filter(kind, int(width), *[int(value) for value in order])
+        if parameter == 0:
+            return None
+        return Filter("median", parameter)
+
+
+    # Filters data along the last axis. The result is written to out if given, which may be data itself
+    def apply(self, data, out = None):
+        data = np.asarray(data, dtype = float)
+        if out is None:
+            out = np.empty_like(data)
+
+        half_width = self.WIDTH//2
+        pad_width = [(0, 0)]*(data.ndim - 1) + [(half_width, half_width)]
+        padded = np.pad(data, pad_width, mode = 'edge')
+
+        if self.KIND == "boxcar":
+            return self.boxcar(padded, out)
+        windows = sliding_window_view(padded, self.WIDTH, axis = -1)
+        if self.KIND == "median":
+            return np.median(windows, axis = -1, out = out)
+        return np.matmul(windows, self.WEIGHTS, out = out)
+
+
+    # Running mean through the difference of a cumulative sum
+    def boxcar(self, padded, out):
+        cumulative = np.cumsum(padded, axis = -1)
+        np.subtract(cumulative[..., self.WIDTH - 1:], np.concatenate((np.zeros(padded.shape[:-1] + (1,)), cumulative[..., :-self.WIDTH]), axis = -1), out = out)
+        out /= self.WIDTH
+        return out
+
+
+    # Weights of a Savitzky-Golay filter. Equal to evaluating a least squares polynomial fit at the center of the window
+    @staticmethod
+    def savgolWeights(width, order):
+        x = np.arange(width) - width//2
+        vandermonde = np.vander(x, order + 1, increasing = True)
+        return np.linalg.pinv(vandermonde)[0]
@@ -0,0 +1,46 @@
+import os
+import shutil
+
+'''
+Offline handling of the IERS Earth orientation tables used by astropy.
+By default astropy downloads the newest IERS-A table when it's needed, which stalls or fails without internet.
+Run "python3 src/iers.py <folder>" while online to fetch the table into a cache folder,
+and set "iers_cache" in config.json to that folder to use it without internet.
+'''
+
+IERS_A_FILE = "finals2000A.all"
+
+# Configures astropy to use the cached IERS-A table and never download anything
+# An empty path keeps astropy's default behaviour
+def configureIERS(cache_path):
+    if not cache_path:
+        return
+
+    from astropy.utils import iers
+    from astropy.utils.data import conf as data_conf
+
+    data_conf.allow_internet = False
+    iers.conf.auto_download = False
+    iers.conf.auto_max_age = None
+
+    table_path = os.path.join(cache_path, IERS_A_FILE)
+    if os.path.exists(table_path):
+        iers.earth_orientation_table.set(iers.IERS_A.open(table_path))
+    else:
+        print(f'No IERS table found at {table_path}, using the table bundled with astropy')
+
+
+# Downloads the newest IERS-A table into the cache folder
+def prefetchIERS(cache_path):
+    from astropy.utils import iers
+    from astropy.utils.data import download_file
+
+    os.makedirs(cache_path, exist_ok = True)
+    downloaded = download_file(iers.IERS_A_URL, cache = "update")
+    shutil.copyfile(downloaded, os.path.join(cache_path, IERS_A_FILE))
+    print(f'Saved IERS table to {os.path.join(cache_path, IERS_A_FILE)}')
+
+
+if __name__ == "__main__":
+    import sys
+    prefetchIERS(sys.argv[1] if len(sys.argv) > 1 else "iers")
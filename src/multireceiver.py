@@ -0,0 +1,202 @@
+import copy
+import threading
+import warnings
+from time import perf_counter
+import numpy as np
+
+from dynspec import DynamicSpectrum
+from rfi import RFIFlagger
+
+'''
+Observing with several receivers at once, fx. dongles on separate hosts.
+Every receiver integrates on its own thread with its own copy of the DSP and its own RFI flaggers, since the RFI at each site differs.
+The spectrums are aligned on the frequency axis of the DSP, where each receiver's residual frequency offset in PPM
+(the part the tuner can't correct in whole PPM) is interpolated away.
+The spectrums of a single integration are averaged. When both the H-line and the blank have been integrated,
+combineBeams weights every receiver by the inverse of its noise variance in the SNR spectrum,
+so a noisy receiver counts less, and the same weights are used for the H-line and blank so the bandpasses still cancel.
+A receiver that fails is left out for the rest of the observation and reported in the health stats.
+'''
+
+# Scales the MAD to the standard deviation of normal distributed data
+MAD_SCALE = 1.4826
+# combine gives one spectrum, while beams also keeps the spectrum of every receiver
+MODES = ["combine", "beams"]
+
+class MultiReceiver():
+    # names identify the receivers, and ppm_residuals are their frequency offsets in PPM that aren't corrected by the tuners
+    def __init__(self, receivers, names, sample_rate, ppm_residuals = None, mode = "combine"):
+        if mode not in MODES:
+            raise ValueError(f'Unknown receiver mode "{mode}". Available modes = {MODES}')
+        self.KEEP_BEAMS = mode == "beams"
+        self.RECEIVERS = receivers
+        self.NAMES = names
+        self.SAMPLE_RATE = sample_rate
+        self.PPM_RESIDUALS = ppm_residuals if ppm_residuals is not None else [0.0]*len(receivers)
+        self.gain = 'auto'
+        self._center_freq = 0
+
+        # RFI flaggers for each receiver, frequency and FFT size, kept between observations like those of the observation
+        self.rfi_flaggers = {}
+        self.health = {name: {"integrations": 0, "failures": 0, "samples": 0, "elapsed": 0.0, "last_error": None} for name in names}
+        self.resetBeams()
+
+
+    # The integrated spectrums of each receiver at each frequency are kept until the next observation
+    def resetBeams(self):
+        self.spectrums = {}
+        self.failed = set()
+
+
+    # Configures receivers that integrate themselves, like spectrum hosts, and starts a new observation
+    def configure(self, sample_rate, dsp_param):
+        self.resetBeams()
+        for receiver in self.RECEIVERS:
+            if hasattr(receiver, "configure"):
+                receiver.configure(sample_rate, dsp_param)
+
+
+    @property
+    def center_freq(self):
+        return self._center_freq
+
+    # Receivers that can't be retuned are left out like receivers that fail to integrate
+    @center_freq.setter
+    def center_freq(self, freq):
+        for index, receiver in enumerate(self.RECEIVERS):
+            if index in self.failed:
+                continue
+            try:
+                receiver.center_freq = freq
+            except Exception as err:
+                self.recordFailure(index, err)
+        self._center_freq = freq
+
+
+    # Integrates on every receiver at once with copies of the DSP and returns the mean of their aligned spectrums
+    # The flagged counts of every receiver are added to the RFI flagger, and the mean of their sub-integrations to the dynamic spectrum
+    def sampleReceivers(self, DSP, dynamic_spectrum = None, rfi_flagger = None):
+        active = [index for index in range(len(self.RECEIVERS)) if index not in self.failed]
+        results = {}
+        threads = [threading.Thread(target = self.sampleReceiver, args = (index, DSP, dynamic_spectrum, rfi_flagger, results), name = f"receiver-{self.NAMES[index]}", daemon = True) for index in active]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if not results:
+            errors = ", ".join(f'{name} ({self.health[name]["last_error"]})' for name in self.NAMES)
+            raise RuntimeError(f'Every receiver failed: {errors}')
+
+        self.freqs = DSP.generateFreqs(self.SAMPLE_RATE)
+        spectrums = {}
+        for index, (spectrum, flagger, capture) in results.items():
+            spectrums[index] = self.align(spectrum, index)
+            self.spectrums.setdefault(self.center_freq, {}).setdefault(index, []).append(spectrum)
+            if rfi_flagger is not None:
+                rfi_flagger.addStats(flagger.stats)
+        if dynamic_spectrum is not None:
+            rows = [capture.getData() for spectrum, flagger, capture in results.values()]
+            # Channels flagged by every receiver stay NaN
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                mean_rows = np.nanmean([data for data, times, counts in rows], axis = 0)
+            dynamic_spectrum.addRows(mean_rows, rows[0][1], rows[0][2], DSP.NUM_FFT*DSP.ESTIMATOR.FRAMES_PER_BLOCK, perf_counter() - start)
+
+        DSP.stats = {}
+        return np.mean(list(spectrums.values()), axis = 0)
+
+
+    # Integrates on one receiver. Failures are recorded instead of raised, so the other receivers finish
+    def sampleReceiver(self, index, DSP, dynamic_spectrum, rfi_flagger, results):
+        name = self.NAMES[index]
+        receiver_DSP = copy.copy(DSP)
+        flagger = None
+        if rfi_flagger is not None:
+            key = (index, self.center_freq, DSP.FFT_SIZE)
+            if key not in self.rfi_flaggers:
+                self.rfi_flaggers[key] = RFIFlagger(threshold = rfi_flagger.THRESHOLD, persistent = rfi_flagger.PERSISTENT)
+            flagger = self.rfi_flaggers[key]
+            flagger.resetStats()
+        capture = DynamicSpectrum(DSP.FFT_SIZE, dynamic_spectrum.SUBINTEGRATION, dynamic_spectrum.CAPACITY, dynamic_spectrum.data.dtype.name) if dynamic_spectrum is not None else None
+
+        start = perf_counter()
+        try:
+            spectrum = receiver_DSP.sample(self.RECEIVERS[index], capture, flagger)
+        except Exception as err:
+            self.recordFailure(index, err)
+            return
+        self.health[name]["integrations"] += 1
+        self.health[name]["samples"] += DSP.NUM_FFT*DSP.BLOCK_SAMPLES
+        self.health[name]["elapsed"] += perf_counter() - start
+        results[index] = (spectrum, flagger, capture)
+
+
+    def recordFailure(self, index, err):
+        self.failed.add(index)
+        self.health[self.NAMES[index]]["failures"] += 1
+        self.health[self.NAMES[index]]["last_error"] = f'{type(err).__name__}: {err}'
+
+
+    # Interpolates a spectrum of a receiver onto the frequency axis, when the receiver is off by a residual PPM offset
+    def align(self, spectrum, index):
+        if self.PPM_RESIDUALS[index] == 0:
+            return spectrum
+        shift = self.PPM_RESIDUALS[index]*1e-6*self.center_freq
+        return np.interp(self.freqs, self.freqs + shift, spectrum)
+
+
+    # Returns the H-line and blank spectrums combined with inverse noise weights, and the H-line and blank spectrums of each receiver
+    # Only receivers that integrated both are combined. Returns None if the blank wasn't integrated in this observation
+    def combineBeams(self, h_line_freq, blank_freq):
+        h_line_spectrums, blank_spectrums = self.spectrums.get(h_line_freq, {}), self.spectrums.get(blank_freq, {})
+        indices = [index for index in h_line_spectrums if index in blank_spectrums and index not in self.failed]
+        if not indices:
+            return None
+
+        # The noise is estimated before the spectrums are aligned, since interpolating smooths it
+        beams = {}
+        weights = []
+        for index in indices:
+            # Switching cycles give several spectrums at each frequency, which have the same number of FFT's
+            h_line_data, blank_data = np.mean(h_line_spectrums[index], axis = 0), np.mean(blank_spectrums[index], axis = 0)
+            weights.append(1/max(self.getNoise(h_line_data - blank_data), 1e-12)**2)
+            beams[self.NAMES[index]] = (self.align(h_line_data, index), self.align(blank_data, index))
+
+        weights = np.array(weights)/np.sum(weights)
+        for index, weight in zip(indices, weights):
+            self.health[self.NAMES[index]]["weight"] = float(weight)
+        h_line_data = np.sum([weight*beams[self.NAMES[index]][0] for index, weight in zip(indices, weights)], axis = 0)
+        blank_data = np.sum([weight*beams[self.NAMES[index]][1] for index, weight in zip(indices, weights)], axis = 0)
+        return h_line_data, blank_data, beams
+
+
+    # Noise of a spectrum from the differences between neighbouring channels, which removes the bandpass and the H-line
+    def getNoise(self, spectrum):
+        differences = np.diff(spectrum)
+        return MAD_SCALE*np.median(np.abs(differences - np.median(differences)))/np.sqrt(2)
+
+
+    # Returns the health of each receiver, with the throughput in samples per second while integrating
+    def getHealth(self):
+        health = {}
+        for index, name in enumerate(self.NAMES):
+            stats = self.health[name].copy()
+            stats["throughput"] = stats["samples"]/stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+            stats["active"] = index not in self.failed
+            if hasattr(self.RECEIVERS[index], "getStats"):
+                stream = self.RECEIVERS[index].getStats()
+                stats["stalls"], stats["overflows"] = stream["stalls"], stream["overflows"]
+            health[name] = stats
+        return health
+
+
+    def read_samples(self, num_samples):
+        raise RuntimeError("Several receivers can't be read as one stream of samples")
+
+
+    def close(self):
+        for receiver in self.RECEIVERS:
+            if hasattr(receiver, "close"):
+                receiver.close()
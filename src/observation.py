@@ -1,11 +1,17 @@
 import json
+import numpy as np
+from datetime import datetime
 
 # Import necessary classes/modules
+# Plotting and ephemeris (matplotlib and astropy) are imported when used, since they are slow to import
 from rtl import RTL
-from plot import Plotter
-from ephemeris import Coordinates as coords
 from dsp import DSP as dsp
 from analysis import Analysis
+from reference import ReferenceCache
+from store import ObservationStore
+from dynspec import DynamicSpectrum
+from rfi import RFIFlagger
+from adaptive import AdaptiveIntegration
 
 class Observation:
     # Initialize observation with corresponding parameters
@@ -13,21 +19,42 @@ class Observation:
         self.ONE_DAY_OBSERVING = kwargs["24h"]
         self.DEG_INTERVAL = kwargs["degree_interval"]
         self.DATAFILE = kwargs["datafile"]
+        # Observations are appended to a binary survey file unless JSON datafiles are chosen
+        self.DATAFILE_FORMAT = kwargs["datafile_format"]
+        self.SURVEY_FILE = kwargs["survey_file"]
+        # Number of on/off switching cycles each observation is split into
+        self.SWITCHING_CYCLES = max(1, kwargs["switching_cycles"])
+        self.REFERENCE_CACHE = ReferenceCache(max_age = kwargs["reference_max_age"], max_drift = kwargs["reference_max_drift"])
+        self.PLOTTER = None
+        self.H_LINE_FREQ = 1420405750
+        self.BLANK_FREQ = self.H_LINE_FREQ + 3200000
+        # RFI flaggers for each frequency and FFT size, kept between observations so persistent RFI stays masked
+        self.RFI_FLAGGERS = {}
     
 
     # Get's the wanted SDR or runs a host
     def getSDR(self, **param):
-        SDR = RTL(sample_rate = param["sample_rate"], PPM_offset = param["PPM_offset"], host_IP = param["host_IP"])
+        SDR = RTL(sample_rate = param["sample_rate"], PPM_offset = param["PPM_offset"], host_IP = param["host_IP"], host_port = param["host_port"], host_mode = param["host_mode"])
         # Host server
         if param["TCP_host"]:
-            SDR.tcpHost()
+            SDR.tcpHost(simulate = param["simulate"])
             quit()
         
         # Get SDR
-        if param["connect_to_host"]:
+        if param["simulate"]:
+            sdr = SDR.rtlSimulator()
+        elif param["replay_path"]:
+            sdr = SDR.rtlReplay(param["replay_path"])
+        elif param["receivers"]:
+            sdr = SDR.rtlMultiReceiver(param["receivers"], param["receiver_mode"])
+        elif param["connect_to_host"]:
             sdr = SDR.rtlTcpClient()
         else:
             sdr = SDR.rtlClient()
+
+        # Record everything read from the SDR
+        if param["record_path"]:
+            sdr = SDR.rtlRecorder(sdr, param["record_path"])
         
         return sdr
 
@@ -39,6 +66,8 @@ class Observation:
         alt, az = coordinates['altitude'], coordinates['azimuth']
         elevation = coordinates['elevation']
         self.time = current_time
+        self.ALT_AZ = (alt, az)
+        from ephemeris import Coordinates as coords
 
         # Instantiate an observer
         Coordinates = coords(lat, lon, elevation, current_time)
@@ -48,45 +77,193 @@ class Observation:
         return Coordinates
     
 
+    # Calculates coordinates and velocity corrections for a list of observation times in one go
+    # The table is read by useScheduleEntry() before each observation
+    def getSchedule(self, times, **coordinates):
+        lat, lon = coordinates['latitude'], coordinates['longitude']
+        alt, az = coordinates['altitude'], coordinates['azimuth']
+        elevation = coordinates['elevation']
+        self.ALT_AZ = (alt, az)
+        from ephemeris import Coordinates as coords
+        from iers import configureIERS
+
+        # Set up the IERS tables before astropy needs them
+        configureIERS(coordinates['iers_cache'])
+        self.SCHEDULE = coords(lat, lon, elevation, times).schedule(alt, az)
+        return self.SCHEDULE
+
+
+    # Recalculates a schedule entry for a new time, fx. when an observation starts later than planned
+    def updateScheduleEntry(self, index, time, **coordinates):
+        from ephemeris import Coordinates as coords
+        self.SCHEDULE[index] = coords(coordinates['latitude'], coordinates['longitude'], coordinates['elevation'], [time]).schedule(coordinates['altitude'], coordinates['azimuth'])[0]
+
+
+    # Sets the time, coordinates and velocity corrections of an observation from the schedule
+    def useScheduleEntry(self, index):
+        entry = self.SCHEDULE[index]
+        self.time = entry["time"].astype(datetime)
+        self.RA, self.DEC = float(entry["ra"]), float(entry["dec"])
+        self.GAL_LON, self.GAL_LAT = float(entry["gal_lon"]), float(entry["gal_lat"])
+        self.barycenter_vel_correction = float(entry["barycenter_correction"])
+        self.lsr_vel_correction = float(entry["lsr_correction"])
+
+
     # Collects data from a given SDR
     def collectData(self, sdr, sample_rate, **dsp_param):
-        # Returns the final processed data
-        DSP = dsp(resolution = dsp_param["resolution"], num_fft = dsp_param["number_of_fft"], median = dsp_param["median"])
+        # Interleaved switching splits the FFT's into shorter on/off sub-integrations
+        num_fft = max(1, dsp_param["number_of_fft"]//self.SWITCHING_CYCLES)
+
+        # Adaptive integration checks the SNR after every chunk of adaptive_check batches, with number_of_fft as the limit
+        # Spectrum hosts and several receivers integrate a whole pass at once, so they integrate a fixed number of FFT's
+        adaptive = AdaptiveIntegration.fromConfig(dsp_param["adaptive"], dsp_param["adaptive_max_time"], dsp_param["checkpoint_path"])
+        if self.SWITCHING_CYCLES > 1 or hasattr(sdr, "integrate") or hasattr(sdr, "sampleReceivers"):
+            adaptive = None
+        if adaptive is not None:
+            num_fft = max(1, min(dsp_param["number_of_fft"], dsp_param["adaptive_check"]*dsp_param["batch_size"]))
+
+        # Returns the final processed data. Optionally zooms in on a band of velocities around the H-line
+        DSP = dsp.fromConfig(sample_rate, num_fft, **dsp_param)
+        # A spectrum host integrates with the same DSP settings
+        if hasattr(sdr, "configure"):
+            sdr.configure(sample_rate, dsp_param)
         
         # Now, collect data
-        sdr.center_freq = 1420405750
+        h_line_freq = self.H_LINE_FREQ
+        blank_freq = self.BLANK_FREQ
         self.freqs = DSP.generateFreqs(sample_rate = sample_rate)
-        self.h_line_data = DSP.sample(sdr)
-        
-        # Sample blank
-        sdr.center_freq += 3200000
-        self.blank_data = DSP.sample(sdr)
 
-        # Get SNR spectrum, correct for slant and apply median filter
-        SNR_spectrum = DSP.combineSpectrums(freqs = self.freqs, h_line_data = self.h_line_data, blank_data = self.blank_data)
-        self.SNR_spectrum = DSP.correctSlant(SNR_spectrum)
-        if dsp_param["median"] != 0:
-            self.SNR_spectrum = DSP.applyMedian(self.SNR_spectrum)
+        # Optionally capture sub-integrations of the H-line and blank spectrums
+        self.dynamic_spectrums = {}
+        if dsp_param["dynamic_spectrum"] > 0:
+            self.dynamic_spectrums = {name: DynamicSpectrum.fromConfig(DSP.FFT_SIZE, dsp_param["dynamic_spectrum"], dsp_param["dynamic_capacity"], dsp_param["dynamic_dtype"]) for name in ["H-line", "Blank"]}
+
+        # Optionally flag RFI and leave it out of the H-line and blank spectrums
+        self.rfi_flaggers = {}
+        if dsp_param["rfi_flagging"]:
+            for name, freq in [("H-line", h_line_freq), ("Blank", blank_freq)]:
+                key = (freq, DSP.FFT_SIZE)
+                if key not in self.RFI_FLAGGERS:
+                    self.RFI_FLAGGERS[key] = RFIFlagger(threshold = dsp_param["rfi_threshold"], persistent = dsp_param["rfi_persistent"])
+                self.rfi_flaggers[name] = self.RFI_FLAGGERS[key]
+                self.rfi_flaggers[name].resetStats()
+
+        self.adaptive_stats = {}
+        if adaptive is not None:
+            # The blank is integrated along with the H-line, so the SNR can be checked while integrating
+            # A checkpoint is only resumed with the same settings and pointing on the same day
+            # 24h observations restart with the same schedule, so they also need the same time
+            key = f"{sample_rate}|{DSP.FFT_SIZE}|{dsp_param['number_of_fft']}|{DSP.NUM_FFT}|{self.ALT_AZ}|" + (str(self.time) if self.ONE_DAY_OBSERVING else str(self.time.date()))
+            getSNRSpectrum = lambda h_line_data, blank_data: self.getSNRSpectrum(DSP, h_line_data, blank_data)
+            self.h_line_data, self.blank_data = adaptive.sample(sdr, DSP, self.freqs, h_line_freq, blank_freq, dsp_param["number_of_fft"], getSNRSpectrum, self.dynamic_spectrums, self.rfi_flaggers, key)
+            self.sample_stats = adaptive.sample_stats
+            self.adaptive_stats = adaptive.stats
+            self.blank_reused = False
+        elif self.SWITCHING_CYCLES > 1:
+            self.h_line_data, self.blank_data = self.sampleInterleaved(sdr, DSP, h_line_freq, blank_freq)
+            self.blank_reused = False
+        else:
+            sdr.center_freq = h_line_freq
+            self.h_line_data = DSP.sample(sdr, self.dynamic_spectrums.get("H-line"), self.rfi_flaggers.get("H-line"))
+            self.sample_stats = {"H-line": DSP.stats}
+
+            # Reuse the blank from a previous observation if it's still valid
+            reference_key = ReferenceCache.getKey(sdr, blank_freq, sample_rate, DSP.FFT_SIZE)
+            self.blank_data = self.REFERENCE_CACHE.get(reference_key, self.h_line_data)
+            self.blank_reused = self.blank_data is not None
+
+            # A reused blank wasn't integrated in this observation, so it has no flagged fractions or dynamic spectrum
+            if self.blank_reused:
+                self.rfi_flaggers.pop("Blank", None)
+                self.dynamic_spectrums.pop("Blank", None)
+            
+            # Sample blank
+            if not self.blank_reused:
+                sdr.center_freq = blank_freq
+                self.blank_data = DSP.sample(sdr, self.dynamic_spectrums.get("Blank"), self.rfi_flaggers.get("Blank"))
+                self.sample_stats["Blank"] = DSP.stats
+                self.REFERENCE_CACHE.put(reference_key, self.blank_data, self.h_line_data)
+
+        # Fractions of the values flagged as RFI in this observation
+        self.rfi_stats = {name: flagger.getFractions() for name, flagger in self.rfi_flaggers.items()}
+
+        # Several receivers are combined with inverse noise weights when both the H-line and blank were integrated
+        # Each receiver's SNR spectrum is kept as a beam if wanted
+        self.beams = {}
+        self.receiver_health = {}
+        if hasattr(sdr, "combineBeams"):
+            combined = sdr.combineBeams(h_line_freq, blank_freq)
+            if combined is not None:
+                self.h_line_data, self.blank_data, beams = combined
+                if sdr.KEEP_BEAMS:
+                    self.beams = {name: self.getSNRSpectrum(DSP, h_line_data, blank_data) for name, (h_line_data, blank_data) in beams.items()}
+            self.receiver_health = sdr.getHealth()
+
+        self.SNR_spectrum = self.getSNRSpectrum(DSP, self.h_line_data, self.blank_data)
+
+
+    # Get SNR spectrum, correct for the baseline and apply the smoothing filter
+    def getSNRSpectrum(self, DSP, h_line_data, blank_data):
+        SNR_spectrum = DSP.combineSpectrums(freqs = self.freqs, h_line_data = h_line_data, blank_data = blank_data)
+        SNR_spectrum = DSP.correctBaseline(self.freqs, SNR_spectrum)
+        return DSP.applyFilter(SNR_spectrum)
 
     
+    # Alternates between short H-line and blank sub-integrations
+    # Every other cycle is sampled in reverse order (on, off, off, on, ...) which cancels linear drifts
+    # Neighbouring sub-integrations at the same frequency share a tune, so only one retune is needed for each cycle
+    def sampleInterleaved(self, sdr, DSP, h_line_freq, blank_freq):
+        h_line_spectrums, blank_spectrums = [], []
+        self.sample_stats = {}
+        tuned_freq = None
+        for cycle in range(self.SWITCHING_CYCLES):
+            order = [h_line_freq, blank_freq] if cycle % 2 == 0 else [blank_freq, h_line_freq]
+            for freq in order:
+                if freq != tuned_freq:
+                    sdr.center_freq = freq
+                    tuned_freq = freq
+                name = "H-line" if freq == h_line_freq else "Blank"
+                spectrum = DSP.sample(sdr, self.dynamic_spectrums.get(name), self.rfi_flaggers.get(name))
+                if freq == h_line_freq:
+                    h_line_spectrums.append(spectrum)
+                else:
+                    blank_spectrums.append(spectrum)
+                self.sample_stats[f"{name} {cycle + 1}"] = DSP.stats
+
+        # Each sub-integration has the same number of FFT's, so the mean of the means is the overall mean
+        return np.mean(h_line_spectrums, axis = 0), np.mean(blank_spectrums, axis = 0)
+
+
     # Gets the radial velocity, LSR correction, max SNR and etc
-    def analyzeData(self, coord_class):
+    # Without a coordinate class, the corrections from the schedule entry are used
+    def analyzeData(self, coord_class = None):
         ANALYSIS_CLASS = Analysis()
         # Get radial velocity and maximum SNR
         self.max_SNR, self.observed_radial_velocity = ANALYSIS_CLASS.getRadialVelocity(self.SNR_spectrum, self.freqs)
 
         # Get frequency corrections w.r.t. barycenter and Local Standard of Rest
-        self.barycenter_vel_correction = coord_class.barycenterVelocityCorrection(self.RA, self.DEC)
+        if coord_class is not None:
+            self.barycenter_vel_correction = coord_class.barycenterVelocityCorrection(self.RA, self.DEC)
         vel_wrt_barycenter = self.observed_radial_velocity + self.barycenter_vel_correction
-        self.lsr_vel_correction = coord_class.lsrVelocityCorrection(self.RA, self.DEC, vel_wrt_barycenter)
+        if coord_class is not None:
+            self.lsr_vel_correction = coord_class.lsrVelocityCorrection(self.RA, self.DEC, vel_wrt_barycenter)
         self.corrected_radial_vel = vel_wrt_barycenter + self.lsr_vel_correction
 
 
     # Plot the data
+    # Returns the rendered plot, which can be added to an animation
     def plotData(self, **params):
-        PLOT = Plotter(params["plot_map"], params["y_min"], params["y_max"])
+        from plot import Plotter
+        # The plotter is kept between observations so it can reuse its figure
+        if self.PLOTTER is None:
+            self.PLOTTER = Plotter(params["plot_map"], params["y_min"], params["y_max"], params["reuse_figure"])
+
+        return self.PLOTTER.plot(self.freqs,self.SNR_spectrum,**self.getPlotInfo())
+
 
-        plot_info = {
+    # Returns the observation details shown on the plot
+    def getPlotInfo(self):
+        return {
             "ra": self.RA,
             "dec": self.DEC,
             "gal_lon": self.GAL_LON,
@@ -96,13 +273,17 @@ class Observation:
             "SNR": self.max_SNR,
             "observed_radial_velocity": self.observed_radial_velocity
         }
-        PLOT.plot(self.freqs,self.SNR_spectrum,**plot_info)
 
 
     # Writes a datafile with all the collected data from the observation
     def writeDatafile(self, **kwargs):
+        saveDatafile(self.getDatafile(**kwargs), self.getDatafilePath())
+
+
+    # Returns the content of the datafile. The spectrums are kept as arrays until the file is saved
+    def getDatafile(self, **kwargs):
         # kwargs = SDR, DSP, observer and observation parameters
-        json_file = {
+        content = {
             "Observation parameters": kwargs,
             "Observation results": {
                 "Time": str(self.time),
@@ -114,20 +295,44 @@ class Observation:
                 "Barycenter correction": self.barycenter_vel_correction,
                 "LSR correction": self.lsr_vel_correction,
                 "Radial velocity": self.corrected_radial_vel,
-                "Max SNR": self.max_SNR
+                "Max SNR": self.max_SNR,
+                "Blank reused": self.blank_reused,
+                "Flagged fractions": self.rfi_stats,
+                "Receivers": self.receiver_health,
+                "Adaptive integration": self.adaptive_stats
             },
             "Data": {
-                "Blank spectrum": self.blank_data.tolist(),
-                "H-line spectrum": self.h_line_data.tolist(),
-                "SNR Spectrum": self.SNR_spectrum.tolist(),
-                "Frequency list": self.freqs.tolist()
+                "Blank spectrum": self.blank_data,
+                "H-line spectrum": self.h_line_data,
+                "SNR Spectrum": self.SNR_spectrum,
+                "Frequency list": self.freqs
             }
         }
 
-        # Save file
-        with open(f"Spectrums/data(ra={self.RA},dec={self.DEC}).json", "w") as file:
-            json.dump(json_file, file, indent = 4)
-            
+        # SNR spectrums of each receiver
+        for name, SNR_spectrum in self.beams.items():
+            content["Data"][f"{name} SNR spectrum"] = SNR_spectrum
+
+        # Sub-integrations in time order, with the seconds since the start of the observation and number of FFT's of each row
+        for name, dynamic_spectrum in self.dynamic_spectrums.items():
+            data, times, counts = dynamic_spectrum.getData()
+            content["Data"][f"{name} dynamic spectrum"] = data
+            content["Data"][f"{name} dynamic spectrum times"] = times
+            content["Data"][f"{name} dynamic spectrum FFT counts"] = counts
+        return content
+
+
+    def getDatafilePath(self):
+        if self.DATAFILE_FORMAT == "json":
+            return f"Spectrums/data(ra={self.RA},dec={self.DEC}).json"
+        return self.SURVEY_FILE
 
 
-        
\ No newline at end of file
+# Saves datafile content. JSON files get one file per observation, other paths are binary survey files that the observation is appended to
+def saveDatafile(content, path):
+    if path.endswith(".json"):
+        # Numpy arrays and values are converted to lists and floats
+        with open(path, "w") as file:
+            json.dump(content, file, indent = 4, default = lambda value: value.tolist())
+    else:
+        ObservationStore(path).append(content)
@@ -0,0 +1,93 @@
+import queue
+import threading
+from collections import deque
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+Background output stage.
+Plots are rendered by a pool of processes and datafiles are written by a thread,
+so the next observation can start while the previous results are still being saved.
+Both are bounded, so submitting blocks if the output falls too far behind the observations.
+If an animation is given, the rendered plots are sent back and added to it in the order they were submitted.
+'''
+
+# The plotter of each worker process. It's kept between plots so it can reuse its figure
+PLOTTER = None
+
+def initPlotter(plot_params):
+    global PLOTTER
+    from plot import Plotter
+    PLOTTER = Plotter(plot_params["plot_map"], plot_params["y_min"], plot_params["y_max"], plot_params["reuse_figure"])
+
+
+# Returns the rendered plot if it's needed for an animation
+def plotResults(freqs, data, plot_info, return_frame):
+    frame = PLOTTER.plot(freqs, data, **plot_info)
+    return frame if return_frame else None
+
+
+class OutputStage():
+    def __init__(self, plot_params, num_workers, max_pending, animation = None):
+        self.PLOT_POOL = ProcessPoolExecutor(max_workers = max(1, num_workers), initializer = initPlotter, initargs = (plot_params,))
+        # Limits the number of plots waiting in the pool
+        self.pending_plots = threading.BoundedSemaphore(max(1, max_pending))
+        self.write_queue = queue.Queue(maxsize = max(1, max_pending))
+        self.errors = []
+        self.ANIMATION = animation
+        # Plots waiting to be added to the animation, in order of submission
+        self.frames = deque()
+
+        self.writer = threading.Thread(target = self.writeLoop, name = "datafile-writer", daemon = True)
+        self.writer.start()
+
+
+    # Hands the results of an observation to the workers
+    # Blocks if max_pending plots or datafiles are already waiting
+    def submit(self, freqs, data, plot_info, datafile = None, datafile_path = None):
+        self.pending_plots.acquire()
+        future = self.PLOT_POOL.submit(plotResults, freqs, data, plot_info, self.ANIMATION is not None)
+        future.add_done_callback(self.plotDone)
+        if self.ANIMATION is not None:
+            self.frames.append(future)
+            self.addFrames()
+
+        if datafile is not None:
+            self.write_queue.put((datafile, datafile_path))
+
+
+    def plotDone(self, future):
+        self.pending_plots.release()
+        if future.exception() is not None:
+            self.errors.append(f'Plotting failed: {future.exception()}')
+
+
+    # Adds the finished plots to the animation. Stops at the first unfinished plot to keep the order
+    def addFrames(self, wait = False):
+        while self.frames and (wait or self.frames[0].done()):
+            future = self.frames.popleft()
+            if future.exception() is None:
+                self.ANIMATION.addFrame(future.result())
+
+
+    def writeLoop(self):
+        from observation import saveDatafile
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            datafile, path = item
+            try:
+                saveDatafile(datafile, path)
+            except Exception:
+                self.errors.append(f'Writing {path} failed: {traceback.format_exc()}')
+
+
+    # Waits for all results to be saved and returns the errors that occured
+    def close(self):
+        self.write_queue.put(None)
+        self.writer.join()
+        if self.ANIMATION is not None:
+            self.addFrames(wait = True)
+        self.PLOT_POOL.shutdown(wait = True)
+        return self.errors
@@ -0,0 +1,133 @@
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from time import perf_counter
+import numpy as np
+
+from pipeline import Pipeline
+
+'''
+Pipeline with worker processes instead of threads, for resolutions where the FFT's need more than one core.
+NumPy's FFT runs on one core and holds the GIL for part of the work, so threads don't scale for large FFT's.
+The ring buffer and the length and first FFT of each block are in shared memory, so the workers read the blocks
+without them being pickled. Only slot numbers are sent through the queues.
+Each worker keeps its own partial sums and its own copies of the RFI flagger and dynamic spectrum,
+which are sent back and merged when the integration is done.
+The workers only see their own batches during the integration, so channels are masked persistently by the RFI flagger
+after more batches than with threads, though the merged mask is the same.
+'''
+
+class ProcessPipeline(Pipeline):
+    # Integrates NUM_FFT FFT's from the SDR and returns the unshifted sum of the log power spectrums and the number of FFT's in each channel
+    def run(self, sdr):
+        context = multiprocessing.get_context()
+        ring_shape = self.ring.shape
+        shared_ring = shared_memory.SharedMemory(create = True, size = int(np.prod(ring_shape))*np.dtype(np.complex64).itemsize)
+        shared_info = shared_memory.SharedMemory(create = True, size = 2*self.NUM_SLOTS*np.dtype(np.int64).itemsize)
+        try:
+            self.ring = np.ndarray(ring_shape, dtype = np.complex64, buffer = shared_ring.buf)
+            self.block_lengths, self.block_first_fft = np.ndarray((2, self.NUM_SLOTS), dtype = np.int64, buffer = shared_info.buf)
+
+            self.free_slots = context.Queue()
+            self.filled_slots = context.Queue()
+            results = context.Queue()
+            for slot in range(self.NUM_SLOTS):
+                self.free_slots.put(slot)
+
+            self.stop_event = threading.Event()
+            self.errors = []
+            self.stats = {"blocks": 0, "overruns": 0, "dropped": 0, "wait_time": 0.0}
+
+            reader = threading.Thread(target = self.reader, args = (sdr,), name = "pipeline-reader", daemon = True)
+            workers = [context.Process(target = processWorker, args = (self.DSP, shared_ring.name, shared_info.name, ring_shape, self.filled_slots, self.free_slots, results), name = f"pipeline-worker-{i}", daemon = True) for i in range(self.NUM_WORKERS)]
+
+            # The workers are started before the reader thread, so they aren't forked while it runs
+            start = perf_counter()
+            for worker in workers:
+                worker.start()
+            reader.start()
+
+            # Stop the workers if interrupted or if one of them fails
+            # The reader is stopped before the shared memory is released, since it may be writing to it
+            try:
+                partial_results = self.collect(results, workers)
+                reader.join()
+            except BaseException:
+                self.stop_event.set()
+                for worker in workers:
+                    worker.terminate()
+                reader.join()
+                raise
+            for worker in workers:
+                worker.join()
+            self.stats["elapsed"] = perf_counter() - start
+
+            if self.errors:
+                raise self.errors[0]
+
+            return self.reduce(partial_results)
+        finally:
+            # The arrays must be released before the shared memory is closed
+            self.ring = self.block_lengths = self.block_first_fft = None
+            shared_ring.close()
+            shared_ring.unlink()
+            shared_info.close()
+            shared_info.unlink()
+
+
+    # Waits for the partial results of every worker
+    # Raises the error of a worker, or an error if a worker stopped without sending its results
+    def collect(self, results, workers):
+        partial_results = []
+        while len(partial_results) < len(workers):
+            try:
+                result = results.get(timeout = 0.1)
+            except queue.Empty:
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    raise RuntimeError("A pipeline worker process stopped unexpectedly")
+                continue
+            if isinstance(result, Exception):
+                raise result
+            partial_results.append(result)
+        return partial_results
+
+
+    # Adds the partial sums together, and merges the RFI flaggers and dynamic spectrums of the workers into the ones of the DSP
+    def reduce(self, partial_results):
+        PSD_sum = np.sum([result[0] for result in partial_results], axis = 0)
+        counts = np.sum([result[1] for result in partial_results], axis = 0)
+        if self.DSP.rfi_flagger is not None:
+            self.DSP.rfi_flagger.merge([result[2] for result in partial_results])
+        if self.DSP.dynamic_spectrum is not None:
+            self.DSP.dynamic_spectrum.merge([result[3] for result in partial_results])
+        return PSD_sum, counts
+
+
+# Worker process. Processes the blocks of the filled slots in the shared ring buffer
+# Sends back its partial sums, RFI flagger and dynamic spectrum, or the error if it fails
+def processWorker(dsp, ring_name, info_name, ring_shape, filled_slots, free_slots, results):
+    shared_ring = shared_memory.SharedMemory(name = ring_name)
+    shared_info = shared_memory.SharedMemory(name = info_name)
+    ring = np.ndarray(ring_shape, dtype = np.complex64, buffer = shared_ring.buf)
+    block_info = np.ndarray((2, ring_shape[0]), dtype = np.int64, buffer = shared_info.buf)
+    try:
+        PSD_sum = np.zeros(dsp.FFT_SIZE)
+        counts = np.zeros(dsp.FFT_SIZE)
+        while True:
+            slot = filled_slots.get()
+            if slot is None:
+                break
+            batch_sum, batch_counts = dsp.processBatch(ring[slot, :block_info[0, slot]], block_info[1, slot])
+            PSD_sum += batch_sum
+            counts += batch_counts
+            free_slots.put(slot)
+        results.put((PSD_sum, counts, dsp.rfi_flagger, dsp.dynamic_spectrum))
+    except Exception as err:
+        # The traceback holds the frames that use the shared memory, and isn't sent anyway
+        results.put(err.with_traceback(None))
+    finally:
+        # The arrays must be released before the shared memory is closed
+        ring = block_info = None
+        shared_ring.close()
+        shared_info.close()
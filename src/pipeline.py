@@ -0,0 +1,134 @@
+import queue
+import threading
+from time import perf_counter
+import numpy as np
+
+'''
+Producer/consumer pipeline for integrating FFT's.
+One reader thread reads blocks of samples from the SDR into a preallocated ring buffer.
+A pool of worker threads processes the blocks and keeps their own partial sum of the spectrums,
+which are added together when the integration is done. The workers also count the FFT's summed in each channel,
+since flagged values are left out.
+NumPy releases the GIL during FFT's and array operations, so the reader keeps reading while the workers process.
+'''
+
+class Pipeline():
+    def __init__(self, dsp, num_workers, num_slots):
+        self.DSP = dsp
+        self.NUM_WORKERS = max(1, num_workers)
+        # At least one slot per worker plus one for the reader
+        self.NUM_SLOTS = max(num_slots, self.NUM_WORKERS + 1)
+        self.BLOCK_SIZE = dsp.BATCH_SIZE*dsp.BLOCK_SAMPLES
+        # Samples from before each block that the estimator and down converter need, which are copied in front of the block
+        self.HISTORY = dsp.HISTORY
+
+        # Preallocated ring buffer of sample blocks
+        self.ring = np.empty((self.NUM_SLOTS, self.HISTORY + self.BLOCK_SIZE), dtype = np.complex64)
+        self.block_lengths = np.zeros(self.NUM_SLOTS, dtype = int)
+        # Number of the first FFT of each block in the integration
+        self.block_first_fft = np.zeros(self.NUM_SLOTS, dtype = int)
+
+
+    # Integrates NUM_FFT FFT's from the SDR and returns the unshifted sum of the log power spectrums and the number of FFT's in each channel
+    def run(self, sdr):
+        self.free_slots = queue.Queue()
+        self.filled_slots = queue.Queue()
+        for slot in range(self.NUM_SLOTS):
+            self.free_slots.put(slot)
+
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.partial_sums = [np.zeros(self.DSP.FFT_SIZE) for i in range(self.NUM_WORKERS)]
+        self.partial_counts = [np.zeros(self.DSP.FFT_SIZE) for i in range(self.NUM_WORKERS)]
+        self.stats = {"blocks": 0, "overruns": 0, "dropped": 0, "wait_time": 0.0}
+
+        reader = threading.Thread(target = self.reader, args = (sdr,), name = "pipeline-reader", daemon = True)
+        workers = [threading.Thread(target = self.worker, args = (i,), name = f"pipeline-worker-{i}", daemon = True) for i in range(self.NUM_WORKERS)]
+
+        start = perf_counter()
+        for thread in [reader] + workers:
+            thread.start()
+
+        # Shut down cleanly if interrupted, the threads stop at their next block
+        try:
+            reader.join()
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            self.stop_event.set()
+            raise
+        self.stats["elapsed"] = perf_counter() - start
+
+        if self.errors:
+            raise self.errors[0]
+
+        return np.sum(self.partial_sums, axis = 0), np.sum(self.partial_counts, axis = 0)
+
+
+    # Reads blocks into free slots of the ring buffer until NUM_FFT FFT's have been read
+    def reader(self, sdr):
+        try:
+            history = self.DSP.readHistory(sdr)
+            remaining = self.DSP.NUM_FFT
+            while remaining > 0 and not self.stop_event.is_set():
+                # Backpressure, wait for a worker to release a slot if the ring buffer is full
+                try:
+                    slot = self.free_slots.get_nowait()
+                except queue.Empty:
+                    self.stats["overruns"] += 1
+                    wait_start = perf_counter()
+                    slot = self.getSlot(self.free_slots)
+                    self.stats["wait_time"] += perf_counter() - wait_start
+                    if slot is None:
+                        break
+
+                num_fft = min(self.DSP.BATCH_SIZE, remaining)
+                samples = np.asarray(sdr.read_samples(num_fft*self.DSP.BLOCK_SAMPLES))
+
+                # Short reads can't be reshaped into whole FFT's and are dropped
+                if samples.size != num_fft*self.DSP.BLOCK_SAMPLES:
+                    self.stats["dropped"] += 1
+                    self.free_slots.put(slot)
+                    continue
+
+                self.ring[slot, :self.HISTORY] = history
+                self.ring[slot, self.HISTORY:self.HISTORY + samples.size] = samples
+                history = self.DSP.nextHistory(history, samples)
+                self.block_lengths[slot] = self.HISTORY + samples.size
+                self.block_first_fft[slot] = self.DSP.NUM_FFT - remaining
+                self.filled_slots.put(slot)
+                self.stats["blocks"] += 1
+                remaining -= num_fft
+        except Exception as err:
+            self.errors.append(err)
+            self.stop_event.set()
+        finally:
+            # One stop signal for each worker
+            for i in range(self.NUM_WORKERS):
+                self.filled_slots.put(None)
+
+
+    # Processes filled slots and adds the result to the worker's own partial sum
+    def worker(self, index):
+        try:
+            while True:
+                slot = self.getSlot(self.filled_slots)
+                if slot is None:
+                    break
+                batch_sum, counts = self.DSP.processBatch(self.ring[slot, :self.block_lengths[slot]], self.block_first_fft[slot])
+                self.partial_sums[index] += batch_sum
+                self.partial_counts[index] += counts
+                self.free_slots.put(slot)
+        except Exception as err:
+            self.errors.append(err)
+            self.stop_event.set()
+
+
+    # Blocks until a slot is available. Returns None if the pipeline is stopping
+    def getSlot(self, slot_queue):
+        while not self.stop_event.is_set():
+            try:
+                return slot_queue.get(timeout = 0.1)
+            except queue.Empty:
+                continue
+        return None
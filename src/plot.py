@@ -1,4 +1,4 @@
-import imageio
+import os
 import numpy as np
 from matplotlib import colors
 import matplotlib.pyplot as plt
@@ -6,12 +6,31 @@ import matplotlib.pyplot as plt
 from analysis import Analysis
 ANALYSIS = Analysis()
 
+# The LAB HI map is parsed once and cached as a binary file next to the text file
+MAP_PATH = 'src/map.txt'
+MAP_CACHE_PATH = 'src/map.npy'
+MAP_CACHE = {}
+
+# Returns the flipped H-line map. The binary cache is memory mapped and rebuilt if the text file is newer
+def loadMap():
+    if "map" not in MAP_CACHE:
+        if not os.path.exists(MAP_CACHE_PATH) or os.path.getmtime(MAP_CACHE_PATH) < os.path.getmtime(MAP_PATH):
+            np.save(MAP_CACHE_PATH, np.flip(np.loadtxt(MAP_PATH), 1))
+        MAP_CACHE["map"] = np.load(MAP_CACHE_PATH, mmap_mode = 'r')
+    return MAP_CACHE["map"]
+
+
 class Plotter():
-    def __init__(self, plot_map, y_min, y_max):
+    def __init__(self, plot_map, y_min, y_max, reuse_figure = False, output_folder = './Spectrums'):
         self.SHOW_MAP = plot_map
         self.Y_MIN = y_min
         self.Y_MAX = y_max
+        # Keep the figure and only update its contents for each new observation
+        self.REUSE_FIGURE = reuse_figure
+        self.OUTPUT_FOLDER = output_folder
+        self.template = None
 
+    # Plots and saves an observation and returns the rendered figure as an RGB array, which can be used as an animation frame
     def plot(self, freqs, data, **kwargs):
         # Unpack info
         ra, dec = kwargs["ra"], kwargs["dec"]
@@ -20,9 +39,21 @@ class Plotter():
         lsr_correction = kwargs["lsr_correction"]
         freq_correction = ANALYSIS.freqFromRadialVel(barycenter_correction + lsr_correction) - ANALYSIS.H_FREQUENCY
         SNR, radial_velocity = kwargs["SNR"], kwargs["observed_radial_velocity"]
+        details = (ra, dec, gal_lon, gal_lat, barycenter_correction, lsr_correction, radial_velocity, SNR)
+        path = f'{self.OUTPUT_FOLDER}/ra={ra},dec={dec}.png'
+
+        # Update the existing figure if it has the same frequency axis
+        freqs_key = (freqs[0], freqs[-1], len(freqs))
+        if self.template is not None and self.template["freqs_key"] == freqs_key:
+            self.updateTemplate(freqs, data, freq_correction, details)
+            return self.save(self.template["fig"], path)
+
+        if self.template is not None:
+            plt.close(self.template["fig"])
+        template = {"freqs_key": freqs_key}
 
         if self.SHOW_MAP:
-            fig = plt.figure(figsize=(20,12))
+            fig = plt.figure(figsize=(20,12), dpi = 100)
             fig.suptitle('Hydrogen line observation', fontsize = 22, y = 0.99)
             fig.subplots_adjust(hspace=1)
             grid = fig.add_gridspec(2,2)
@@ -32,25 +63,68 @@ class Plotter():
             spectrum_ax = fig.add_subplot(grid[1,0])
             corrected_spectrum_ax = fig.add_subplot(grid[1,1])
 
-            self.spectrumGrid(spectrum_ax, 'Observed spectrum', freqs, data)
-            self.spectrumGrid(corrected_spectrum_ax, 'Corrected spectrum w.r.t. LSR', np.add(freqs, freq_correction), data)
-            self.skyGrid(sky_ax, ra, dec)
-            self.detailsGrid(details_ax, ra, dec, gal_lon, gal_lat, barycenter_correction, lsr_correction, radial_velocity, SNR)
+            template["spectrum"] = self.spectrumGrid(spectrum_ax, 'Observed spectrum', freqs, data)
+            template["corrected_spectrum"] = self.spectrumGrid(corrected_spectrum_ax, 'Corrected spectrum w.r.t. LSR', np.add(freqs, freq_correction), data)
+            template["sky"] = self.skyGrid(sky_ax, ra, dec)
+            template["details"] = self.detailsGrid(details_ax, *details)
 
             # Share y-axis for spectrums
             corrected_spectrum_ax.set_yticklabels([])
             corrected_spectrum_ax.set_ylabel('')
 
         else:
-            fig, ax = plt.subplots(figsize = (12, 7))
-            self.spectrumGrid(ax, "Observed spectrum", freqs, data)
+            fig, ax = plt.subplots(figsize = (12, 7), dpi = 100)
+            template["spectrum"] = self.spectrumGrid(ax, "Observed spectrum", freqs, data)
         
 
         # Saves plot
-        path = f'./Spectrums/ra={ra},dec={dec}.png'
-        plt.tight_layout(pad = 1.75)
-        plt.savefig(path, dpi = 100)
-        plt.close()
+        fig.tight_layout(pad = 1.75)
+        frame = self.save(fig, path)
+        if self.REUSE_FIGURE:
+            template["fig"] = fig
+            self.template = template
+        else:
+            plt.close(fig)
+        return frame
+
+
+    # Renders the figure once and saves the rendered image, so the frame comes without reading the PNG back
+    def save(self, fig, path):
+        fig.canvas.draw()
+        frame = np.array(fig.canvas.buffer_rgba())[..., :3]
+        plt.imsave(path, frame)
+        return frame
+
+
+    # Updates the spectrums, sky position and details of the kept figure
+    def updateTemplate(self, freqs, data, freq_correction, details):
+        template = self.template
+        self.updateSpectrum(template["spectrum"], freqs, data)
+        if not self.SHOW_MAP:
+            return
+
+        self.updateSpectrum(template["corrected_spectrum"], np.add(freqs, freq_correction), data)
+
+        ra, dec = details[0], details[1]
+        vertical, horizontal, marker = template["sky"]
+        vertical.set_xdata([ra, ra])
+        horizontal.set_ydata([dec, dec])
+        marker.set_data([ra], [dec])
+
+        table = template["details"]
+        for row, value in enumerate(self.detailsValues(*details)):
+            table[row + 1, 0].get_text().set_text(value[0])
+
+
+    # Replaces the data of a spectrum line and updates the axis limits
+    # The radial velocity axis follows the frequency axis by itself
+    def updateSpectrum(self, line, freqs, data):
+        ax = line.axes
+        line.set_data(freqs, data)
+        ax.set(xlim = [freqs[0], freqs[-1]])
+        if 0.0 == self.Y_MIN == self.Y_MAX:
+            ax.relim()
+            ax.autoscale_view(scalex = False)
 
     
     # Arrange detail grid
@@ -58,17 +132,9 @@ class Plotter():
     def detailsGrid(self, ax, ra, dec,gal_lon, gal_lat, barycenter_correction, lsr_correction, radial_velocity, SNR):
         ax.axis('off')
 
-        source_vel = np.round(radial_velocity + barycenter_correction + lsr_correction, 2)
         title = ['Values']
         labels = [r'RA/Dec', r'Galactic $l$/$b$', 'Peak SNR', 'Observed\nradial velocity', 'Radial correction\nfor barycenter', 'Radial correction\nfor LSR', 'Corrected\nsource velocity']
-        values = [
-            [fr'RA={ra}$^\circ$, Dec={dec}$^\circ$'],
-            [fr'$l$={gal_lon}$^\circ$, $b$={gal_lat}$^\circ$'],
-            [f'{SNR}dB'],
-            [f'{radial_velocity}' + r'$\frac{km}{s}$'],
-            [f'{barycenter_correction}' + r'$\frac{km}{s}$'],
-            [f'{lsr_correction}' + r'$\frac{km}{s}$'],
-            [f'{source_vel}' + r'$\frac{km}{s}$']]
+        values = self.detailsValues(ra, dec,gal_lon, gal_lat, barycenter_correction, lsr_correction, radial_velocity, SNR)
 
         loc = 'center'
         colwidth = [0.5, 0.2]
@@ -78,6 +144,20 @@ class Plotter():
         table.auto_set_font_size(False)
         table.set_fontsize(14)
         table.scale(1, 2.25)
+        return table
+
+
+    # Returns the cell text of the details table
+    def detailsValues(self, ra, dec,gal_lon, gal_lat, barycenter_correction, lsr_correction, radial_velocity, SNR):
+        source_vel = np.round(radial_velocity + barycenter_correction + lsr_correction, 2)
+        return [
+            [fr'RA={ra}$^\circ$, Dec={dec}$^\circ$'],
+            [fr'$l$={gal_lon}$^\circ$, $b$={gal_lat}$^\circ$'],
+            [f'{SNR}dB'],
+            [f'{radial_velocity}' + r'$\frac{km}{s}$'],
+            [f'{barycenter_correction}' + r'$\frac{km}{s}$'],
+            [f'{lsr_correction}' + r'$\frac{km}{s}$'],
+            [f'{source_vel}' + r'$\frac{km}{s}$']]
     
     
     # Arrange sky grid
@@ -85,18 +165,17 @@ class Plotter():
         ax.set(title = 'Milky Way H-line map')
 
         # Huge thanks to the Virgo and Pictor project for sharing their code for the hydrogen line map!
-        img = np.loadtxt('src/map.txt')
-        flipimg = np.flip(img, 1)
-        ax.imshow(flipimg, extent = [360, 0, -90, 90], interpolation = 'none')
+        ax.imshow(loadMap(), extent = [360, 0, -90, 90], interpolation = 'none')
 
         # Axis labels
         ax.set(xlabel = 'Right ascension / degrees', ylabel = 'Declination / degrees')
-        ax.axvline(x = ra, color = 'r', linestyle = ':', linewidth = 1)
-        ax.axhline(y = dec, color = 'r', linestyle = ':', linewidth = 1)
+        vertical = ax.axvline(x = ra, color = 'r', linestyle = ':', linewidth = 1)
+        horizontal = ax.axhline(y = dec, color = 'r', linestyle = ':', linewidth = 1)
 
         # Plot with legend
-        ax.plot(ra, dec, marker = '.', markersize = 15, color = 'r', label = 'LAB HI Survey (Kalberla et al., 2005)')
+        marker, = ax.plot(ra, dec, marker = '.', markersize = 15, color = 'r', label = 'LAB HI Survey (Kalberla et al., 2005)')
         ax.legend(prop = {'size': 10}, loc = 1)
+        return vertical, horizontal, marker
 
 
     # Arranges spectrum grid
@@ -104,7 +183,7 @@ class Plotter():
         start_freq = freqs[0]
         stop_freq = freqs[-1]
 
-        ax.plot(freqs, data, color = 'g', label = 'Observed data')
+        line, = ax.plot(freqs, data, color = 'g', label = 'Observed data')
 
         # Plots theoretical H-line frequency
         ax.axvline(x = ANALYSIS.H_FREQUENCY, color = 'r', linestyle = ':', linewidth = 2, label = 'Theoretical frequency')
@@ -128,11 +207,15 @@ class Plotter():
         # Adds top x-axis for radial velocity
         radial_vel = ax.secondary_xaxis('top', functions = (ANALYSIS.radialVelFromFreq, ANALYSIS.freqFromRadialVel))
         radial_vel.set_xlabel(r'Radial velocity / $\frac{km}{s}$')
+        return line
         
 
-    # Generates and saves a GIF of 24H observations
+    # Generates and saves a GIF of 24H observations from the saved plots
+    # The plots are read one at a time, so only one is kept in memory
     def generateGIF(self, ra, dec):
+        from animation import AnimationWriter
         print('Generating GIF from observations... This may take a while')
-        path = f'Spectrums/ra={ra[0]},dec={dec}.gif'
-        images = [imageio.imread(f'Spectrums/ra={coord},dec={dec}.png') for coord in ra]
-        imageio.mimsave(path, images)
\ No newline at end of file
+        animation = AnimationWriter(f'{self.OUTPUT_FOLDER}/ra={ra[0]},dec={dec}')
+        for coord in ra:
+            animation.addFrame(plt.imread(f'{self.OUTPUT_FOLDER}/ra={coord},dec={dec}.png'))
+        return animation.close()
\ No newline at end of file
@@ -0,0 +1,192 @@
+import os
+import json
+import atexit
+from datetime import datetime
+import numpy as np
+
+'''
+Recording and replay of raw IQ samples.
+Recordings are stored in a folder as chunks of interleaved 8-bit I/Q samples, the same format as the RTL-SDR delivers.
+A metadata.json sidecar describes the sample rate, PPM offset and the center frequency and timestamps of each chunk.
+'''
+
+# Lookup table from an unsigned 8-bit sample to a float in [-1, 1], equal to pyrtlsdr's conversion
+IQ_LUT = (np.arange(256, dtype = np.float32) - 127.5)/127.5
+
+# Default number of samples in each chunk (256MB)
+CHUNK_SAMPLES = 2**27
+
+
+# Converts interleaved 8-bit IQ to complex64 through the lookup table
+# The lookup result is written directly into the float32 view of the complex output
+def bytesToIQ(raw, out = None):
+    raw = np.frombuffer(raw, dtype = np.uint8) if not isinstance(raw, np.ndarray) else raw
+    if out is None:
+        out = np.empty(raw.size//2, dtype = np.complex64)
+    np.take(IQ_LUT, raw[:2*out.size], out = out.view(np.float32))
+    return out
+
+
+# Converts complex samples in [-1, 1] back to interleaved 8-bit IQ
+def iqToBytes(samples):
+    samples = np.asarray(samples)
+    raw = np.empty(2*samples.size, dtype = np.float32)
+    raw[0::2], raw[1::2] = samples.real, samples.imag
+    return np.clip(np.rint((raw + 1.0)*127.5), 0, 255).astype(np.uint8)
+
+
+# Wraps any SDR device and writes everything read from it to disk
+class IQRecorder():
+    def __init__(self, sdr, path, sample_rate, PPM_offset, chunk_samples = CHUNK_SAMPLES):
+        self.sdr = sdr
+        self.PATH = path
+        self.CHUNK_SAMPLES = chunk_samples
+        os.makedirs(path, exist_ok = True)
+
+        self.metadata = {
+            "format": "uint8 interleaved IQ",
+            "sample_rate": sample_rate,
+            "PPM_offset": PPM_offset,
+            "created": str(datetime.utcnow()),
+            "chunks": []
+        }
+        self.file = None
+        self.chunk = None
+        atexit.register(self.close)
+
+
+    # Retuning starts a new chunk so replay can find the samples for each frequency
+    @property
+    def center_freq(self):
+        return self.sdr.center_freq
+
+    @center_freq.setter
+    def center_freq(self, freq):
+        self.sdr.center_freq = freq
+        self.closeChunk()
+
+
+    # Everything else is passed on to the wrapped device
+    def __getattr__(self, name):
+        if name == "sdr":
+            raise AttributeError(name)
+        return getattr(self.sdr, name)
+
+
+    # Reads samples from the wrapped device and appends the raw bytes to the current chunk
+    def read_samples(self, num_samples):
+        if hasattr(self.sdr, "read_bytes"):
+            raw = np.frombuffer(self.sdr.read_bytes(2*num_samples), dtype = np.uint8)
+            samples = bytesToIQ(raw)
+        else:
+            samples = np.asarray(self.sdr.read_samples(num_samples))
+            raw = iqToBytes(samples)
+
+        if self.chunk is None or self.chunk["num_samples"] >= self.CHUNK_SAMPLES:
+            self.openChunk()
+        self.file.write(raw.tobytes())
+        self.chunk["num_samples"] += raw.size//2
+        self.chunk["end_time"] = str(datetime.utcnow())
+
+        return samples
+
+
+    # Starts a new chunk file at the current center frequency
+    def openChunk(self):
+        self.closeChunk()
+        self.chunk = {
+            "file": f"chunk_{len(self.metadata['chunks']):05d}.iq",
+            "center_freq": self.sdr.center_freq,
+            "num_samples": 0,
+            "start_time": str(datetime.utcnow()),
+            "end_time": str(datetime.utcnow())
+        }
+        self.metadata["chunks"].append(self.chunk)
+        self.file = open(os.path.join(self.PATH, self.chunk["file"]), "wb")
+        self.writeMetadata()
+
+
+    def closeChunk(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.writeMetadata()
+        self.chunk = None
+
+
+    def writeMetadata(self):
+        with open(os.path.join(self.PATH, "metadata.json"), "w") as file:
+            json.dump(self.metadata, file, indent = 4)
+
+
+    def close(self):
+        self.closeChunk()
+
+
+# Replays a recording with the same interface as the RTL-SDR
+# Samples are served straight from memory mapped chunks as fast as the disk allows
+class IQReplay():
+    def __init__(self, path):
+        self.PATH = path
+        with open(os.path.join(path, "metadata.json"), "r") as file:
+            self.metadata = json.load(file)
+
+        self.sample_rate = self.metadata["sample_rate"]
+        self.freq_correction = self.metadata["PPM_offset"]
+        self.gain = 'auto'
+
+        # Memory map each chunk as interleaved bytes
+        self.chunks = [chunk for chunk in self.metadata["chunks"] if chunk["num_samples"] > 0]
+        for chunk in self.chunks:
+            chunk["data"] = np.memmap(os.path.join(path, chunk["file"]), dtype = np.uint8, mode = 'r', shape = (2*chunk["num_samples"],))
+
+        # Number of times the recording has been replayed from the start
+        self.loops = 0
+        self.center_freq = self.chunks[0]["center_freq"]
+
+
+    # Tuning selects the chunks recorded at that frequency
+    @property
+    def center_freq(self):
+        return self.CENTER_FREQ
+
+    @center_freq.setter
+    def center_freq(self, freq):
+        selected = [chunk["data"] for chunk in self.chunks if chunk["center_freq"] == freq]
+        if not selected:
+            recorded = sorted(set(chunk["center_freq"] for chunk in self.chunks))
+            raise ValueError(f'No samples recorded at {freq}Hz. Recorded frequencies = {recorded}')
+        self.CENTER_FREQ = freq
+        self.selected = selected
+        self.chunk_index = 0
+        self.position = 0
+
+
+    # Returns interleaved bytes. Reads within a chunk are zero-copy views of the memory map
+    # The recording loops when the end is reached
+    def read_bytes(self, num_bytes):
+        parts = []
+        while num_bytes > 0:
+            data = self.selected[self.chunk_index]
+            part = data[self.position:self.position + num_bytes]
+            parts.append(part)
+            num_bytes -= part.size
+            self.position += part.size
+
+            if self.position >= data.size:
+                self.position = 0
+                self.chunk_index += 1
+                if self.chunk_index == len(self.selected):
+                    self.chunk_index = 0
+                    self.loops += 1
+
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+    def read_samples(self, num_samples):
+        return bytesToIQ(self.read_bytes(2*num_samples))
+
+
+    def close(self):
+        self.chunks = []
+        self.selected = []
@@ -0,0 +1,47 @@
+from time import monotonic
+import numpy as np
+
+'''
+Cache of blank reference spectrums.
+The blank spectrum only depends on the receiver, not on where the antenna points,
+so it can be reused for consecutive observations as long as it's fresh and the receiver hasn't drifted.
+Drift is detected by comparing the median level of the new H-line spectrum with the one the reference was recorded with.
+'''
+
+class ReferenceCache():
+    def __init__(self, max_age, max_drift):
+        # Maximum age in seconds before a reference is recorded again. 0 disables the cache
+        self.MAX_AGE = max_age
+        # Maximum change in median level of the H-line spectrum in dB before a reference is recorded again
+        self.MAX_DRIFT = max_drift
+        self.references = {}
+
+
+    # References are kept for each combination of receiver settings
+    @staticmethod
+    def getKey(sdr, center_freq, sample_rate, fft_size):
+        return (center_freq, sample_rate, fft_size, getattr(sdr, "gain", None))
+
+
+    # Returns the cached reference for the key, or None if there's no usable reference
+    def get(self, key, h_line_data):
+        if self.MAX_AGE <= 0 or key not in self.references:
+            return None
+
+        reference = self.references[key]
+        if monotonic() - reference["time"] > self.MAX_AGE:
+            return None
+        if abs(np.median(h_line_data) - reference["level"]) > self.MAX_DRIFT:
+            return None
+        return reference["blank_data"]
+
+
+    # Stores a new reference together with the level of the H-line spectrum it was recorded with
+    def put(self, key, blank_data, h_line_data):
+        if self.MAX_AGE <= 0:
+            return
+        self.references[key] = {
+            "blank_data": blank_data,
+            "level": np.median(h_line_data),
+            "time": monotonic()
+        }
@@ -0,0 +1,172 @@
+import threading
+import numpy as np
+
+'''
+RFI flagging of batches of FFT's.
+Every batch of power spectrums (one FFT per row) is checked at once for:
+    Spectral kurtosis:  Channels whose power isn't noise-like over the batch, like carriers and pulsed signals.
+    Time outliers:      FFT's whose total power deviates from the batch, like impulsive interference.
+    Frequency outliers: Channels that stand out from the mean spectrum of the batch, like narrowband interference.
+Outliers are found with the median absolute deviation (MAD), which isn't affected by the outliers themselves.
+Channels that are flagged in more than PERSISTENT of the batches are masked in every batch from then on.
+Every test flags whole FFT's or whole channels of the batch, so the flags are kept as one mask of each instead of a mask of every value.
+Flagged values are left out of the integration. The flagged fractions are counted until the stats are reset.
+Worker processes flag with their own copies, which are merged back when the integration is done.
+'''
+
+# Scales the MAD to the standard deviation of normal distributed data
+MAD_SCALE = 1.4826
+# Batches needed before a channel can be masked persistently
+MIN_BATCHES = 10
+# Number of channels in each block of the coarse baseline used for frequency outliers
+BLOCK_SIZE = 32
+
+
+# Medians along the last axis from a partial sort, which skips the NaN checks of np.median
+def median(values):
+    size = values.shape[-1]
+    middle = np.partition(values, [(size - 1)//2, size//2], axis = -1)
+    return (middle[..., (size - 1)//2] + middle[..., size//2])/2
+
+class RFIFlagger():
+    def __init__(self, threshold = 4.0, persistent = 0.5):
+        # Number of standard deviations before something is flagged
+        self.THRESHOLD = threshold
+        # Fraction of the batches a channel must be flagged in to be masked persistently. 0 disables the persistent mask
+        self.PERSISTENT = persistent
+
+        self.channel_flags = None
+        self.num_batches = 0
+        self.persistent_mask = None
+        self.lock = threading.Lock()
+        self.resetStats()
+
+
+    def resetStats(self):
+        self.stats = {"total": 0, "kurtosis": 0, "time": 0, "frequency": 0, "persistent": 0, "dropped": 0, "values": 0}
+
+
+    # Adds the counts of values that were flagged elsewhere, like on a spectrum host
+    def addStats(self, stats):
+        with self.lock:
+            for name in self.stats:
+                self.stats[name] += stats[name]
+
+
+    # Returns the fraction of the values flagged since the stats were reset, in total and by each test
+    def getFractions(self):
+        values = max(1, self.stats["values"])
+        return {name: round(count/values, 5) for name, count in self.stats.items() if name != "values"}
+
+
+    # Returns boolean arrays of the flagged FFT's and flagged channels of a batch of power spectrums
+    # dropped marks FFT's of dropped samples, which are flagged without being used for the tests
+    def flag(self, PSD, dropped):
+        num_fft, num_channels = PSD.shape
+        valid = ~dropped
+        num_valid = np.count_nonzero(valid)
+        if self.persistent_mask is None or self.persistent_mask.size != num_channels:
+            self.channel_flags = np.zeros(num_channels, dtype = int)
+            self.persistent_mask = np.zeros(num_channels, dtype = bool)
+
+        kurtosis_mask = np.zeros(num_channels, dtype = bool)
+        frequency_mask = np.zeros(num_channels, dtype = bool)
+        time_mask = np.zeros(num_fft, dtype = bool)
+        if num_valid >= 8:
+            valid_PSD = PSD if num_valid == num_fft else PSD[valid]
+            # Sums along the FFT's and channels as products with vectors of ones, which are faster than np.sum on 2D arrays
+            S1 = np.ones(num_valid) @ valid_PSD
+            S2 = np.einsum('ij,ij->j', valid_PSD, valid_PSD)
+            kurtosis_mask = self.spectralKurtosis(S1, S2, num_valid)
+            frequency_mask = self.frequencyOutliers(S1/num_valid)
+            time_mask[valid] = self.outliers(valid_PSD @ np.ones(num_channels))
+
+        channel_mask = kurtosis_mask | frequency_mask | self.persistent_mask
+        fft_mask = time_mask | dropped
+
+        with self.lock:
+            self.updatePersistentMask(kurtosis_mask | frequency_mask)
+            self.stats["values"] += PSD.size
+            self.stats["total"] += np.count_nonzero(channel_mask)*num_fft + np.count_nonzero(fft_mask)*num_channels - np.count_nonzero(channel_mask)*np.count_nonzero(fft_mask)
+            self.stats["kurtosis"] += np.count_nonzero(kurtosis_mask)*num_fft
+            self.stats["frequency"] += np.count_nonzero(frequency_mask)*num_fft
+            self.stats["persistent"] += np.count_nonzero(self.persistent_mask)*num_fft
+            self.stats["time"] += np.count_nonzero(time_mask)*num_channels
+            self.stats["dropped"] += np.count_nonzero(dropped)*num_channels
+        return fft_mask, channel_mask
+
+
+    # Spectral kurtosis estimator from the sums of the power and squared power of each channel
+    # It's 1 for noise, with a standard deviation of about 2/sqrt(M) for M FFT's
+    def spectralKurtosis(self, S1, S2, M):
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            kurtosis = (M + 1)/(M - 1)*(M*S2/S1**2 - 1)
+        std = np.sqrt(4*M**2/((M - 1)*(M + 2)*(M + 3)))
+        return ~(np.abs(kurtosis - 1) <= self.THRESHOLD*std)
+
+
+    # Channels of the mean spectrum that stand out above a coarse baseline
+    # The baseline interpolates the medians of blocks of channels, so it follows the bandpass but not narrow signals.
+    # Only channels above the baseline are flagged, since RFI adds power and the roll off at the band edges falls below it
+    def frequencyOutliers(self, mean_PSD):
+        with np.errstate(divide = 'ignore'):
+            spectrum = 10*np.log10(mean_PSD)
+        num_blocks = max(1, spectrum.size//BLOCK_SIZE)
+        block_size = spectrum.size//num_blocks
+        medians = median(spectrum[:num_blocks*block_size].reshape(num_blocks, block_size))
+        centers = np.arange(num_blocks)*block_size + (block_size - 1)/2
+        baseline = np.interp(np.arange(spectrum.size), centers, medians)
+        return self.outliers(spectrum - baseline, upper = True)
+
+
+    # Values more than THRESHOLD standard deviations from the median, where the standard deviation is estimated from the MAD
+    # If upper is set, only values above the median are outliers
+    def outliers(self, values, upper = False):
+        difference = values - median(values)
+        absolute = np.abs(difference)
+        deviation = difference if upper else absolute
+        MAD = median(absolute)
+        return ~(deviation <= self.THRESHOLD*MAD_SCALE*MAD) if MAD > 0 else np.zeros(values.shape, dtype = bool)
+
+
+    # Channels that are flagged in most batches are masked persistently
+    def updatePersistentMask(self, channel_mask):
+        self.channel_flags += channel_mask
+        self.num_batches += 1
+        if self.PERSISTENT > 0 and self.num_batches >= MIN_BATCHES:
+            self.persistent_mask |= self.channel_flags > self.PERSISTENT*self.num_batches
+
+
+    # Merges copies of the flagger that were used by worker processes from this one
+    # The stats and flag counts each copy added are added, and the persistent masks are combined
+    def merge(self, copies):
+        with self.lock:
+            stats, num_batches = self.stats.copy(), self.num_batches
+            channel_flags = None if self.channel_flags is None else self.channel_flags.copy()
+            for copy in copies:
+                if copy.channel_flags is None:
+                    continue
+                for name in stats:
+                    self.stats[name] += copy.stats[name] - stats[name]
+                # Copies start from this flagger's counts, unless the number of channels changed
+                started = channel_flags is not None and channel_flags.size == copy.channel_flags.size
+                if self.channel_flags is None or self.channel_flags.size != copy.channel_flags.size:
+                    self.channel_flags = np.zeros(copy.channel_flags.size, dtype = int)
+                    self.persistent_mask = np.zeros(copy.channel_flags.size, dtype = bool)
+                self.channel_flags += copy.channel_flags - channel_flags if started else copy.channel_flags
+                self.num_batches += copy.num_batches - num_batches
+                self.persistent_mask |= copy.persistent_mask
+            if self.PERSISTENT > 0 and self.num_batches >= MIN_BATCHES and self.channel_flags is not None:
+                self.persistent_mask |= self.channel_flags > self.PERSISTENT*self.num_batches
+
+
+    # The lock can't be pickled, so copies sent between processes get a new one
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
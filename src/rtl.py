@@ -1,7 +1,9 @@
 import socket
-from rtlsdr import RtlSdr
-from rtlsdr import RtlSdrTcpServer
-from rtlsdr.rtlsdrtcp.client import RtlSdrTcpClient
+from recording import IQRecorder, IQReplay
+from simulator import SimulatedSdr
+from rtltcp import RtlTcpClient, RtlTcpServer
+from spectrumtcp import SpectrumClient, SpectrumServer
+from multireceiver import MultiReceiver
 
 # Available sample rates
 '''
@@ -24,20 +26,31 @@ This involves TCP host and -clients and serial connections.
 Each function returns a device corresponding to the wished device (host, client, serial).
 
 The sample() function returns samples.
+TCP hosts and clients use either the rtl_tcp protocol, which streams continuously and works with the rtl_tcp tool,
+or pyrtlsdr's own protocol, which requests every read from the host.
+A spectrum host integrates the spectrums itself and only sends them to the client.
+pyrtlsdr is imported when a device is created, so the simulator and replay work without it installed.
 '''
 
+HOST_MODES = ["rtl_tcp", "pyrtlsdr", "spectrum"]
+
 class RTL():
     # Init with RTL parameters
-    def __init__(self, sample_rate, PPM_offset, host_IP):
+    def __init__(self, sample_rate, PPM_offset, host_IP, host_port = 5050, host_mode = "rtl_tcp"):
         self.SAMPLE_RATE = sample_rate
         self.PPM_OFFSET = PPM_offset
         self.CENTER_FREQ = 1420405750
 
+        if host_mode not in HOST_MODES:
+            raise ValueError(f'Unknown host mode "{host_mode}". Available modes = {HOST_MODES}')
         self.HOST_IP = host_IP
+        self.HOST_PORT = host_port
+        self.HOST_MODE = host_mode
     
 
     # Return a physical serial SDR client
     def rtlClient(self):
+        from rtlsdr import RtlSdr
         client_sdr = RtlSdr()
         client_sdr.sample_rate = self.SAMPLE_RATE
         client_sdr.center_freq = self.CENTER_FREQ
@@ -45,7 +58,7 @@ class RTL():
         
         # For some reason the SDR doesn't want to set the offset PPM to 0 so we avoid that
         if self.PPM_OFFSET != 0:
-                self.sdr.freq_correction = self.PPM_OFFSET
+                client_sdr.freq_correction = self.PPM_OFFSET
         
         return client_sdr
 
@@ -54,18 +67,86 @@ class RTL():
     def rtlTcpClient(self):
         # Try to initiate a client connection with settings
         try:
-            client_sdr = RtlSdrTcpClient(hostname = self.HOST_IP, port = 5050)
+            return self.connectToHost(self.HOST_IP, self.HOST_PORT, self.PPM_OFFSET)
+        except Exception as err:
+            print(f'Type = {type(err)} occured with message = {err}')
+            quit()
+
+    # Connects to a host with the protocol of the host mode
+    def connectToHost(self, host_IP, host_port, PPM_offset):
+        if self.HOST_MODE == "rtl_tcp":
+            client_sdr = RtlTcpClient(hostname = host_IP, port = host_port, sample_rate = self.SAMPLE_RATE)
+            client_sdr.center_freq = self.CENTER_FREQ
+            client_sdr.gain = 'auto'
+            if PPM_offset != 0:
+                client_sdr.freq_correction = PPM_offset
             return client_sdr
+
+        if self.HOST_MODE == "spectrum":
+            return SpectrumClient(hostname = host_IP, port = host_port, sample_rate = self.SAMPLE_RATE)
+
+        from rtlsdr.rtlsdrtcp.client import RtlSdrTcpClient
+        client_sdr = RtlSdrTcpClient(hostname = host_IP, port = host_port)
+        return client_sdr
+
+    # Connects to several hosts at once, given as "IP:port" or "IP:port:PPM offset"
+    # The tuners correct whole PPM, and the rest of the offset is corrected when the spectrums are aligned
+    # Hosts that can't be reached are left out. Returns a device that integrates on every host
+    def rtlMultiReceiver(self, receivers, mode = "combine"):
+        clients, names, residuals = [], [], []
+        for receiver in receivers:
+            host_IP, host_port, *offset = receiver.split(":")
+            PPM_offset = float(offset[0]) if offset else self.PPM_OFFSET
+            try:
+                clients.append(self.connectToHost(host_IP, int(host_port), round(PPM_offset)))
+            except Exception as err:
+                print(f'Receiver {host_IP}:{host_port} left out. Type = {type(err)} occured with message = {err}')
+                continue
+            names.append(f'{host_IP}:{host_port}')
+            residuals.append(PPM_offset - round(PPM_offset))
+
+        if not clients:
+            print('None of the receivers could be reached')
+            quit()
+        return MultiReceiver(clients, names, self.SAMPLE_RATE, residuals, mode)
+
+    # Wraps a device and records all samples read from it to the given folder
+    def rtlRecorder(self, sdr, path):
+        print(f'Recording IQ samples to {path}')
+        return IQRecorder(sdr, path, sample_rate = self.SAMPLE_RATE, PPM_offset = self.PPM_OFFSET)
+
+    # Replays a recording made with rtlRecorder
+    # Returns a device with the same read_samples/center_freq interface as the RTL-SDR
+    def rtlReplay(self, path):
+        try:
+            replay_sdr = IQReplay(path)
         except Exception as err:
             print(f'Type = {type(err)} occured with message = {err}')
             quit()
 
+        if replay_sdr.sample_rate != self.SAMPLE_RATE:
+            print(f'Warning: Recording has sample rate {replay_sdr.sample_rate}Hz but config has {self.SAMPLE_RATE}Hz')
+        return replay_sdr
+
+    # Returns a simulated SDR for running without a dongle
+    def rtlSimulator(self):
+        simulated_sdr = SimulatedSdr(sample_rate = self.SAMPLE_RATE, center_freq = self.CENTER_FREQ)
+        simulated_sdr.freq_correction = self.PPM_OFFSET
+        return simulated_sdr
+
     # Start hosting TCP server
-    def tcpHost(self):
+    # With the rtl_tcp protocol, the simulator can be hosted instead of the RTL-SDR
+    def tcpHost(self, simulate = False):
         try:
             local_ip = self.getIp()
             print(f'Hosting server at local IP = {local_ip}')
-            server = RtlSdrTcpServer(hostname = local_ip, port = 5050)
+            if self.HOST_MODE == "rtl_tcp":
+                server = RtlTcpServer(self.rtlSimulator() if simulate else self.rtlClient(), hostname = local_ip, port = self.HOST_PORT)
+            elif self.HOST_MODE == "spectrum":
+                server = SpectrumServer(self.rtlSimulator() if simulate else self.rtlClient(), hostname = local_ip, port = self.HOST_PORT)
+            else:
+                from rtlsdr import RtlSdrTcpServer
+                server = RtlSdrTcpServer(hostname = local_ip, port = self.HOST_PORT)
             print('Starting SDR - Waiting for client (Kill with ctrl + C)')
             server.run_forever()
         except Exception as err:
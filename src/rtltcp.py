@@ -0,0 +1,361 @@
+import socket
+import struct
+import threading
+from time import monotonic, perf_counter
+import numpy as np
+
+from recording import bytesToIQ, iqToBytes
+
+'''
+Native client and server for the rtl_tcp protocol, which is the protocol of the rtl_tcp tool of the RTL-SDR drivers.
+The server sends a 12 byte header ("RTL0", tuner type and number of gains) and then streams interleaved 8-bit IQ samples
+without being asked. The client controls the tuner with 5 byte commands of a command byte and a big-endian 32-bit parameter.
+The client receives the stream continuously on a thread into a preallocated ring buffer with recv_into,
+so no samples are lost while the DSP processes a batch, and converts the bytes with the lookup table of the recordings
+into a complex64 buffer that is reused between reads.
+The server streams any device with read_samples, like the simulator, so the client can be tested without a dongle.
+'''
+
+MAGIC = b"RTL0"
+HEADER = struct.Struct(">4sII")
+COMMAND = struct.Struct(">BI")
+
+SET_FREQUENCY = 0x01
+SET_SAMPLE_RATE = 0x02
+SET_GAIN_MODE = 0x03
+SET_GAIN = 0x04
+SET_FREQ_CORRECTION = 0x05
+
+# Tuner type and number of gains sent by the server. The R820T is the tuner of most dongles
+R820T = 5
+R820T_GAINS = 29
+
+# Seconds of samples the ring buffer of the client holds
+BUFFER_SECONDS = 2.0
+# Seconds of the stream that are discarded after retuning, which also drains what was sent before the server retuned
+SETTLE_TIME = 0.5
+# Bytes received by each recv_into
+RECEIVE_SIZE = 2**16
+
+
+class RtlTcpClient():
+    def __init__(self, hostname, port, sample_rate = 2400000, timeout = 10.0):
+        self.socket = socket.create_connection((hostname, port), timeout = timeout)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**22)
+        magic, self.TUNER_TYPE, self.NUM_GAINS = HEADER.unpack(self.receiveExactly(HEADER.size))
+        if magic != MAGIC:
+            self.socket.close()
+            raise ConnectionError(f'{hostname}:{port} is not an rtl_tcp server')
+        self.TIMEOUT = timeout
+
+        # Ring buffer of received bytes. The positions count every byte received and read, so they never wrap
+        self.CAPACITY = 2*int(BUFFER_SECONDS*sample_rate)
+        # Reads larger than half the ring buffer are read in chunks of that, so the receiver fills one half while the other is converted
+        self.CHUNK_BYTES = self.CAPACITY//4*2
+        self.ring = np.empty(self.CAPACITY, dtype = np.uint8)
+        self.write_position = 0
+        self.read_position = 0
+        self.discard_until = 0.0
+        self.samples = np.empty(0, dtype = np.complex64)
+        self.condition = threading.Condition()
+        self.error = None
+        self.running = True
+        self.stats = {"bytes": 0, "stalls": 0, "stall_time": 0.0, "overflows": 0, "discarded": 0}
+        self.start = perf_counter()
+
+        self._center_freq = 0
+        self._sample_rate = 0
+        self._freq_correction = 0
+        self._gain = 'auto'
+        self.sample_rate = sample_rate
+
+        self.receiver = threading.Thread(target = self.receive, name = "rtl_tcp-receiver", daemon = True)
+        self.receiver.start()
+
+
+    # Reads the header before the stream starts
+    def receiveExactly(self, num_bytes):
+        data = bytearray()
+        while len(data) < num_bytes:
+            chunk = self.socket.recv(num_bytes - len(data))
+            if not chunk:
+                raise ConnectionError("rtl_tcp server closed the connection")
+            data += chunk
+        return bytes(data)
+
+
+    def sendCommand(self, command, parameter):
+        self.socket.sendall(COMMAND.pack(command, int(parameter) & 0xFFFFFFFF))
+
+
+    # Samples received before a retune are from the old frequency, so they're discarded
+    # Only whole samples are discarded, so I and Q stay in order
+    def retune(self):
+        with self.condition:
+            position = self.write_position - self.write_position % 2
+            self.stats["discarded"] += position - self.read_position
+            self.read_position = position
+            self.discard_until = monotonic() + SETTLE_TIME
+            self.condition.notify_all()
+
+
+    @property
+    def center_freq(self):
+        return self._center_freq
+
+    @center_freq.setter
+    def center_freq(self, freq):
+        self.sendCommand(SET_FREQUENCY, freq)
+        self._center_freq = int(freq)
+        self.retune()
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate
+
+    @sample_rate.setter
+    def sample_rate(self, rate):
+        self.sendCommand(SET_SAMPLE_RATE, rate)
+        self._sample_rate = int(rate)
+        self.retune()
+
+    @property
+    def freq_correction(self):
+        return self._freq_correction
+
+    @freq_correction.setter
+    def freq_correction(self, ppm):
+        self.sendCommand(SET_FREQ_CORRECTION, ppm)
+        self._freq_correction = int(ppm)
+
+    # 'auto' or the gain in dB
+    @property
+    def gain(self):
+        return self._gain
+
+    @gain.setter
+    def gain(self, gain):
+        if gain == 'auto':
+            self.sendCommand(SET_GAIN_MODE, 0)
+        else:
+            self.sendCommand(SET_GAIN_MODE, 1)
+            self.sendCommand(SET_GAIN, round(gain*10))
+        self._gain = gain
+
+
+    # Receives the stream into the free part of the ring buffer until the client is closed
+    # When the ring buffer is full, it waits for the DSP to read, and the server buffers the stream meanwhile
+    def receive(self):
+        view = memoryview(self.ring)
+        try:
+            while self.running:
+                with self.condition:
+                    free = self.CAPACITY - (self.write_position - self.read_position)
+                    if free == 0:
+                        self.stats["overflows"] += 1
+                        while self.running and self.write_position - self.read_position == self.CAPACITY:
+                            self.condition.wait()
+                        continue
+                    start = self.write_position % self.CAPACITY
+                    end = min(self.CAPACITY, start + free, start + RECEIVE_SIZE)
+
+                # The bytes are only received into free space, which the DSP doesn't read
+                try:
+                    num_bytes = self.socket.recv_into(view[start:end])
+                except socket.timeout:
+                    continue
+                if num_bytes == 0:
+                    raise ConnectionError("rtl_tcp server closed the connection")
+
+                with self.condition:
+                    self.stats["bytes"] += num_bytes
+                    if monotonic() < self.discard_until:
+                        # An odd byte is kept, so only whole samples are discarded
+                        keep = num_bytes % 2
+                        self.ring[start] = self.ring[start + num_bytes - 1]
+                        self.write_position += keep
+                        self.stats["discarded"] += num_bytes - keep
+                    else:
+                        self.write_position += num_bytes
+                        self.condition.notify_all()
+        except Exception as err:
+            with self.condition:
+                self.error = err
+                self.condition.notify_all()
+
+
+    # Waits until num_bytes have been received and returns the position of the first byte in the ring buffer
+    def waitForBytes(self, num_bytes):
+        if num_bytes > self.CAPACITY:
+            raise ValueError(f'Can\'t read {num_bytes//2} samples at once from a buffer of {self.CAPACITY//2} samples')
+        with self.condition:
+            if self.write_position - self.read_position < num_bytes:
+                self.stats["stalls"] += 1
+                wait_start = perf_counter()
+                while self.write_position - self.read_position < num_bytes:
+                    if self.error is not None:
+                        raise self.error
+                    if not self.condition.wait(timeout = self.TIMEOUT):
+                        raise TimeoutError(f'No samples from the rtl_tcp server in {self.TIMEOUT} seconds')
+                self.stats["stall_time"] += perf_counter() - wait_start
+            return self.read_position
+
+
+    # Releases bytes that have been read, so the receiver can use their space again
+    def release(self, num_bytes):
+        with self.condition:
+            self.read_position += num_bytes
+            self.condition.notify_all()
+
+
+    # Returns the two parts of num_bytes in the ring buffer from a position, where the second is empty unless the part wraps around
+    def getParts(self, position, num_bytes):
+        start = position % self.CAPACITY
+        first = min(num_bytes, self.CAPACITY - start)
+        return self.ring[start:start + first], self.ring[:num_bytes - first]
+
+
+    # Returns num_samples complex samples. The array is reused by the next read, so it must be copied to be kept
+    # Any number of samples can be read, also more than the ring buffer holds
+    def read_samples(self, num_samples):
+        if self.samples.size < num_samples:
+            self.samples = np.empty(num_samples, dtype = np.complex64)
+        samples = self.samples[:num_samples]
+        for start in range(0, 2*num_samples, self.CHUNK_BYTES):
+            num_bytes = min(self.CHUNK_BYTES, 2*num_samples - start)
+            first, second = self.getParts(self.waitForBytes(num_bytes), num_bytes)
+            chunk = samples[start//2:(start + num_bytes)//2]
+            bytesToIQ(first, out = chunk[:first.size//2])
+            bytesToIQ(second, out = chunk[first.size//2:])
+            self.release(num_bytes)
+        return samples
+
+
+    # Returns num_bytes raw interleaved IQ bytes, which the recorder stores without converting
+    def read_bytes(self, num_bytes):
+        num_bytes -= num_bytes % 2
+        raw = np.empty(num_bytes, dtype = np.uint8)
+        for start in range(0, num_bytes, self.CHUNK_BYTES):
+            chunk_bytes = min(self.CHUNK_BYTES, num_bytes - start)
+            first, second = self.getParts(self.waitForBytes(chunk_bytes), chunk_bytes)
+            raw[start:start + first.size] = first
+            raw[start + first.size:start + chunk_bytes] = second
+            self.release(chunk_bytes)
+        return raw
+
+
+    # Returns the received bytes, the sustained throughput in samples per second,
+    # and how often and how long reads waited for samples
+    def getStats(self):
+        with self.condition:
+            stats = self.stats.copy()
+        stats["elapsed"] = perf_counter() - self.start
+        stats["throughput"] = stats["bytes"]/2/stats["elapsed"]
+        return stats
+
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.receiver.join(timeout = 1.0)
+
+
+# Stand-in rtl_tcp server that streams a device with read_samples, like the simulator or an RTL-SDR
+# Serves one client at a time. Commands are applied to the device between the blocks it streams
+class RtlTcpServer():
+    def __init__(self, sdr, hostname, port, block_size = 2**16):
+        self.sdr = sdr
+        self.BLOCK_SIZE = block_size
+        self.server = socket.create_server((hostname, port))
+        self.ADDRESS = self.server.getsockname()
+        self.running = True
+        self.lock = threading.Lock()
+
+
+    # Serves clients until the server is closed
+    def run_forever(self):
+        while self.running:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                break
+            self.serve(connection)
+
+
+    # Runs the server on a thread and returns it
+    def start(self):
+        thread = threading.Thread(target = self.run_forever, name = "rtl_tcp-server", daemon = True)
+        thread.start()
+        return thread
+
+
+    def serve(self, connection):
+        connected = threading.Event()
+        connected.set()
+        commands = threading.Thread(target = self.handleCommands, args = (connection, connected), name = "rtl_tcp-commands", daemon = True)
+        try:
+            connection.sendall(HEADER.pack(MAGIC, R820T, R820T_GAINS))
+            commands.start()
+            while self.running and connected.is_set():
+                # Devices with raw bytes, like the RTL-SDR, are streamed without converting
+                with self.lock:
+                    if hasattr(self.sdr, "read_bytes"):
+                        raw = np.frombuffer(self.sdr.read_bytes(2*self.BLOCK_SIZE), dtype = np.uint8)
+                    else:
+                        raw = iqToBytes(self.sdr.read_samples(self.BLOCK_SIZE))
+                connection.sendall(raw)
+        except OSError:
+            pass
+        finally:
+            connected.clear()
+            connection.close()
+
+
+    # Applies the commands of a client to the device until it disconnects
+    def handleCommands(self, connection, connected):
+        buffer = b""
+        try:
+            while connected.is_set():
+                data = connection.recv(COMMAND.size)
+                if not data:
+                    break
+                buffer += data
+                while len(buffer) >= COMMAND.size:
+                    command, parameter = COMMAND.unpack(buffer[:COMMAND.size])
+                    buffer = buffer[COMMAND.size:]
+                    with self.lock:
+                        self.applyCommand(command, parameter)
+        except OSError:
+            pass
+        finally:
+            connected.clear()
+
+
+    def applyCommand(self, command, parameter):
+        if command == SET_FREQUENCY:
+            self.sdr.center_freq = parameter
+        elif command == SET_SAMPLE_RATE:
+            self.sdr.sample_rate = parameter
+        elif command == SET_FREQ_CORRECTION:
+            # The parameter is a signed 32-bit number
+            self.sdr.freq_correction = parameter - 2**32 if parameter >= 2**31 else parameter
+        elif command == SET_GAIN_MODE and parameter == 0:
+            self.sdr.gain = 'auto'
+        elif command == SET_GAIN:
+            self.sdr.gain = parameter/10
+
+
+    def close(self):
+        self.running = False
+        # Shutting down wakes the thread waiting for clients
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
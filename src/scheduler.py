@@ -0,0 +1,139 @@
+import os
+import json
+from time import monotonic, sleep
+from datetime import datetime, timedelta
+
+'''
+Scheduler for observations in fixed time slots, like the 24h observations.
+Slot i starts at start_time + i*interval. The start time is tied to the monotonic clock once,
+and every deadline is calculated from it, so waiting doesn't drift and isn't affected by changes to the system clock.
+A new schedule is tied to the monotonic clock when its slots are first asked for, so the time spent calculating the ephemeris
+of the planned times before that doesn't make slot 0 late.
+A prepare callback is called prepare_ahead seconds before each slot, so the next observation can be set up while waiting.
+
+If an observation overruns into the following slots, the overrun policy decides what happens to the slots that have started:
+    "skip":     They're skipped and the schedule continues with the next slot that hasn't started.
+    "compress": They're observed right away, one after another, until the schedule has caught up.
+
+Progress is saved to a state file after each slot. If the survey is interrupted,
+running it again with the same settings before it would have ended resumes it at the right slot.
+'''
+
+OVERRUN_POLICIES = ["skip", "compress"]
+
+class Scheduler():
+    def __init__(self, num_slots, interval, overrun_policy = "skip", prepare_ahead = 0, state_path = ""):
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError(f'Unknown overrun policy "{overrun_policy}". Available policies = {OVERRUN_POLICIES}')
+        self.NUM_SLOTS = num_slots
+        self.INTERVAL = interval
+        self.OVERRUN_POLICY = overrun_policy
+        self.PREPARE_AHEAD = prepare_ahead
+        self.STATE_PATH = state_path
+
+        self.next_slot = 0
+        self.skipped = []
+        # Seconds the current slot started after its deadline
+        self.late = 0
+        self.START_TIME = datetime.utcnow()
+        self.resumed = self.loadState()
+
+        # Monotonic time of the start of slot 0. A resumed schedule keeps its start time, while a new one starts when slots() is first called
+        self.START = monotonic() - (datetime.utcnow() - self.START_TIME).total_seconds()
+        self.anchored = self.resumed
+
+
+    # Returns the planned start time of every slot
+    def getTimes(self):
+        return [self.START_TIME + timedelta(seconds = self.INTERVAL*slot) for slot in range(self.NUM_SLOTS)]
+
+
+    # Monotonic time when a slot starts
+    def deadline(self, slot):
+        return self.START + self.INTERVAL*slot
+
+
+    # Yields the slots to observe, waiting until each one starts
+    # prepare(slot, start_time) is called before waiting for the last prepare_ahead seconds.
+    # start_time is the time the slot will actually start, which is later than planned for compressed slots
+    # A slot is saved as done when the loop asks for the next one, so a slot that raised an error is observed again when resuming
+    def slots(self, prepare = None):
+        if not self.anchored:
+            self.START = monotonic()
+            self.anchored = True
+        while self.next_slot < self.NUM_SLOTS:
+            slot = self.getNextSlot()
+            if slot is None:
+                break
+
+            start = max(self.deadline(slot), monotonic())
+            self.wait(start - self.PREPARE_AHEAD)
+            if prepare is not None:
+                prepare(slot, self.START_TIME + timedelta(seconds = start - self.START))
+            self.wait(start)
+
+            self.late = monotonic() - self.deadline(slot)
+            yield slot
+
+            self.next_slot = slot + 1
+            self.saveState()
+
+
+    # Returns the next slot to observe according to the overrun policy, or None if there are none left
+    def getNextSlot(self):
+        slot = self.next_slot
+        if self.OVERRUN_POLICY == "skip":
+            # A slot that has started can still be observed, as long as the next one hasn't
+            while self.INTERVAL > 0 and slot < self.NUM_SLOTS and monotonic() >= self.deadline(slot + 1):
+                self.skipped.append(slot)
+                slot += 1
+        self.next_slot = slot
+        return slot if slot < self.NUM_SLOTS else None
+
+
+    # Sleeps until a monotonic time. Returns right away if it has passed
+    def wait(self, until):
+        remaining = until - monotonic()
+        while remaining > 0:
+            sleep(remaining)
+            remaining = until - monotonic()
+
+
+    # Loads the state of an unfinished survey with the same slots. Returns whether it was resumed
+    def loadState(self):
+        if not self.STATE_PATH or not os.path.exists(self.STATE_PATH):
+            return False
+        try:
+            with open(self.STATE_PATH, "r") as file:
+                state = json.load(file)
+            start_time = datetime.fromisoformat(state["start_time"])
+            num_slots, interval, next_slot, skipped = state["num_slots"], state["interval"], state["next_slot"], state["skipped"]
+        except (OSError, ValueError, KeyError) as err:
+            print(f'Could not read the schedule state in {self.STATE_PATH} ({err}), starting a new schedule')
+            return False
+
+        end_time = start_time + timedelta(seconds = self.INTERVAL*self.NUM_SLOTS)
+        if num_slots != self.NUM_SLOTS or interval != self.INTERVAL or next_slot >= self.NUM_SLOTS or end_time <= datetime.utcnow():
+            return False
+
+        self.START_TIME = start_time
+        self.next_slot = next_slot
+        self.skipped = skipped
+        return True
+
+
+    # The state is written to a temporary file first, so an interruption can't leave a broken state file
+    def saveState(self):
+        if not self.STATE_PATH:
+            return
+        state = {
+            "start_time": self.START_TIME.isoformat(),
+            "num_slots": self.NUM_SLOTS,
+            "interval": self.INTERVAL,
+            "next_slot": self.next_slot,
+            "skipped": self.skipped
+        }
+        temporary_path = f'{self.STATE_PATH}.tmp'
+        with open(temporary_path, "w") as file:
+            json.dump(state, file, indent = 4)
+        os.replace(temporary_path, self.STATE_PATH)
@@ -0,0 +1,109 @@
+import numpy as np
+
+'''
+Simulated RTL-SDR for running and benchmarking the software without a dongle.
+The IQ samples are generated in the frequency domain, where the power spectrum is shaped by
+a sloped bandpass, a doppler shifted gaussian H-line profile and narrowband RFI, and then transformed to the time domain.
+This is done for whole segments at once, so generation is much faster than the sample rates of the RTL-SDR.
+'''
+
+H_FREQUENCY = 1420405750
+C_SPEED = 299792.458 # km/s
+
+class SimulatedSdr():
+    # Number of samples generated by each inverse FFT
+    SEGMENT_SIZE = 2**16
+
+    def __init__(self, sample_rate = 2400000, center_freq = H_FREQUENCY, **model):
+        self.sample_rate = sample_rate
+        self.center_freq = center_freq
+        self.gain = 'auto'
+        self.freq_correction = 0
+
+        # Model of the received signal
+        self.NOISE_STD = model.get("noise_std", 0.15)                           # Standard deviation of I and Q in the time domain
+        self.BANDPASS_SLOPE = model.get("bandpass_slope", 3.0)                  # Change in dB across the band
+        self.BANDPASS_ROLLOFF = model.get("bandpass_rolloff", 0.85)             # Fraction of the band before the edges roll off
+        self.H_LINE_VELOCITY = model.get("h_line_velocity", -20.0)              # Radial velocity of the H-line in km/s
+        self.H_LINE_WIDTH = model.get("h_line_width", 25.0)                     # Standard deviation of the H-line in km/s
+        self.H_LINE_AMPLITUDE = model.get("h_line_amplitude", 0.1)              # H-line power relative to the noise floor
+        self.RFI = model.get("rfi", [[1420105750, 30.0], [1421205750, 10.0]])   # [frequency in Hz, power relative to one bin of noise]
+        self.DROP_PROBABILITY = model.get("drop_probability", 0.001)            # Probability that a read contains dropped samples
+        self.DROP_LENGTH = model.get("drop_length", 2**16)                      # Number of samples dropped, like a lost USB transfer
+
+        self.rng = np.random.default_rng(model.get("seed", None))
+        self.leftover = np.zeros(0, dtype = np.complex64)
+        self.shapes = {}
+
+
+    # Returns the amplitude of each frequency bin (in FFT order) for the current tuning
+    # Shapes are cached for each sample rate and center frequency
+    def getShape(self):
+        key = (self.sample_rate, self.center_freq)
+        if key in self.shapes:
+            return self.shapes[key]
+
+        offsets = np.fft.fftfreq(self.SEGMENT_SIZE, 1/self.sample_rate)
+        freqs = self.center_freq + offsets
+        relative = offsets/(self.sample_rate/2)
+
+        # Sloped bandpass with roll off at the edges of the band
+        bandpass_dB = self.BANDPASS_SLOPE/2*relative - 20*np.clip(np.abs(relative) - self.BANDPASS_ROLLOFF, 0, None)/(1 - self.BANDPASS_ROLLOFF)
+        bandpass = 10**(bandpass_dB/10)
+
+        # Gaussian H-line at the doppler shifted frequency (radio convention)
+        line_freq = H_FREQUENCY*(1 - self.H_LINE_VELOCITY/C_SPEED)
+        line_width = H_FREQUENCY*self.H_LINE_WIDTH/C_SPEED
+        h_line = self.H_LINE_AMPLITUDE*np.exp(-0.5*((freqs - line_freq)/line_width)**2)
+
+        power = bandpass*(1 + h_line)
+
+        # Narrowband RFI occupies a single bin
+        for rfi_freq, rfi_power in self.RFI:
+            index = int(np.rint((rfi_freq - self.center_freq)/self.sample_rate*self.SEGMENT_SIZE))
+            if -self.SEGMENT_SIZE//2 <= index < self.SEGMENT_SIZE//2:
+                power[index] += rfi_power
+
+        # Scale so the time domain samples have the wanted standard deviation
+        amplitude = np.sqrt(power)
+        amplitude *= self.NOISE_STD*self.SEGMENT_SIZE/np.sqrt(np.sum(power))
+        self.shapes[key] = amplitude.astype(np.float32)
+        return self.shapes[key]
+
+
+    # Generates a number of segments of IQ samples
+    def generate(self, num_segments):
+        amplitude = self.getShape()
+        noise = self.rng.standard_normal((num_segments, 2*self.SEGMENT_SIZE), dtype = np.float32).view(np.complex64)
+        noise *= amplitude
+        samples = np.fft.ifft(noise, axis = 1).astype(np.complex64).ravel()
+
+        # Quantize to 8 bits like the RTL-SDR
+        samples_view = samples.view(np.float32)
+        np.clip(np.floor(samples_view*127.5) + 0.5, -127.5, 127.5, out = samples_view)
+        samples_view /= 127.5
+        return samples
+
+
+    def read_samples(self, num_samples):
+        missing = num_samples - self.leftover.size
+        if missing > 0:
+            num_segments = -(-missing//self.SEGMENT_SIZE)
+            samples = np.concatenate((self.leftover, self.generate(num_segments)))
+        else:
+            samples = self.leftover
+        samples, self.leftover = samples[:num_samples], samples[num_samples:]
+
+        # Dropped samples are read as zeros
+        # Drops start at a multiple of DROP_LENGTH from the start of the read, so with a power of two DROP_LENGTH
+        # at least as large as the FFT's, whole FFT's are zeroed like when the RTL-SDR loses a transfer
+        if self.rng.random() < self.DROP_PROBABILITY:
+            start = self.DROP_LENGTH*self.rng.integers(0, max(1, num_samples//self.DROP_LENGTH))
+            samples = samples.copy()
+            samples[start:start + self.DROP_LENGTH] = 0
+
+        return samples
+
+
+    def close(self):
+        self.shapes = {}
@@ -0,0 +1,245 @@
+import json
+import socket
+import struct
+import threading
+from time import perf_counter
+import numpy as np
+
+from dsp import DSP
+from dynspec import DynamicSpectrum
+from rfi import RFIFlagger
+
+'''
+Spectrum host and client, for running the integration on the device next to the antenna.
+Instead of the raw IQ stream (4.8 MB/s at 2.4 MS/s), only the integrated float32 spectrum and its metadata are sent,
+which is a few kB for every integration.
+Every message is a frame of a 9 byte header (MAGIC, message type and payload length) and a payload.
+The client sends requests, and the host answers every request with one frame:
+    CONFIGURE:  JSON of the sample rate and the DSP section of the config, answered with OK.
+    TUNE:       Center frequency as a big-endian double, answered with OK.
+    INTEGRATE:  JSON of the number of FFT's, the FFT's per row of the dynamic spectrum (0 for none) and if RFI is flagged,
+                answered with SPECTRUM.
+Errors on the host are answered with ERROR and the message, which the client raises.
+A SPECTRUM payload is the length of its JSON metadata, the metadata, and the float32 spectrum,
+followed by the rows, times and FFT counts of the dynamic spectrum if one was requested.
+The host keeps an RFI flagger for each frequency and FFT size, so persistent RFI stays masked between integrations.
+'''
+
+MAGIC = b"HLSP"
+HEADER = struct.Struct(">4sBI")
+LENGTH = struct.Struct(">I")
+FREQUENCY = struct.Struct(">d")
+
+CONFIGURE = 1
+TUNE = 2
+INTEGRATE = 3
+SPECTRUM = 4
+OK = 5
+ERROR = 6
+
+
+# Sends a frame with a message type and payload
+def sendFrame(connection, message_type, payload = b""):
+    connection.sendall(HEADER.pack(MAGIC, message_type, len(payload)) + payload)
+
+
+# Receives a frame and returns its message type and payload
+def receiveFrame(connection):
+    magic, message_type, length = HEADER.unpack(receiveExactly(connection, HEADER.size))
+    if magic != MAGIC:
+        raise ConnectionError("Received a frame that isn't from a spectrum host or client")
+    return message_type, receiveExactly(connection, length)
+
+
+def receiveExactly(connection, num_bytes):
+    data = bytearray(num_bytes)
+    view = memoryview(data)
+    received = 0
+    while received < num_bytes:
+        chunk = connection.recv_into(view[received:])
+        if chunk == 0:
+            raise ConnectionError("The spectrum connection was closed")
+        received += chunk
+    return data
+
+
+# Packs the metadata and arrays of a spectrum
+def packSpectrum(metadata, arrays):
+    encoded = json.dumps(metadata).encode()
+    return LENGTH.pack(len(encoded)) + encoded + b"".join(np.ascontiguousarray(array).tobytes() for array in arrays)
+
+
+# Unpacks the metadata, spectrum and dynamic spectrum rows, times and FFT counts of a spectrum
+def unpackSpectrum(payload):
+    length, = LENGTH.unpack_from(payload)
+    metadata = json.loads(bytes(payload[LENGTH.size:LENGTH.size + length]))
+    fft_size, num_rows = metadata["fft_size"], metadata["rows"]
+    offset = LENGTH.size + length
+    arrays = []
+    for dtype, count in [(np.float32, fft_size), (np.float32, num_rows*fft_size), (np.float64, num_rows), (np.int32, num_rows)]:
+        arrays.append(np.frombuffer(payload, dtype = dtype, count = count, offset = offset))
+        offset += count*np.dtype(dtype).itemsize
+    spectrum, rows, times, counts = arrays
+    return metadata, spectrum, (rows.reshape(num_rows, fft_size), times, counts)
+
+
+class SpectrumClient():
+    def __init__(self, hostname, port, sample_rate = 2400000, timeout = 10.0):
+        self.socket = socket.create_connection((hostname, port), timeout = timeout)
+        # Integrations take as long as they take
+        self.socket.settimeout(None)
+        self.sample_rate = sample_rate
+        self.gain = 'auto'
+        self.freq_correction = 0
+        self._center_freq = 0
+        self.stats = {"bytes": 0, "integrations": 0}
+
+
+    # Sends a request and returns the payload of the answer
+    def request(self, message_type, payload = b""):
+        sendFrame(self.socket, message_type, payload)
+        answer_type, answer = receiveFrame(self.socket)
+        self.stats["bytes"] += HEADER.size + len(answer)
+        if answer_type == ERROR:
+            raise RuntimeError(f'Spectrum host failed with message = {answer.decode()}')
+        return answer
+
+
+    # Sets up the DSP on the host with the DSP section of the config
+    def configure(self, sample_rate, dsp_param):
+        self.sample_rate = sample_rate
+        self.request(CONFIGURE, json.dumps({"sample_rate": sample_rate, "DSP": dsp_param}).encode())
+
+
+    @property
+    def center_freq(self):
+        return self._center_freq
+
+    @center_freq.setter
+    def center_freq(self, freq):
+        self.request(TUNE, FREQUENCY.pack(freq))
+        self._center_freq = freq
+
+
+    # Integrates num_fft FFT's on the host at the current frequency
+    # Returns the metadata, the shifted spectrum in dB and the rows, times and FFT counts of the dynamic spectrum
+    def integrate(self, num_fft, subintegration = 0, rfi_flagging = False):
+        answer = self.request(INTEGRATE, json.dumps({"num_fft": num_fft, "dynamic_spectrum": subintegration, "rfi_flagging": rfi_flagging}).encode())
+        self.stats["integrations"] += 1
+        return unpackSpectrum(answer)
+
+
+    def read_samples(self, num_samples):
+        raise RuntimeError("A spectrum host integrates the spectrums itself and doesn't stream samples")
+
+
+    def close(self):
+        self.socket.close()
+
+
+# Integrates spectrums from a device with read_samples, like the RTL-SDR or the simulator, for a client
+# Serves one client at a time
+class SpectrumServer():
+    def __init__(self, sdr, hostname, port):
+        self.sdr = sdr
+        self.server = socket.create_server((hostname, port))
+        self.ADDRESS = self.server.getsockname()
+        self.running = True
+        self.config = None
+        self.dsps = {}
+        # RFI flaggers for each frequency and FFT size, kept between integrations so persistent RFI stays masked
+        self.rfi_flaggers = {}
+
+
+    # Serves clients until the server is closed
+    def run_forever(self):
+        while self.running:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                break
+            try:
+                self.serve(connection)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                connection.close()
+
+
+    # Runs the server on a thread and returns it
+    def start(self):
+        thread = threading.Thread(target = self.run_forever, name = "spectrum-server", daemon = True)
+        thread.start()
+        return thread
+
+
+    # Answers the requests of a client until it disconnects
+    # Errors from a request are sent to the client, which keeps the connection
+    def serve(self, connection):
+        while self.running:
+            message_type, payload = receiveFrame(connection)
+            try:
+                answer_type, answer = self.handle(message_type, payload)
+            except Exception as err:
+                answer_type, answer = ERROR, f'{type(err).__name__}: {err}'.encode()
+            sendFrame(connection, answer_type, answer)
+
+
+    def handle(self, message_type, payload):
+        if message_type == CONFIGURE:
+            self.config = json.loads(bytes(payload))
+            self.dsps = {}
+            if self.sdr.sample_rate != self.config["sample_rate"]:
+                self.sdr.sample_rate = self.config["sample_rate"]
+            return OK, b""
+        if message_type == TUNE:
+            self.sdr.center_freq, = FREQUENCY.unpack(payload)
+            return OK, b""
+        if message_type == INTEGRATE:
+            if self.config is None:
+                raise ValueError("The DSP must be configured before integrating")
+            return SPECTRUM, self.integrate(**json.loads(bytes(payload)))
+        raise ValueError(f'Unknown message type {message_type}')
+
+
+    # Integrates at the current frequency and returns the packed spectrum
+    def integrate(self, num_fft, dynamic_spectrum, rfi_flagging):
+        dsp_param = self.config["DSP"]
+        if num_fft not in self.dsps:
+            self.dsps[num_fft] = DSP.fromConfig(self.config["sample_rate"], num_fft, **dsp_param)
+        DSP_CLASS = self.dsps[num_fft]
+
+        # The dynamic spectrum only holds this integration, and the flagger only counts it
+        capture = DynamicSpectrum.fromConfig(DSP_CLASS.FFT_SIZE, dynamic_spectrum, dsp_param["dynamic_capacity"], dsp_param["dynamic_dtype"]) if dynamic_spectrum > 0 else None
+        rfi_flagger = None
+        if rfi_flagging:
+            key = (self.sdr.center_freq, DSP_CLASS.FFT_SIZE)
+            if key not in self.rfi_flaggers:
+                self.rfi_flaggers[key] = RFIFlagger(threshold = dsp_param["rfi_threshold"], persistent = dsp_param["rfi_persistent"])
+            rfi_flagger = self.rfi_flaggers[key]
+            rfi_flagger.resetStats()
+
+        start = perf_counter()
+        spectrum = DSP_CLASS.sample(self.sdr, capture, rfi_flagger)
+        rows, times, counts = capture.getData() if capture is not None else (np.zeros((0, DSP_CLASS.FFT_SIZE)), np.zeros(0), np.zeros(0))
+
+        metadata = {
+            "center_freq": self.sdr.center_freq,
+            "fft_size": DSP_CLASS.FFT_SIZE,
+            "num_fft": num_fft,
+            "elapsed": perf_counter() - start,
+            "rows": len(rows),
+            "stats": DSP_CLASS.stats,
+            "rfi": {name: int(count) for name, count in rfi_flagger.stats.items()} if rfi_flagger is not None else None
+        }
+        return packSpectrum(metadata, [spectrum.astype(np.float32), rows.astype(np.float32), times.astype(np.float64), counts.astype(np.int32)])
+
+
+    def close(self):
+        self.running = False
+        # Shutting down wakes the thread waiting for clients
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
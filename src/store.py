@@ -0,0 +1,100 @@
+import os
+import json
+import struct
+import numpy as np
+
+'''
+Append-only binary store for observations.
+All observations of a survey are appended to one file. Each record is a small header followed by the raw arrays:
+
+    b"HLOB" | header length (uint64) | JSON header | padding | arrays
+
+The JSON header holds the observation parameters and results and, for each array, its dtype, shape and offset.
+Records are never rewritten, so earlier observations are kept and a crash can at most leave an incomplete last record,
+which is ignored when reading and removed by the next append. Arrays are read back as memory maps, so reading a single record only touches that record.
+'''
+
+MAGIC = b"HLOB"
+PREFIX = struct.Struct("<4sQ")
+# Arrays start at a multiple of this
+ALIGNMENT = 16
+
+class ObservationStore():
+    def __init__(self, path):
+        self.PATH = path
+        self.index = []
+        self.indexed_size = 0
+
+
+    # Appends an observation. Arrays are taken from the "Data" section, everything else is stored in the header
+    def append(self, content):
+        header = {key: value for key, value in content.items() if key != "Data"}
+        header["Arrays"] = {}
+
+        arrays = {name: np.ascontiguousarray(array) for name, array in content["Data"].items()}
+        offset = 0
+        for name, array in arrays.items():
+            header["Arrays"][name] = {"dtype": array.dtype.str, "shape": array.shape, "offset": offset}
+            offset += -(-array.nbytes//ALIGNMENT)*ALIGNMENT
+        header["Data size"] = offset
+
+        header_bytes = json.dumps(header, default = lambda value: value.tolist()).encode()
+        header_bytes += b" "*(-(PREFIX.size + len(header_bytes)) % ALIGNMENT)
+
+        # Remove an incomplete record left by an interrupted write before appending
+        self.getIndex()
+        if os.path.exists(self.PATH) and os.path.getsize(self.PATH) > self.indexed_size:
+            os.truncate(self.PATH, self.indexed_size)
+
+        with open(self.PATH, "ab") as file:
+            file.write(PREFIX.pack(MAGIC, len(header_bytes)))
+            file.write(header_bytes)
+            for name, array in arrays.items():
+                file.write(array.tobytes())
+                file.write(b"\0"*(-array.nbytes % ALIGNMENT))
+
+
+    # Returns the headers of all complete records. Only the headers are read from the file
+    def getIndex(self):
+        if not os.path.exists(self.PATH):
+            return []
+
+        file_size = os.path.getsize(self.PATH)
+        if file_size == self.indexed_size:
+            return self.index
+
+        with open(self.PATH, "rb") as file:
+            position = self.indexed_size
+            while position + PREFIX.size <= file_size:
+                file.seek(position)
+                magic, header_length = PREFIX.unpack(file.read(PREFIX.size))
+                if magic != MAGIC:
+                    raise ValueError(f'{self.PATH} is corrupt at byte {position}')
+                data_offset = position + PREFIX.size + header_length
+
+                # Incomplete record from an interrupted write
+                if data_offset > file_size:
+                    break
+                header = json.loads(file.read(header_length))
+                if data_offset + header["Data size"] > file_size:
+                    break
+                header["Data offset"] = data_offset
+                self.index.append(header)
+                position = data_offset + header["Data size"]
+            self.indexed_size = position
+
+        return self.index
+
+
+    def __len__(self):
+        return len(self.getIndex())
+
+
+    # Reads a record back into the same fields as the datafile. The arrays are memory mapped
+    def read(self, record):
+        header = self.getIndex()[record]
+        content = {key: value for key, value in header.items() if key not in ["Arrays", "Data size", "Data offset"]}
+        content["Data"] = {}
+        for name, array in header["Arrays"].items():
+            content["Data"][name] = np.memmap(self.PATH, dtype = np.dtype(array["dtype"]), mode = 'r', offset = header["Data offset"] + array["offset"], shape = tuple(array["shape"]))
+        return content
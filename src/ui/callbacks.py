@@ -13,29 +13,69 @@ parameters = {
         "PPM_offset": 0,
         "TCP_host": False,
         "connect_to_host": False,
-        "host_IP": "127.0.0.1"
+        "host_IP": "127.0.0.1",
+        "host_port": 5050,
+        "host_mode": "rtl_tcp",
+        "receivers": [],
+        "receiver_mode": "combine",
+        "record_path": "",
+        "replay_path": "",
+        "simulate": False
     },
     "DSP": {
         "number_of_fft": 1000,
+        "adaptive": "",
+        "adaptive_check": 10,
+        "adaptive_max_time": 600,
+        "checkpoint_path": "",
         "resolution": 11,
-        "median": 5
+        "estimator": "fft",
+        "zoom_span": 0,
+        "zoom_center": 0,
+        "median": 5,
+        "baseline": "poly:1",
+        "baseline_window": 150,
+        "batch_size": 100,
+        "threads": 0,
+        "processes": 0,
+        "ring_slots": 8,
+        "dynamic_spectrum": 0,
+        "dynamic_capacity": 1024,
+        "dynamic_dtype": "float32",
+        "rfi_flagging": False,
+        "rfi_threshold": 4.0,
+        "rfi_persistent": 0.5
     },
     "observer": {
         "latitude": 0.0,
         "longitude": 0.0,
         "azimuth": 0.0,
         "altitude": 0.0,
-        "elevation": 0.0
+        "elevation": 0.0,
+        "iers_cache": ""
     },
     "plotting":{
         "plot_map": True,
         "y_min": 0.0,
-        "y_max": 0.0
+        "y_max": 0.0,
+        "reuse_figure": True,
+        "animation": "gif"
     },
     "observation": {
         "24h": False,
         "degree_interval": 5.0,
-        "datafile": False
+        "datafile": False,
+        "datafile_format": "binary",
+        "survey_file": "Spectrums/survey.hlobs",
+        "switching_cycles": 1,
+        "reference_max_age": 0,
+        "reference_max_drift": 0.5,
+        "background_output": False,
+        "output_workers": 1,
+        "max_pending_output": 4,
+        "overrun_policy": "skip",
+        "prepare_ahead": 10,
+        "state_file": "Spectrums/schedule.json"
     }
 }
 
@@ -54,7 +94,10 @@ def read_from_config():
         # Iterrate over each key in category (SDR, DSP, etc.)
         for category in categories:
             for key, value in parsed_config[category].items():
-                dpg.set_value(key, value)
+                # Not all parameters have a widget in the UI
+                if dpg.does_item_exist(key):
+                    # Text fields only accept strings, fx. the median filter
+                    dpg.set_value(key, str(value) if isinstance(dpg.get_value(key), str) else value)
                 parameters[category][key] = value
 
 # Callback functions
@@ -69,6 +112,9 @@ def btn_callback(sender, app_data, user_data):
     elif sender == "run_observation":
         update_config()
         os.system('py H-line.py' if os.name =='nt' else 'python3 H-line.py')
+    elif sender == "live_view":
+        from src.ui import live
+        live.openLiveView(parameters)
     elif sender == "edit_theme":
         dpg.show_style_editor()
     elif sender == "open_obs_folder":
@@ -0,0 +1,171 @@
+import threading
+import numpy as np
+import dearpygui.dearpygui as dpg
+
+from dsp import DSP
+from observation import Observation
+
+'''
+Live spectrum and waterfall for locating the H-line.
+A processing thread reads from the SDR, averages the spectrums with an exponential average and
+reduces them to the width of the display. The GUI thread only copies the newest display data into the plot
+and the waterfall texture, so the interface stays responsive however fast the SDR delivers samples.
+The waterfall is stored twice in a buffer of double height, so the scrolled image is always a contiguous slice and is never rolled.
+'''
+
+# Number of points in the spectrum and columns in the waterfall
+DISPLAY_WIDTH = 512
+# Number of rows in the waterfall
+WATERFALL_HEIGHT = 200
+# Spectrums per second, which is also the scroll rate of the waterfall
+UPDATE_RATE = 20
+
+# Running live view, if any
+LIVE_VIEW = None
+
+class LiveSpectrum():
+    def __init__(self, sdr, sample_rate, resolution, averaging = 0.2):
+        self.SDR = sdr
+        self.DSP = DSP(resolution = resolution, num_fft = 1, median = 0, batch_size = 1, threads = 0, ring_slots = 1, baseline = "poly:1", baseline_window = 150)
+        # Fraction of each new spectrum in the average
+        self.averaging = averaging
+        # Number of FFT's read for each update
+        self.NUM_FFT = max(1, int(sample_rate/UPDATE_RATE)//self.DSP.FFT_SIZE)
+        self.DECIMATION = max(1, self.DSP.FFT_SIZE//DISPLAY_WIDTH)
+        self.WIDTH = self.DSP.FFT_SIZE//self.DECIMATION
+
+        freqs = self.DSP.generateFreqs(sample_rate)
+        self.freqs = list(freqs[:self.WIDTH*self.DECIMATION].reshape(self.WIDTH, self.DECIMATION).mean(axis = 1)/1e6)
+        self.average = None
+        self.spectrum = np.zeros(self.WIDTH)
+        self.waterfall = np.zeros((2*WATERFALL_HEIGHT, self.WIDTH), dtype = np.float32)
+        self.row = 0
+        self.version = 0
+        # Version last shown by the GUI
+        self.shown_version = 0
+
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.thread = None
+        self.error = None
+
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target = self.processLoop, name = "live-spectrum", daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+        self.SDR.close()
+
+
+    def processLoop(self):
+        try:
+            while self.running.is_set():
+                self.processUpdate()
+        except Exception as err:
+            self.error = err
+            print(f'Type = {type(err)} occured with message = {err}')
+
+
+    # Reads and processes the samples of one update
+    def processUpdate(self):
+        samples = self.SDR.read_samples(self.NUM_FFT*self.DSP.FFT_SIZE)
+        log_sum, counts = self.DSP.processBatch(samples)
+        self.addSpectrum(np.fft.fftshift(log_sum/np.maximum(counts, 1)))
+
+
+    # Updates the exponential average with a new spectrum in dB and publishes the decimated result
+    def addSpectrum(self, spectrum):
+        if self.average is None:
+            self.average = spectrum
+        else:
+            self.average += self.averaging*(spectrum - self.average)
+        display = self.average[:self.WIDTH*self.DECIMATION].reshape(self.WIDTH, self.DECIMATION).mean(axis = 1)
+
+        with self.lock:
+            self.spectrum = display
+            # Rows are written upwards and twice, so rows [row, row + WATERFALL_HEIGHT) hold the waterfall with the newest row first
+            self.row = (self.row - 1) % WATERFALL_HEIGHT
+            self.waterfall[self.row] = display
+            self.waterfall[self.row + WATERFALL_HEIGHT] = display
+            self.version += 1
+
+
+    # Returns the newest spectrum and waterfall (newest row first), or None if nothing changed since the given version
+    def getDisplay(self, version):
+        with self.lock:
+            if self.version == version:
+                return None
+            return self.version, self.spectrum, self.waterfall[self.row:self.row + WATERFALL_HEIGHT].copy()
+
+
+# RGBA colors of the waterfall from dark blue through green to yellow, looked up for values between 0 and 1
+COLORMAP_STOPS = np.array([[0.0, 0.0, 0.2], [0.0, 0.4, 0.8], [0.0, 0.8, 0.4], [1.0, 1.0, 0.0]])
+COLORMAP = np.ones((256, 4), dtype = np.float32)
+for channel in range(3):
+    COLORMAP[:, channel] = np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(COLORMAP_STOPS)), COLORMAP_STOPS[:, channel])
+
+def colormap(values):
+    return COLORMAP[(np.clip(values, 0, 1)*255).astype(np.uint8)]
+
+
+# Opens the live view window and starts reading from the SDR set in the parameters
+def openLiveView(parameters):
+    global LIVE_VIEW
+    if LIVE_VIEW is not None:
+        return
+
+    observation = Observation(**parameters["observation"])
+    sdr = observation.getSDR(**parameters["SDR"])
+    sdr.center_freq = observation.H_LINE_FREQ
+    LIVE_VIEW = LiveSpectrum(sdr, parameters["SDR"]["sample_rate"], parameters["DSP"]["resolution"])
+    width = LIVE_VIEW.WIDTH
+
+    # Make room for the live view next to the parameter windows
+    dpg.set_viewport_width(max(dpg.get_viewport_width(), 1310))
+    dpg.set_viewport_height(max(dpg.get_viewport_height(), 610))
+
+    with dpg.texture_registry():
+        dpg.add_dynamic_texture(width, WATERFALL_HEIGHT, [0.0]*(width*WATERFALL_HEIGHT*4), tag = "live_waterfall")
+
+    with dpg.window(label = "Live view", tag = "live_window", width = 640, height = 560, pos = (650, 10), on_close = closeLiveView):
+        dpg.add_slider_float(label = "Averaging", tag = "live_averaging", default_value = LIVE_VIEW.averaging, min_value = 0.01, max_value = 1.0, callback = lambda sender, app_data: setattr(LIVE_VIEW, "averaging", app_data))
+        with dpg.plot(label = "Live spectrum", height = 280, width = -1):
+            dpg.add_plot_axis(dpg.mvXAxis, label = "Frequency / MHz")
+            with dpg.plot_axis(dpg.mvYAxis, label = "Power / dB", tag = "live_y_axis"):
+                dpg.add_line_series(LIVE_VIEW.freqs, [0.0]*width, tag = "live_series")
+        dpg.add_image("live_waterfall", width = 620, height = WATERFALL_HEIGHT)
+
+    LIVE_VIEW.start()
+
+
+def closeLiveView():
+    global LIVE_VIEW
+    if LIVE_VIEW is None:
+        return
+    LIVE_VIEW.stop()
+    LIVE_VIEW = None
+    dpg.delete_item("live_window")
+    dpg.delete_item("live_waterfall")
+
+
+# Copies the newest data to the plot and waterfall. Called by the GUI thread before each frame
+def update():
+    if LIVE_VIEW is None:
+        return
+    display = LIVE_VIEW.getDisplay(LIVE_VIEW.shown_version)
+    if display is None:
+        return
+    LIVE_VIEW.shown_version, spectrum, waterfall = display
+
+    dpg.set_value("live_series", [LIVE_VIEW.freqs, list(spectrum)])
+    dpg.fit_axis_data("live_y_axis")
+
+    # The waterfall colors span the range of the newest spectrum
+    low, high = np.min(spectrum), np.max(spectrum)
+    dpg.set_value("live_waterfall", colormap((waterfall - low)/max(high - low, 1e-6)).ravel())
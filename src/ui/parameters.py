@@ -55,12 +55,14 @@ def sdrWindow():
             dpg.add_text("(help)",tag="DSP_category")
 
         dpg.add_input_int(label="FFT number",user_data="DSP",default_value=1000,tag="number_of_fft",callback=callbacks.text_callback)
-        dpg.add_input_int(label="Median",user_data="DSP",default_value=5,tag="median",callback=callbacks.text_callback)
+        dpg.add_input_text(label="Median",user_data="DSP",default_value="5",tag="median",callback=callbacks.text_callback)
 
         with dpg.tooltip("DSP_category"):
             help_msg = '''
             FFT number = Number of FFT's to receive and average.
             Median = Number of samples to include in median smoothing.
+            Other filters are selected with kernel:width, fx. boxcar:9.
+            Kernels = median, boxcar, savgol and hanning.
             '''
             dpg.add_text(textwrap.dedent(help_msg))
 
@@ -135,14 +137,14 @@ def actionsWindow():
             dpg.add_text("Perform actions")
             dpg.add_text("(help)", tag="action_category")
         
-        # dpg.add_button(label="Live view",tag="live_view",callback=callbacks.btn_callback)
+        dpg.add_button(label="Live view",tag="live_view",callback=callbacks.btn_callback)
         dpg.add_button(label="Edit theme",tag="edit_theme",callback=callbacks.btn_callback)
         dpg.add_button(label="Browse observations",tag="open_obs_folder",callback=callbacks.btn_callback)
         dpg.add_button(label="Update parameters from config",tag="update_parameters",callback=callbacks.btn_callback)
 
         with dpg.tooltip("action_category"):
-            # Live view = Open a live spectrum for locating the H-line.
             help_msg = '''
+            Live view = Open a live spectrum and waterfall for locating the H-line.
             Edit theme = Edit the look and appearance of the user interface.
             Browse observations = Browse the folder with previous observations.
             Update parameters from config = Updates the UI with the parameters from the config file.
@@ -5,6 +5,11 @@ import dearpygui.dearpygui as dpg
 sys.path.append("src/")
 from src.ui import parameters
 
+# The live view is imported by its button when it's first opened, so it doesn't slow down starting the UI
+# Returns the live view module, or None if it hasn't been opened
+def liveView():
+    return sys.modules.get("src.ui.live")
+
 # Run user intereface
 def run_ui():
     dpg.create_context()
@@ -18,7 +23,15 @@ def run_ui():
 
     dpg.setup_dearpygui()
     dpg.show_viewport()
-    dpg.start_dearpygui()
+
+    # Frames are rendered manually, so the live view can be updated before each frame
+    while dpg.is_dearpygui_running():
+        if liveView() is not None:
+            liveView().update()
+        dpg.render_dearpygui_frame()
+
+    if liveView() is not None:
+        liveView().closeLiveView()
     dpg.destroy_context()
 
 if __name__ == "__main__":